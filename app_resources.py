@@ -0,0 +1,48 @@
+import os
+import uuid
+import streamlit as st
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from pymongo.server_api import ServerApi
+
+from catalog import Catalog
+from query_stats import QueryCounter
+
+# Load environment variables (MongoDB URI)
+load_dotenv()
+MONGO_URI = os.getenv("MONGO_URI")
+CATALOG_REFRESH = 60  # Seconds between reads of what changed in MongoDB
+
+
+# Connect to MongoDB once per server process; every page, rerun and session shares the client's connection pool
+@st.cache_resource
+def init_connection():
+    query_counter = QueryCounter()
+    return MongoClient(MONGO_URI, server_api=ServerApi('1'), event_listeners=[query_counter]), query_counter
+
+
+# One in-memory copy of the filterable fields, shared by the Search and Match pages
+@st.cache_resource
+def load_catalog():
+    client, _ = init_connection()
+    return Catalog.load(client["scholarship_db"]["scholarships"])
+
+
+def current_catalog():
+    """The shared catalog, after reading what changed if that was last done over CATALOG_REFRESH seconds ago."""
+    client, _ = init_connection()
+    catalog = load_catalog()
+    catalog.refresh_if_older(client["scholarship_db"]["scholarships"], CATALOG_REFRESH)
+    return catalog
+
+
+def current_user_id():
+    """The id of this session's user.
+
+    There is no sign-in yet: a user is an id kept in the page URL, so a reload
+    or bookmark finds the same lists and profile.
+    """
+    if 'user_id' not in st.session_state:
+        st.session_state.user_id = st.query_params.get("user") or uuid.uuid4().hex
+    st.query_params["user"] = st.session_state.user_id
+    return st.session_state.user_id
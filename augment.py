@@ -1,12 +1,27 @@
+import argparse
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pymongo import UpdateOne
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
+from bson import json_util
 from dotenv import load_dotenv
 import os
+import openai
 from openai import OpenAI
+from functools import lru_cache
 from tqdm import tqdm
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, create_model
 from typing import Optional
 
+from augment_cache import DEFAULT_MAX_ENTRIES, AugmentCache, cache_key
+from indexes import ensure_indexes
+from normalize import summarize
+from preextract import preextract
+from profile_matches import refresh_stored_matches
+from throttle import RateLimiter, backoff_delay
+
 # Load environment variables
 load_dotenv()
 
@@ -16,11 +31,49 @@ client = MongoClient(MONGO_URI, server_api=ServerApi('1'))
 db = client['scholarship_db']
 scholarships = db['scholarships']
 
-# Set up OpenAI API
-openai_client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+# Set up OpenAI API (retries are handled by augment_document so they share our backoff and rate limits)
+openai_client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'), max_retries=0)
+
+MODEL = "gpt-4o-2024-08-06"  # Use the appropriate model that supports structured outputs
+
+DEFAULT_CONCURRENCY = 8             # Requests in flight at once
+DEFAULT_REQUESTS_PER_MINUTE = 500
+DEFAULT_TOKENS_PER_MINUTE = 200_000
+DEFAULT_RETRIES = 5
+DEFAULT_BATCH_SIZE = 100            # Augmented documents written per bulk_write
+DEFAULT_PAGE_SIZE = 1000            # Pending documents read per query
+DEFAULT_PACK_SIZE = 1               # Descriptions sent per request (1 disables packing)
+DEFAULT_PACK_TOKENS = 6_000         # Estimated prompt and response tokens allowed in one packed request
+RESPONSE_TOKENS = 300               # Rough size of one structured response
+CHECKPOINT_PATH = 'augment_checkpoint.json'
+
+SYSTEM_PROMPT = "You are a helpful assistant that extracts scholarship information."
+PROMPT_TEMPLATE = """
+    Given the following scholarship description, please extract or infer the required information:
+
+    Description: {description}
+
+    Provide the information in a structured format following the specified schema.
+    If a field is not applicable or the information is not provided, use null for optional fields.
+    """
+PACK_PROMPT_TEMPLATE = """
+    Given the following scholarship descriptions, please extract or infer the required information for each one:
+
+{documents}
+
+    Provide one entry per document in a structured format following the specified schema,
+    with doc_index set to the number of the document it describes.
+    If a field is not applicable or the information is not provided, use null for optional fields.
+    """
+PACK_DOCUMENT_TEMPLATE = """    Document {index}:
+    Description: {description}
+"""
+
+
+# Define the structured output model (bump SCHEMA_VERSION whenever its fields change)
+SCHEMA_VERSION = 1
 
 
-# Define the structured output model
 class AugmentedScholarship(BaseModel):
     title: str
     is_merit_based: bool
@@ -41,52 +94,442 @@ class AugmentedScholarship(BaseModel):
     low_income: bool
     first_generation: bool
 
-def augment_document(doc):
-    if "name" in doc:
-        return doc
 
-    prompt = f"""
-    Given the following scholarship description, please extract or infer the required information:
+@lru_cache(maxsize=None)
+def remaining_model(resolved: frozenset):
+    """AugmentedScholarship without the `resolved` fields, so the model is only asked for the rest."""
+    if not resolved:
+        return AugmentedScholarship
+    fields = {name: (field.annotation, field) for name, field in AugmentedScholarship.model_fields.items()
+              if name not in resolved}
+    return create_model('RemainingScholarshipFields', **fields)
 
-    Description: {doc['description']}
 
-    Provide the information in a structured format following the specified schema.
-    If a field is not applicable or the information is not provided, use null for optional fields.
+@lru_cache(maxsize=None)
+def packed_model(resolved: frozenset):
+    """A list of remaining_model(resolved) entries, each tagged with the document it answers."""
+    entry = create_model('PackedScholarship', __base__=remaining_model(resolved),
+                         doc_index=(int, Field(description="Number of the document this entry describes")))
+    return create_model('PackedScholarships', scholarships=(list[entry], ...))
+
+
+class RequestLimits:
+    """Request and token rate limits shared by every augmentation thread."""
+
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE):
+        self.__requests = RateLimiter(requests_per_minute / 60)
+        self.__tokens = RateLimiter(tokens_per_minute / 60)
+
+    def wait(self, prompt: str, response_tokens: float = RESPONSE_TOKENS) -> None:
+        self.__requests.wait()
+        # About four characters per token, plus the response
+        self.__tokens.wait(len(prompt) / 4 + response_tokens)
+
+
+class Checkpoint:
+    """Remembers the _id up to which every pending document has been augmented and saved.
+
+    A checkpoint written for another SCHEMA_VERSION is ignored.
+    """
+
+    def __init__(self, path: str = CHECKPOINT_PATH):
+        self.__path = path
+
+    def load(self):
+        if not os.path.exists(self.__path):
+            return None
+        with open(self.__path, 'r') as file:
+            state = json_util.loads(file.read())
+        return state["last_id"] if state.get("schema_version") == SCHEMA_VERSION else None
+
+    def save(self, last_id) -> None:
+        # Write to a temporary file first so a crash never leaves a half-written checkpoint
+        with open(self.__path + '.tmp', 'w') as file:
+            file.write(json_util.dumps({"last_id": last_id, "schema_version": SCHEMA_VERSION}))
+        os.replace(self.__path + '.tmp', self.__path)
+
+    def clear(self) -> None:
+        if os.path.exists(self.__path):
+            os.remove(self.__path)
+
+
+def pending_query(after_id=None) -> dict:
+    """Documents never augmented, or augmented under an older schema, optionally after `after_id`.
+
+    Older versions are a range rather than a $ne, so the augmentation_version_id
+    index (indexes.py) bounds the scan to pending documents.
     """
+    query = {"$or": [{"augmentation_version": None}, {"augmentation_version": {"$lt": SCHEMA_VERSION}}]}
+    if after_id is not None:
+        query["_id"] = {"$gt": after_id}
+    return query
+
+
+def find_pending(collection=scholarships, after_id=None, page_size=DEFAULT_PAGE_SIZE):
+    """Stream pending documents in _id order, fetching only what augmentation needs.
+
+    Documents are read `page_size` at a time, each page a short query of its
+    own, so no cursor sits idle on the server (and times out) while the model
+    works through a page.
+    """
+    while True:
+        page = list(collection.find(pending_query(after_id), {"_id": 1, "description": 1})
+                    .sort("_id", 1).limit(page_size))
+        yield from page
+        if len(page) < page_size:
+            return
+        after_id = page[-1]["_id"]
+
+
+def is_retryable(error) -> bool:
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def retry_after(error):
+    response = getattr(error, 'response', None)
+    value = response.headers.get('retry-after') if response is not None else None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def build_messages(description: str) -> list:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": PROMPT_TEMPLATE.format(description=description)}
+    ]
+
 
-    response = openai_client.beta.chat.completions.parse(
-        model="gpt-4o-2024-08-06",  # Use the appropriate model that supports structured outputs
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant that extracts scholarship information."},
-            {"role": "user", "content": prompt}
-        ],
-        response_format=AugmentedScholarship
-    )
+def build_pack_messages(descriptions: list) -> list:
+    documents = "\n".join(PACK_DOCUMENT_TEMPLATE.format(index=index, description=description)
+                          for index, description in enumerate(descriptions, start=1))
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": PACK_PROMPT_TEMPLATE.format(documents=documents)}
+    ]
+
+
+def estimate_tokens(description: str) -> float:
+    """Rough prompt and response tokens one description adds to a request."""
+    return len(description) / 4 + RESPONSE_TOKENS
+
+
+def request_completion(llm, limits, messages, response_format, response_tokens, retries=DEFAULT_RETRIES):
+    """One structured-output request, retried with backoff; returns the parsed model."""
+    llm = llm or openai_client
+    for attempt in range(retries + 1):
+        if limits:
+            limits.wait(messages[-1]["content"], response_tokens)
+        try:
+            response = llm.beta.chat.completions.parse(
+                model=MODEL,
+                messages=messages,
+                response_format=response_format
+            )
+            break
+        except Exception as e:
+            # Back off on rate limits (429) and server errors (5xx), honouring Retry-After
+            if attempt == retries or not is_retryable(e):
+                raise
+            time.sleep(retry_after(e) or backoff_delay(attempt))
 
     result = response.choices[0].message
-    parsed = result.parsed
+    if result.parsed is None:
+        raise ValueError(f"no structured answer: {result.refusal or 'empty response'}")
+    return result.parsed
+
+
+def prepare_document(doc, cache=None, rules=True):
+    """Fill what is known without a request; returns the fields still to ask for and their cache key.
+
+    Fields stated outright in the description are filled by preextract, and
+    byte-identical descriptions get a stored answer from the cache. When
+    nothing is left to ask, the fields returned are empty.
+    """
+    known = preextract(doc['description']) if rules else {}
+    doc.update(known)
+    doc['rule_fields'] = sorted(known)
+    resolved = frozenset(known)
+    if not remaining_model(resolved).model_fields:
+        return resolved, None
+
+    # Packed and single requests share cache entries: the answer for a description is the same
+    key = cache_key(doc['description'], PROMPT_TEMPLATE, MODEL, SCHEMA_VERSION, *sorted(known))
+    cached = cache.get(key) if cache else None
+    if cached is not None:
+        doc.update(cached)
+        return frozenset(AugmentedScholarship.model_fields), None
+    return resolved, key
+
+
+def response_tokens_for(resolved: frozenset) -> float:
+    return RESPONSE_TOKENS * len(remaining_model(resolved).model_fields) / len(AugmentedScholarship.model_fields)
+
+
+def augment_document(doc, llm=None, limits=None, retries=DEFAULT_RETRIES, cache=None, rules=True):
+    resolved, key = prepare_document(doc, cache, rules)
+    return complete_document(doc, resolved, key, llm, limits, retries, cache)
+
+
+def complete_document(doc, resolved, key, llm=None, limits=None, retries=DEFAULT_RETRIES, cache=None):
+    """Ask the model for the fields of `doc` not in `resolved`, as prepared by prepare_document."""
+    response_format = remaining_model(resolved)
+    if not response_format.model_fields:
+        return doc
+
+    messages = build_messages(doc['description'])
+    parsed = request_completion(llm, limits, messages, response_format, response_tokens_for(resolved),
+                                retries).model_dump()
+    if cache:
+        cache.put(key, parsed)
 
     # Merge the augmented data with the original document
     doc.update(parsed)
     return doc
 
 
+def augment_pack(docs, llm=None, limits=None, retries=DEFAULT_RETRIES, cache=None, rules=True) -> list:
+    """Augment several documents with one request per group needing the same fields.
+
+    When a packed answer does not validate or does not hold exactly one entry
+    per document, each document of that group is requested on its own instead.
+    Returns, in the order of `docs`, each augmented document or the exception
+    that prevented augmenting it.
+    """
+    results = list(docs)
+    groups = {}  # fields already resolved -> [(position, doc, cache key)]
+    for position, doc in enumerate(docs):
+        resolved, key = prepare_document(doc, cache, rules)
+        if remaining_model(resolved).model_fields:
+            groups.setdefault(resolved, []).append((position, doc, key))
+
+    for resolved, group in groups.items():
+        if len(group) > 1:
+            messages = build_pack_messages([doc['description'] for _, doc, _ in group])
+            try:
+                answers = request_completion(llm, limits, messages, packed_model(resolved),
+                                             response_tokens_for(resolved) * len(group), retries).scholarships
+                by_index = {answer.doc_index: answer for answer in answers}
+                if len(answers) == len(group) and sorted(by_index) == list(range(1, len(group) + 1)):
+                    for index, (_, doc, key) in enumerate(group, start=1):
+                        parsed = by_index[index].model_dump(exclude={'doc_index'})
+                        if cache:
+                            cache.put(key, parsed)
+                        doc.update(parsed)
+                    continue
+            except (ValueError, openai.LengthFinishReasonError, openai.ContentFilterFinishReasonError):
+                pass  # ValueError covers pydantic's ValidationError
+        # A single document, or a packed answer that could not be matched up
+        for position, doc, key in group:
+            try:
+                results[position] = complete_document(doc, resolved, key, llm, limits, retries, cache)
+            except Exception as e:
+                results[position] = e
+    return results
+
+
+def augmentation_update(doc_id, augmented: dict) -> UpdateOne:
+    """The write that stores augmented fields on a document and stamps it with SCHEMA_VERSION.
+
+    When the description is at hand, its summary for result cards is stored too.
+    rule_fields lists the fields preextract filled rather than the model.
+    """
+    fields = {field: augmented[field] for field in AugmentedScholarship.model_fields}
+    if "description" in augmented:
+        fields["summary"] = summarize(augmented["description"])
+    fields["rule_fields"] = augmented.get("rule_fields", [])
+    fields["augmentation_version"] = SCHEMA_VERSION
+    return UpdateOne({"_id": doc_id}, {"$set": fields, "$currentDate": {"updated_at": True}})
+
+
+def augment_all(docs, collection=scholarships, llm=None, concurrency=DEFAULT_CONCURRENCY, limits=None,
+                batch_size=DEFAULT_BATCH_SIZE, progress=True, cache=None, checkpoint=None, rules=True,
+                pack_size=DEFAULT_PACK_SIZE, pack_tokens=DEFAULT_PACK_TOKENS):
+    """Augment `docs` with up to `concurrency` requests in flight, writing results in bulk.
+
+    Documents are pulled from the iterable only as request slots free up, so a
+    cursor can be passed without loading the collection into memory. With an
+    AugmentCache, previously seen descriptions are answered from the cache, and
+    a description already in flight is never requested a second time. With
+    `rules`, fields the description states outright are filled by preextract
+    and left out of the request. With a `pack_size` above 1, up to that many
+    descriptions (and no more than an estimated `pack_tokens`) share one
+    request through augment_pack. Every augmented document is stamped with
+    SCHEMA_VERSION.
+
+    With a Checkpoint, `docs` must be in _id order; after each bulk write the
+    checkpoint moves to the last _id below which every document is finished.
+    Returns the number of documents augmented and the number that failed.
+    """
+    limits = limits or RequestLimits()
+    updates = []
+    augmented = failed = 0
+    submitted = deque()  # _ids in submission order, for the checkpoint
+    finished = set()
+
+    def flush():
+        if updates:
+            collection.bulk_write(updates, ordered=False)
+            updates.clear()
+        if checkpoint:
+            last_id = None
+            while submitted and submitted[0] in finished:
+                last_id = submitted.popleft()
+                finished.discard(last_id)
+            if last_id is not None:
+                checkpoint.save(last_id)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor, \
+            tqdm(desc="Processing scholarships", disable=not progress) as progress_bar:
+        pending = {}
+        in_flight = {}  # description -> future of the request already made for it
+        pack = []       # (doc, future) waiting to be sent together
+        pack_estimate = 0.0
+
+        def send_pack():
+            nonlocal pack_estimate
+            if not pack:
+                return
+            docs_in_pack, futures = zip(*pack)
+            pack.clear()
+            pack_estimate = 0.0
+            request = executor.submit(augment_pack, list(docs_in_pack), llm, limits, DEFAULT_RETRIES, cache, rules)
+
+            def distribute(_):
+                try:
+                    results = request.result()
+                except Exception as e:
+                    results = [e] * len(futures)
+                for future, result in zip(futures, results):
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+
+            request.add_done_callback(distribute)
+
+        def follow(leader, doc):
+            """A future for `doc` that reuses the answer of an identical description in flight."""
+            follower = Future()
+
+            def copy(_):
+                try:
+                    answer = leader.result()
+                    doc.update({field: answer[field] for field in AugmentedScholarship.model_fields if field in answer})
+                    # The same description gives the same rule-filled fields, so their provenance is copied too
+                    doc['rule_fields'] = answer.get('rule_fields', [])
+                    follower.set_result(doc)
+                except Exception as e:
+                    follower.set_exception(e)
+
+            leader.add_done_callback(copy)
+            return follower
+
+        def collect(done):
+            nonlocal augmented, failed
+            for future in done:
+                doc_id, description = pending.pop(future)
+                if in_flight.get(description) is future:
+                    del in_flight[description]
+                progress_bar.update()
+                finished.add(doc_id)
+                try:
+                    augmented_doc = future.result()
+                except Exception as e:
+                    print(f"Error processing document {doc_id}: {str(e)}")
+                    failed += 1
+                    continue
+                # Queue the update of the document in the database
+                updates.append(augmentation_update(doc_id, augmented_doc))
+                augmented += 1
+                if len(updates) >= batch_size:
+                    flush()
+
+        for doc in docs:
+            leader = in_flight.get(doc["description"])
+            if leader:
+                future = follow(leader, doc)
+            elif pack_size > 1:
+                if pack and pack_estimate + estimate_tokens(doc["description"]) > pack_tokens:
+                    send_pack()
+                future = in_flight[doc["description"]] = Future()
+                pack.append((doc, future))
+                pack_estimate += estimate_tokens(doc["description"])
+                if len(pack) >= pack_size:
+                    send_pack()
+            else:
+                future = in_flight[doc["description"]] = \
+                    executor.submit(augment_document, doc, llm, limits, DEFAULT_RETRIES, cache, rules)
+            pending[future] = (doc["_id"], doc["description"])
+            submitted.append(doc["_id"])
+            if len(pending) >= concurrency * 2 * max(1, pack_size):
+                # Never wait on documents that have not been sent yet
+                send_pack()
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        send_pack()
+        collect(wait(pending).done)
+        flush()
+
+    return augmented, failed
+
+
 # Main execution
 if __name__ == "__main__":
-    # Get all documents from the collection
-    all_docs = list(scholarships.find())
+    parser = argparse.ArgumentParser(
+        description="Augment scholarships with structured fields from the LLM. Only documents missing augmentation "
+                    "for the current schema version are processed, and an interrupted run resumes from its "
+                    "checkpoint. Title, reward and location are read straight off load2.py descriptions.")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help="requests in flight at once")
+    parser.add_argument('--requests-per-minute', type=float, default=DEFAULT_REQUESTS_PER_MINUTE,
+                        help="model requests sent per minute at most")
+    parser.add_argument('--tokens-per-minute', type=float, default=DEFAULT_TOKENS_PER_MINUTE,
+                        help="estimated tokens sent per minute at most")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="augmented documents written per bulk_write")
+    parser.add_argument('--no-cache', action='store_true', help="call the model even for descriptions seen before")
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_ENTRIES,
+                        help="results kept in the augmentation cache")
+    parser.add_argument('--restart', action='store_true',
+                        help="ignore the checkpoint left by an interrupted run")
+    parser.add_argument('--no-rules', action='store_true',
+                        help="ask the model for every field, even those the description states outright")
+    parser.add_argument('--pack', type=int, default=DEFAULT_PACK_SIZE,
+                        help="descriptions sent together in one request (1 sends each on its own); a pack whose "
+                             "answer does not line up is retried one document at a time")
+    parser.add_argument('--pack-tokens', type=int, default=DEFAULT_PACK_TOKENS,
+                        help="estimated prompt and response tokens allowed in one packed request")
+    args = parser.parse_args()
 
-    # Process each document
-    for doc in tqdm(all_docs, desc="Processing scholarships"):
-        try:
-            augmented_doc = augment_document(doc)
+    # Stream only documents that still need augmenting, resuming after the last checkpoint
+    ensure_indexes(scholarships)
+    checkpoint = Checkpoint()
+    if args.restart:
+        checkpoint.clear()
+    resume_after = checkpoint.load()
+    if resume_after is not None:
+        print(f"Resuming after document {resume_after}")
+    pending_docs = find_pending(after_id=resume_after)
 
-            # Update the document in the database
-            scholarships.update_one({"_id": doc["_id"]}, {"$set": augmented_doc})
-        except Exception as e:
-            print(f"Error processing document {doc['_id']}: {str(e)}")
+    # Process the documents concurrently
+    limits = RequestLimits(args.requests_per_minute, args.tokens_per_minute)
+    cache = None if args.no_cache else AugmentCache(max_entries=args.cache_size)
+    augmented, failed = augment_all(pending_docs, concurrency=args.concurrency, limits=limits,
+                                    batch_size=args.batch_size, cache=cache, checkpoint=checkpoint,
+                                    rules=not args.no_rules, pack_size=args.pack, pack_tokens=args.pack_tokens)
+    # Finished: failed documents are still pending and get retried by the next run
+    checkpoint.clear()
 
-    print(f"Processed and updated {len(all_docs)} scholarships.")
+    print(f"Processed and updated {augmented} scholarships ({failed} failed).")
+    if cache:
+        stats = cache.get_stats()
+        print(f"Augmentation cache: {stats['hits']} hits, {stats['misses']} misses "
+              f"({cache.get_hit_rate():.0%} hit rate)")
+        cache.close()
+    refresh_stored_matches(db)
 
     # Close the MongoDB connection
     client.close()
@@ -0,0 +1,183 @@
+import argparse
+import json
+from bson import json_util
+from pydantic import ValidationError
+from tqdm import tqdm
+
+from augment import (DEFAULT_BATCH_SIZE, MODEL, AugmentedScholarship, augmentation_update, build_messages, client, db,
+                     find_pending, openai_client, scholarships)
+from bulk import batched
+from indexes import ensure_indexes
+from jsonl import JsonlWriter, read_lines
+from profile_matches import refresh_stored_matches
+
+MAX_REQUESTS_PER_FILE = 50_000  # The provider's limit for one batch input file
+
+
+def response_format(model=AugmentedScholarship) -> dict:
+    """Structured-output settings for `model`, as the parse() helper sends them for a live request.
+
+    Strict mode wants every field listed as required (optional ones still
+    accept null) and no other properties, and does not take defaults.
+    """
+    schema = model.model_json_schema()
+    for field in schema["properties"].values():
+        field.pop("default", None)
+    schema["required"] = list(schema["properties"])
+    schema["additionalProperties"] = False
+    return {"type": "json_schema", "json_schema": {"name": model.__name__, "schema": schema, "strict": True}}
+
+
+def batch_request(doc) -> dict:
+    """One line of a batch input file: the same chat completion augment_document would send."""
+    return {
+        # json_util keeps the _id's type (ObjectId or otherwise) through the round trip
+        "custom_id": json_util.dumps(doc["_id"]),
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": MODEL,
+            "messages": build_messages(doc["description"]),
+            "response_format": response_format(),
+        }
+    }
+
+
+def write_batch_requests(path_prefix, collection=scholarships, max_requests=MAX_REQUESTS_PER_FILE):
+    """Write every pending document into batch input files named <prefix>-0001.jsonl, ...
+
+    Returns the paths written.
+    """
+    paths = []
+    for number, docs in enumerate(batched(find_pending(collection), max_requests), start=1):
+        path = f"{path_prefix}-{number:04d}.jsonl"
+        writer = JsonlWriter(path)
+        for doc in docs:
+            writer.write(batch_request(doc))
+        writer.close()
+        paths.append(path)
+    return paths
+
+
+def parse_result(line: dict) -> AugmentedScholarship:
+    """Validate one line of a batch output file, raising ValueError if it holds no usable answer."""
+    if line.get("error"):
+        raise ValueError(line["error"].get("message", "request failed"))
+    response = line.get("response") or {}
+    if response.get("status_code") != 200:
+        raise ValueError(f"status {response.get('status_code')}")
+    message = response["body"]["choices"][0]["message"]
+    if message.get("refusal"):
+        raise ValueError(f"refused: {message['refusal']}")
+    try:
+        return AugmentedScholarship.model_validate_json(message["content"])
+    except ValidationError as e:
+        raise ValueError(f"invalid response: {e.error_count()} validation errors") from e
+
+
+def ingest_batch_results(paths, collection=scholarships, batch_size=DEFAULT_BATCH_SIZE, failed_path=None):
+    """Apply batch output files to the collection in bulk.
+
+    Lines that fail, are malformed or do not validate are skipped (and listed
+    in `failed_path` if given); their documents stay pending, so the next
+    write_batch_requests picks up exactly those and none of the successful ones.
+    Each document's description is read back so its summary is stored as well.
+    Returns the number of documents applied and the number that failed.
+    """
+    applied = failed = 0
+    failures = JsonlWriter(failed_path) if failed_path else None
+
+    def results():
+        nonlocal failed
+        for path in paths:
+            for text in read_lines(path):
+                line = None
+                try:
+                    line = json.loads(text)
+                    result = json_util.loads(line["custom_id"]), parse_result(line).model_dump()
+                except (ValueError, KeyError, IndexError, TypeError) as e:
+                    failed += 1
+                    if failures:
+                        custom_id = line.get("custom_id") if isinstance(line, dict) else None
+                        failures.write({"custom_id": custom_id, "reason": str(e)})
+                    continue
+                yield result
+
+    for batch in batched(tqdm(results(), desc="Applying batch results"), batch_size):
+        descriptions = {doc["_id"]: doc.get("description") for doc in
+                        collection.find({"_id": {"$in": [doc_id for doc_id, _ in batch]}}, {"description": 1})}
+        updates = []
+        for doc_id, augmented in batch:
+            if descriptions.get(doc_id) is not None:
+                augmented["description"] = descriptions[doc_id]
+            updates.append(augmentation_update(doc_id, augmented))
+        collection.bulk_write(updates, ordered=False)
+        applied += len(updates)
+
+    if failures:
+        failures.close()
+    return applied, failed
+
+
+def submit_batch(path, llm=openai_client):
+    """Upload a batch input file and start a batch job; returns the batch ID."""
+    with open(path, 'rb') as file:
+        input_file = llm.files.create(file=file, purpose="batch")
+    batch = llm.batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions",
+                               completion_window="24h")
+    return batch.id
+
+
+def download_batch(batch_id, path, llm=openai_client):
+    """Save the output and error lines of a finished batch to `path`; returns the batch status."""
+    batch = llm.batches.retrieve(batch_id)
+    if batch.status != "completed":
+        return batch.status
+    with open(path, 'w', encoding='utf-8') as file:
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                content = llm.files.content(file_id).text
+                file.write(content if content.endswith('\n') or not content else content + '\n')
+    return batch.status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Augment scholarships through offline batch files, for large backfills: prepare, submit each "
+                    "file, download each batch once finished, then ingest the results. Failed lines stay pending, "
+                    "so running prepare again retries only those.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    prepare = commands.add_parser("prepare", help="write pending documents to batch input files")
+    prepare.add_argument('--prefix', default='augment_batch', help="input files are named <prefix>-0001.jsonl, ...")
+    prepare.add_argument('--max-requests', type=int, default=MAX_REQUESTS_PER_FILE)
+
+    submit = commands.add_parser("submit", help="upload a batch input file and start the batch")
+    submit.add_argument('file')
+
+    download = commands.add_parser("download", help="save the results of a finished batch")
+    download.add_argument('batch_id')
+    download.add_argument('file')
+
+    ingest = commands.add_parser("ingest", help="validate batch results and apply them to MongoDB")
+    ingest.add_argument('files', nargs='+')
+    ingest.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    ingest.add_argument('--failed', default='augment_batch_failed.jsonl', help="where to list lines that failed")
+
+    args = parser.parse_args()
+
+    if args.command == "prepare":
+        ensure_indexes(scholarships)
+        paths = write_batch_requests(args.prefix, max_requests=args.max_requests)
+        print(f"Wrote {len(paths)} batch input files: {', '.join(paths) or 'nothing pending'}")
+    elif args.command == "submit":
+        print(f"Started batch {submit_batch(args.file)}")
+    elif args.command == "download":
+        print(f"Batch {args.batch_id} is {download_batch(args.batch_id, args.file)}")
+    else:
+        applied, failed = ingest_batch_results(args.files, batch_size=args.batch_size, failed_path=args.failed)
+        print(f"Applied {applied} results ({failed} failed, listed in {args.failed}); "
+              f"run prepare again to retry the failures.")
+        refresh_stored_matches(db)
+
+    client.close()
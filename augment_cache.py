@@ -0,0 +1,72 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+DEFAULT_PATH = 'augment_cache.sqlite'
+DEFAULT_MAX_ENTRIES = 100_000
+
+
+def cache_key(*parts) -> str:
+    """Hash everything that determines a model answer: description, prompt, model and schema version."""
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+
+class AugmentCache:
+    """Persistent, size-bounded store of parsed augmentation results keyed by cache_key.
+
+    When more than `max_entries` results are stored, the least recently used
+    ones are evicted.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__connection.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, result TEXT, last_used REAL)"
+        )
+        self.__connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self.__max_entries = max_entries
+        self.__size = self.__connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+
+    def get(self, key: str):
+        with self.__lock:
+            row = self.__connection.execute("SELECT result FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.__misses += 1
+                return None
+            self.__hits += 1
+            self.__connection.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.__connection.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, result: dict) -> None:
+        with self.__lock:
+            exists = self.__connection.execute("SELECT 1 FROM results WHERE key = ?", (key,)).fetchone()
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO results (key, result, last_used) VALUES (?, ?, ?)",
+                (key, json.dumps(result), time.time())
+            )
+            if not exists:
+                self.__size += 1
+            if self.__size > self.__max_entries:
+                excess = self.__size - self.__max_entries
+                self.__connection.execute(
+                    "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_used LIMIT ?)", (excess,)
+                )
+                self.__size -= excess
+            self.__connection.commit()
+
+    def get_hit_rate(self) -> float:
+        lookups = self.__hits + self.__misses
+        return self.__hits / lookups if lookups else 0.0
+
+    def get_stats(self) -> dict:
+        return {"hits": self.__hits, "misses": self.__misses, "entries": self.__size}
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__connection.close()
@@ -0,0 +1,1299 @@
+"""Offline benchmarks for the Equalify pipeline.
+
+Usage: python bench.py <benchmark> [options]
+
+Every benchmark runs against local stand-ins (fixture pages, synthetic data), so
+nothing here touches the ASU site, OpenAI or the production database.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Fixture pages shaped like the ASU listing and scholarship pages
+def listing_page(page, per_page, pages):
+    first = page * per_page
+    # Each scholarship is linked twice, like the title and "Read more" links on the real site
+    anchors = "\n".join(
+        f'<li><a href="/scholarship/{first + i}">Scholarship {first + i}</a> '
+        f'<a href="/scholarship/{first + i}/#details">Read more</a></li>'
+        for i in range(per_page)
+    )
+    pager = " ".join(
+        f'<a href="/scholarship-search&page={number}">{number + 1}</a>'
+        for number in range(max(0, page - 2), min(pages, page + 3))
+    )
+    return f"""<html><head><title>Scholarship search</title></head>
+<body><div id="main"><ul>{anchors}</ul>
+<nav class="pager">{pager}</nav></div></body></html>"""
+
+
+def scholarship_page(scholarship_id, revision=0):
+    paragraphs = "\n".join(
+        f"<p>Requirement {i} for scholarship {scholarship_id}: applicants must be enrolled full time.</p>"
+        for i in range(20)
+    )
+    menu = "\n".join(
+        f'<li class="menu-item"><div class="menu-label"><a href="/topic/{i}">Topic {i}</a></div></li>'
+        for i in range(60)
+    )
+    return f"""<html><head><title>Scholarship {scholarship_id}</title>
+<script>var analytics = {{"page": {scholarship_id}, "template": "<div class=x>"}};</script>
+<style>div.content > h1 {{ color: maroon; }}</style></head>
+<body><header><nav><a href="/">Home</a><a href="/scholarship-search&page=0">Search</a>
+<ul class="menu">{menu}</ul></nav></header>
+<!-- <div class="legacy-banner"> -->
+<div class="layout"><div class="content">
+<h1 id="page-title">Fixture Scholarship {scholarship_id}</h1>
+<div class="field">Award amount: ${1000 + scholarship_id + revision}</div>
+{paragraphs}
+</div><aside><div>Related scholarships</div></aside></div>
+<footer><div>Arizona State University</div><ul class="menu">{menu}</ul></footer></body></html>"""
+
+
+class LocalServer:
+    """A threaded HTTP server on localhost; subclasses answer requests in `handle`."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        self.__lock = threading.Lock()
+        self.__server = ThreadingHTTPServer(("127.0.0.1", 0), self.__make_handler())
+        self.__server.daemon_threads = True
+        self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.__server.server_address[1]}"
+
+    def __make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server.count_request()
+                time.sleep(server.latency)
+                server.handle(self)
+
+            do_POST = do_GET
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    @staticmethod
+    def send(request, status, payload, headers=None):
+        request.send_response(status)
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.send_header("Content-Length", str(len(payload)))
+        request.end_headers()
+        request.wfile.write(payload)
+
+    def count_request(self):
+        with self.__lock:
+            self.requests += 1
+
+    def handle(self, request):
+        raise NotImplementedError
+
+    def __enter__(self):
+        self.__thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+
+class FixtureServer(LocalServer):
+    """Serves fixture pages, with ETags, sleeping `latency` seconds per request."""
+
+    def __init__(self, pages=8, per_page=25, latency=0.02):
+        super().__init__(latency)
+        self.pages = pages
+        self.per_page = per_page
+        self.revisions = {}  # scholarship id -> revision, to simulate edited pages
+
+    def handle(self, request):
+        status, body = self.respond(request.path)
+        payload = body.encode()
+        etag = '"' + hashlib.md5(payload).hexdigest() + '"'
+        if request.headers.get("If-None-Match") == etag:
+            self.send(request, 304, b"", {"ETag": etag})
+            return
+        self.send(request, status, payload, {"Content-Type": "text/html; charset=utf-8", "ETag": etag})
+
+    def respond(self, path):
+        if path.startswith("/scholarship-search&page="):
+            page = int(path.split("=")[-1])
+            if page < self.pages:
+                return 200, listing_page(page, self.per_page, self.pages)
+            return 200, "<html><body><div id='main'><p>No results</p></div></body></html>"
+        if path.startswith("/scholarship/"):
+            scholarship_id = int(path.split("/")[-1])
+            return 200, scholarship_page(scholarship_id, self.revisions.get(scholarship_id, 0))
+        return 404, "<html><body>Not found</body></html>"
+
+
+def fake_instance(schema, definitions, counters, items=1):
+    """Build a value matching a (strict) JSON schema, as a structured-output model would."""
+    if "$ref" in schema:
+        return fake_instance(definitions[schema["$ref"].split("/")[-1]], definitions, counters, items)
+    if "anyOf" in schema:
+        return None
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: fake_instance(prop, definitions, counters, items)
+                for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [fake_instance(schema["items"], definitions, counters, items) for _ in range(items)]
+    if kind == "integer":
+        counters["integer"] = counters.get("integer", 0) + 1
+        return counters["integer"]
+    if kind == "number":
+        return 1000.0
+    if kind == "boolean":
+        return False
+    return "Fixture scholarship"
+
+
+class FakeModelServer(LocalServer):
+    """An OpenAI-compatible chat completions endpoint answering with schema-shaped JSON.
+
+    A fraction `error_rate` of requests get a 429 so retry handling is exercised.
+    Array fields get one item per "Description:" in the prompt, except in a
+    fraction `mismatch_rate` of multi-description answers, which drop one.
+    Each completion token adds `token_latency` seconds, and the response schema
+    counts towards prompt tokens, as it does with the real API.
+    """
+
+    def __init__(self, latency=0.5, error_rate=0.0, mismatch_rate=0.0, token_latency=0.0):
+        super().__init__(latency)
+        self.error_rate = error_rate
+        self.mismatch_rate = mismatch_rate
+        self.token_latency = token_latency
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.__lock = threading.Lock()
+
+    def handle(self, request):
+        body = json.loads(request.rfile.read(int(request.headers["Content-Length"])))
+        if random.random() < self.error_rate:
+            error = {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}}
+            self.send(request, 429, json.dumps(error).encode(),
+                      {"Content-Type": "application/json", "Retry-After": "0.05"})
+            return
+
+        prompt = "".join(message["content"] for message in body["messages"])
+        schema = body["response_format"]["json_schema"]["schema"]
+        items = max(1, prompt.count("Description:"))
+        if items > 1 and random.random() < self.mismatch_rate:
+            items -= 1
+        content = json.dumps(fake_instance(schema, schema.get("$defs", {}), {}, items))
+        usage = {"prompt_tokens": (len(prompt) + len(json.dumps(schema))) // 4, "completion_tokens": len(content) // 4}
+        time.sleep(usage["completion_tokens"] * self.token_latency)
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        with self.__lock:
+            self.prompt_tokens += usage["prompt_tokens"]
+            self.completion_tokens += usage["completion_tokens"]
+        completion = {
+            "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()), "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content, "refusal": None}}],
+            "usage": usage,
+        }
+        self.send(request, 200, json.dumps(completion).encode(), {"Content-Type": "application/json"})
+
+
+class NullCollection:
+    """Stands in for the scholarships collection, counting bulk writes instead of storing them."""
+
+    def __init__(self):
+        self.writes = 0
+
+    def bulk_write(self, operations, ordered=True):
+        self.writes += len(operations)
+
+
+ETHNICITIES = ["African American", "Hispanic", "Native American", "Asian", "Other"]
+DESCRIPTION_WORDS = ("nursing engineering teaching business music art biology education community leadership "
+                     "service veterans rural women first-generation research medicine law agriculture "
+                     "students must attend accredited university college full-time enrolled").split()
+GENDERS = ["Female", "Male", "Non-binary", "Other"]
+MAJORS = ["Nursing", "Engineering", "Computer Science", "Education", "Business", "Biology", "Music", "Agriculture"]
+UNIVERSITIES = ["Arizona State University", "University of Texas", "Ohio State University", "Purdue University"]
+LOCATIONS = ["Arizona", "Texas", "California", "Ohio", "New York", "Florida", "Georgia", "Washington"]
+
+
+def synthetic_scholarships(count, seed=0):
+    """Augmented scholarship documents with realistic skew: most have no preference and few flags set."""
+    from indexes import FLAG_FIELDS
+
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    for i in range(count):
+        doc = {
+            "id": f"synthetic-{i}",
+            "title": f"{rng.choice(DESCRIPTION_WORDS).title()} Scholarship {i}",
+            "description": " ".join(rng.choices(DESCRIPTION_WORDS, k=60)),
+            "preferred_ethnicity": rng.choice(ETHNICITIES) if rng.random() < 0.2 else None,
+            "preferred_gender": rng.choice(GENDERS) if rng.random() < 0.15 else None,
+            "preferred_major": None,
+            "reward": float(rng.choice([500, 1000, 2500, 5000, 10000, 25000])),
+            "due_date": start + timedelta(days=rng.randrange(365)) if rng.random() < 0.9 else None,
+            "updated_at": start,
+        }
+        for flag in FLAG_FIELDS:
+            doc[flag] = rng.random() < 0.05
+        if rng.random() < 0.15:
+            doc["preferred_major"] = ", ".join(rng.sample(MAJORS, rng.randint(1, 3)))
+        doc["university"] = rng.choice(UNIVERSITIES) if rng.random() < 0.05 else None
+        doc["location"] = ", ".join(rng.sample(LOCATIONS, rng.randint(1, 2))) if rng.random() < 0.15 else None
+        yield doc
+
+
+class ListCollection:
+    """Stands in for the scholarships collection where only find() is needed, returning every document."""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query=None, projection=None):
+        return iter(self.docs)
+
+
+def bench_scrape(args):
+    import scrape
+
+    with FixtureServer(pages=args.pages, per_page=args.per_page, latency=args.latency) as server:
+        print(f"{'concurrency':>11}  {'pages':>5}  {'seconds':>7}  {'pages/sec':>9}")
+        for concurrency in args.concurrency:
+            server.requests = 0
+            start = time.perf_counter()
+            results = list(scrape.crawl(base_url=f"{server.url}/scholarship-search&page=",
+                                   prefix=f"{server.url}/scholarship/", concurrency=concurrency, rate=args.rate,
+                                   progress=False))
+            elapsed = time.perf_counter() - start
+            assert len(results) == args.pages * args.per_page
+            assert server.requests == args.pages + len(results)
+            print(f"{concurrency:>11}  {server.requests:>5}  {elapsed:>7.2f}  {server.requests / elapsed:>9.1f}")
+
+
+def bench_recrawl(args):
+    import scrape
+    from crawl_cache import CrawlCache
+
+    with FixtureServer(pages=args.pages, per_page=args.per_page, latency=args.latency) as server, \
+            tempfile.TemporaryDirectory() as tmp:
+        cache_path = os.path.join(tmp, "crawl_cache.sqlite")
+        scholarships = args.pages * args.per_page
+        print(f"{'run':>9}  {'output':>6}  {'requests':>8}  {'seconds':>7}  {'hit':>5}  {'miss':>5}  {'changed':>7}")
+        for run in ("full", "unchanged", "edited"):
+            if run == "edited":
+                for scholarship_id in range(0, args.pages * args.per_page, 10):
+                    server.revisions[scholarship_id] = 1
+            cache = CrawlCache(cache_path)
+            requests_before = server.requests
+            start = time.perf_counter()
+            results = list(scrape.crawl(base_url=f"{server.url}/scholarship-search&page=",
+                                   prefix=f"{server.url}/scholarship/", concurrency=args.concurrency,
+                                   rate=args.rate, progress=False, cache=cache))
+            elapsed = time.perf_counter() - start
+            cache.close()
+            stats = cache.get_stats()
+            requests = server.requests - requests_before
+            # Every run visits every listing page and every scholarship, however many come back unchanged
+            assert sum(stats.values()) == scholarships, stats
+            assert requests - scholarships >= args.pages, f"only {requests - scholarships} listing pages fetched"
+            print(f"{run:>9}  {len(results):>6}  {requests:>8}  {elapsed:>7.2f}  {stats['hit']:>5}  {stats['miss']:>5}  "
+                  f"{stats['changed']:>7}")
+
+
+# Markup html.parser nests in ways counting tags does not, which extract_description_fast must agree on
+MALFORMED_PAGES = [
+    '<div><p><div>bad nesting</p></div><h1 id="page-title">T</h1>zz</div>',
+    '<div>a<table><tr><td><div><h1 id="page-title">T</h1>x</div></td></tr></table>b</div>',
+    '<div><h1 id="x" id="page-title">T</h1>y</div>',
+    '<div><h1 id="page-title" id="x">T</h1>y</div>',
+    '<div>o<div><p>q</div><h1 id="page-title">T</h1>r</div>s</div>',
+    '<div>x<span><div><h1 id="page-title">T</h1></span>y</div>z</div>',
+    '<div><!-- <div> --><h1 id="page-title">T</h1><script>"</div>"</script>a</div>b',
+]
+
+
+def bench_extract(args):
+    from concurrent.futures import ProcessPoolExecutor
+
+    import scrape
+
+    for page in MALFORMED_PAGES:
+        assert scrape.extract_description_fast(page) == scrape.extract_description(page), page
+
+    documents = [scholarship_page(i).encode() for i in range(args.documents)]
+    expected = [scrape.extract_description(document) for document in documents]
+
+    def run(label, extract):
+        start = time.perf_counter()
+        descriptions = extract()
+        elapsed = time.perf_counter() - start
+        assert descriptions == expected, f"{label} extracted different descriptions"
+        print(f"{label:>28}  {elapsed:>7.2f}  {len(documents) / elapsed:>8.1f}")
+
+    print(f"{'extractor':>28}  {'seconds':>7}  {'docs/sec':>8}")
+    run("full parse", lambda: [scrape.extract_description(document) for document in documents])
+    run("targeted subtree", lambda: [scrape.extract_description_fast(document) for document in documents])
+    for workers in args.workers:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(scrape.extract_description_fast, documents[:workers]))  # start the workers
+            run(f"targeted subtree, {workers} procs",
+                lambda: list(pool.map(scrape.extract_description_fast, documents, chunksize=16)))
+
+
+def bench_database(args):
+    """A scratch database on a local mongod, or in process with --in-process (needs mongomock)."""
+    if args.in_process:
+        import mongomock
+        return mongomock.MongoClient()["equalify_bench"]
+    from pymongo import MongoClient
+    client = MongoClient(args.mongo_uri)
+    client.drop_database("equalify_bench")
+    return client["equalify_bench"]
+
+
+def add_database_arguments(parser):
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017", help="scratch mongod to benchmark against")
+    parser.add_argument("--in-process", action="store_true", help="use mongomock instead of a mongod (checks results only, its timings mean little)")
+
+
+def bench_load(args):
+    from bulk import bulk_upsert
+
+    db = bench_database(args)
+    records = [{"id": str(i), "description": f"Fixture scholarship {i} " * 20} for i in range(args.records)]
+
+    print(f"{'loader':>22}  {'seconds':>7}  {'records/sec':>11}  counts")
+    collection = db["insert_one"]
+    start = time.perf_counter()
+    for record in records:
+        collection.insert_one(dict(record))
+    elapsed = time.perf_counter() - start
+    print(f"{'insert_one':>22}  {elapsed:>7.2f}  {len(records) / elapsed:>11.0f}")
+
+    collection = db["bulk_upsert"]
+    for run in ("bulk_upsert (new)", "bulk_upsert (reload)"):
+        start = time.perf_counter()
+        counts = bulk_upsert(collection, (dict(record) for record in records), batch_size=args.batch_size)
+        elapsed = time.perf_counter() - start
+        print(f"{run:>22}  {elapsed:>7.2f}  {len(records) / elapsed:>11.0f}  {counts}")
+
+
+class CountingCollection:
+    """Wraps a collection, counting bulk_write calls and the operations in them."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.batches = 0
+        self.operations = 0
+
+    def bulk_write(self, operations, ordered=True):
+        self.batches += 1
+        self.operations += len(operations)
+        return self.collection.bulk_write(operations, ordered=ordered)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+def bench_interactions(args):
+    from concurrent.futures import ThreadPoolExecutor
+    from interactions import KINDS, InteractionStore, ensure_indexes
+
+    db = bench_database(args)
+    scholarships = db["scholarships"]
+    ids = scholarships.insert_many([{"title": f"Scholarship {i}"} for i in range(args.scholarships)]).inserted_ids
+    rng = random.Random(1)
+    # Most clicks land on the first few results everyone sees, often the same button more than once
+    clicks = [(f"user-{rng.randrange(args.users)}", ids[min(int(rng.expovariate(0.5)), len(ids) - 1)],
+               rng.choice(KINDS), rng.random() < 0.8) for _ in range(args.clicks)]
+
+    def share(user):
+        return clicks[user::args.users]
+
+    print(f"{'writer':>12}  {'clicks/sec':>10}  {'round trips':>11}  {'documents written':>17}")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.users) as pool:
+        list(pool.map(lambda part: [scholarships.update_one({"_id": scholarship_id}, {"$set": {kind: state}})
+                                    for _, scholarship_id, kind, state in share(part)], range(args.users)))
+    elapsed = time.perf_counter() - start
+    print(f"{'update_one':>12}  {len(clicks) / elapsed:>10.0f}  {len(clicks):>11}  {len(clicks):>17}")
+
+    interactions = CountingCollection(db["user_interactions"])
+    ensure_indexes(interactions.collection)
+    store = InteractionStore(interactions, scholarships, interval=args.interval)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.users) as pool:
+        list(pool.map(lambda part: [store.record(*click) for click in share(part)], range(args.users)))
+    elapsed = time.perf_counter() - start
+    store.close()
+    print(f"{'write-behind':>12}  {len(clicks) / elapsed:>10.0f}  {interactions.batches:>11}"
+          f"  {interactions.operations:>17}")
+
+
+def bench_csv(args):
+    import load2
+    from bulk import bulk_upsert
+
+    with open("load2.csv", encoding="utf-8") as file:
+        sample = list(csv.DictReader(file))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "synthetic.csv")
+        with open(path, "w", encoding="utf-8", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=load2.TEXT_COLUMNS)
+            writer.writeheader()
+            for i in range(args.rows):
+                row = dict(sample[i % len(sample)])
+                row["Scholarship Name"] = f"{row['Scholarship Name']} #{i}"
+                row["Link"] = f"{row['Link']}-{i}"
+                writer.writerow(row)
+        size = os.path.getsize(path) / 1e6
+        print(f"{args.rows} rows, {size:.0f} MB")
+
+        start = time.perf_counter()
+        documents = load2.read_scholarships(path, args.chunk_size)
+        if args.load:
+            counts = bulk_upsert(bench_database(args)["csv"], documents, batch_size=args.batch_size)
+            rows = counts["inserted"] + counts["updated"] + counts["unchanged"]
+        else:
+            rows = sum(1 for _ in documents)
+        elapsed = time.perf_counter() - start
+        assert rows == args.rows
+        stage = "parse + normalize + upsert" if args.load else "parse + normalize"
+        print(f"{stage}: {elapsed:.1f}s, {rows / elapsed:,.0f} rows/sec, {size / elapsed:.1f} MB/sec")
+
+
+def bench_search(args):
+    import indexes
+    from bulk import batched
+    from scholarship_queries import fetch_page
+
+    def median_latency(collection, query):
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            fetch_page(collection, query)
+            timings.append(time.perf_counter() - start)
+        return sorted(timings)[len(timings) // 2] * 1000
+
+    db = bench_database(args)
+    print(f"{'documents':>9}  {'query':>22}  {'no index ms':>11}  {'indexed ms':>10}  plan")
+    for size in args.sizes:
+        collection = db[f"search_{size}"]
+        for docs in batched(synthetic_scholarships(size), 10_000):
+            collection.insert_many(docs)
+        # The filters of fetch_page, then the search box (mongomock has no $text)
+        queries = indexes.FILTER_QUERIES[:args.queries] + ([] if args.in_process else indexes.REPRESENTATIVE_QUERIES[:1])
+        # $text needs its index, so the search box is compared with the title $regex it replaced
+        unindexed = {label: median_latency(collection, query) for label, query in queries if "$text" not in query}
+        unindexed["text search"] = median_latency(collection, {"title": {"$regex": "nursing", "$options": "i"},
+                                                               "reward": {"$gte": 0}})
+        indexes.ensure_indexes(collection)
+        collection.create_indexes(indexes.FILTER_INDEXES)
+        for label, query in queries:
+            plan = "" if args.in_process else ", ".join(indexes.explain_query(collection, query)["indexes"]) or "COLLSCAN"
+            print(f"{size:>9}  {label:>22}  {unindexed[label]:>11.2f}  {median_latency(collection, query):>10.2f}  {plan}")
+        collection.drop()
+
+
+def bench_paginate(args):
+    import bson
+    from bulk import batched
+    from indexes import FILTER_INDEXES, ensure_indexes
+    from scholarship_queries import build_query, fetch_page, next_page_after
+
+    query = build_query()
+    db = bench_database(args)
+    print(f"{'documents':>9}  {'page':>5}  {'method':>16}  {'ms':>8}  {'docs read':>9}  {'KB read':>8}")
+    for size in args.sizes:
+        collection = db[f"paginate_{size}"]
+        for docs in batched(synthetic_scholarships(size), 10_000):
+            collection.insert_many(docs)
+        ensure_indexes(collection)
+        collection.create_indexes(FILTER_INDEXES)  # fetch_page's indexes, which the app no longer creates
+        last_page = (size - 1) // args.page_size + 1
+        for page_number in (1, last_page // 2, last_page):
+            # Before: every match read and sorted in Python, then one page sliced out
+            start = time.perf_counter()
+            matches = sorted(collection.find(query), key=lambda x: x.get("due_date") or datetime.max)
+            page = matches[(page_number - 1) * args.page_size:page_number * args.page_size]
+            elapsed = (time.perf_counter() - start) * 1000
+            kilobytes = sum(len(bson.encode(doc)) for doc in matches) / 1000
+            print(f"{size:>9}  {page_number:>5}  {'sort and slice':>16}  {elapsed:>8.1f}  {len(matches):>9}  {kilobytes:>8.0f}")
+
+            # After: the cursor of the previous page, as the Search page keeps it in session state
+            after = None
+            if page_number > 1:
+                after = next_page_after(query, matches[(page_number - 2) * args.page_size:(page_number - 1) * args.page_size])
+            start = time.perf_counter()
+            keyset_page = fetch_page(collection, query, after, page_size=args.page_size)
+            elapsed = (time.perf_counter() - start) * 1000
+            assert [doc["_id"] for doc in keyset_page] == [doc["_id"] for doc in page]
+            kilobytes = sum(len(bson.encode(doc)) for doc in keyset_page) / 1000
+            print(f"{size:>9}  {page_number:>5}  {'keyset':>16}  {elapsed:>8.1f}  {len(keyset_page):>9}  {kilobytes:>8.0f}")
+        collection.drop()
+
+
+def bench_cards(args):
+    import bson
+    import load2
+    from bulk import batched
+    from indexes import FILTER_INDEXES, ensure_indexes
+    from normalize import summarize
+    from scholarship_queries import CARD_FIELDS, build_query, fetch_page, next_page_after
+
+    with open("load2.csv", encoding="utf-8") as file:
+        rows = list(csv.DictReader(file))
+
+    def catalog():
+        for i, doc in enumerate(synthetic_scholarships(args.documents)):
+            # Scraped descriptions run to several paragraphs; a few load2.csv rows back to back stand in for one
+            doc["description"] = "\n\n".join(load2.create_description(rows[(i + k) % len(rows)]) for k in range(4))
+            doc["summary"] = summarize(doc["description"])
+            yield doc
+
+    collection = bench_database(args)["cards"]
+    for docs in batched(catalog(), 10_000):
+        collection.insert_many(docs)
+    ensure_indexes(collection)
+    collection.create_indexes(FILTER_INDEXES)  # fetch_page's indexes, which the app no longer creates
+    query = build_query()
+    # mongomock cannot evaluate the $ifNull fallback, and every benchmark document has a summary anyway
+    card_fields = {**CARD_FIELDS, "summary": 1} if args.in_process else CARD_FIELDS
+
+    print(f"{'projection':>10}  {'ms/page':>7}  {'KB/page':>7}  {'chars rendered/page':>19}")
+    for label, projection in (("full", None), ("card", card_fields)):
+        elapsed = size = chars = 0.0
+        after = None
+        for _ in range(args.pages):
+            start = time.perf_counter()
+            page = fetch_page(collection, query, after, projection=projection)
+            elapsed += time.perf_counter() - start
+            after = next_page_after(query, page, after)
+            size += sum(len(bson.encode(doc)) for doc in page)
+            # What the results list writes for each card before it is expanded
+            chars += sum(len(str(doc.get("summary") if projection else doc.get("description"))) for doc in page)
+        print(f"{label:>10}  {elapsed / args.pages * 1000:>7.2f}  {size / args.pages / 1000:>7.1f}  "
+              f"{chars / args.pages:>19,.0f}")
+
+
+def bench_catalog(args):
+    from bulk import batched
+    from catalog import Catalog
+    from indexes import FILTER_INDEXES, FLAG_FIELDS, ensure_indexes
+    from scholarship_queries import build_query, fetch_page, normalize_filters
+
+    rng = random.Random(1)
+    # Sidebar combinations a student might pick: a preference or two, a few flags, a reward floor
+    combinations = [normalize_filters("", rng.choice(["All"] * 3 + ETHNICITIES), rng.choice(["All"] * 3 + GENDERS), "",
+                                      rng.choice([0, 0, 1000, 5000]), 1000000, rng.sample(FLAG_FIELDS, rng.randrange(3)),
+                                      rng.choice([None, None, 30]), today=datetime(2025, 3, 1))
+                    for _ in range(args.queries)]
+
+    def median_ms(run):
+        timings = []
+        for filters in combinations:
+            start = time.perf_counter()
+            run(filters)
+            timings.append(time.perf_counter() - start)
+        return sorted(timings)[len(timings) // 2] * 1000
+
+    db = bench_database(args)
+    print(f"{'documents':>9}  {'load s':>6}  {'MB':>5}  {'mongo ms':>8}  {'catalog ms':>10}  {'refresh ms':>10}")
+    for size in args.sizes:
+        collection = db[f"catalog_{size}"]
+        for docs in batched(synthetic_scholarships(size), 10_000):
+            collection.insert_many(docs)
+        ensure_indexes(collection)
+        collection.create_indexes(FILTER_INDEXES)  # fetch_page's indexes, which the app no longer creates
+
+        start = time.perf_counter()
+        catalog = Catalog.load(collection)
+        load = time.perf_counter() - start
+
+        # One page and the total, as the Search page needs for each rerun
+        def mongo(filters):
+            query = build_query(*filters)
+            return collection.count_documents(query), fetch_page(collection, query)
+
+        def in_memory(filters):
+            return catalog.count(filters), catalog.page(filters)
+
+        for filters in combinations[:5]:
+            count, page = mongo(filters)
+            assert (count, [doc["_id"] for doc in page]) == in_memory(filters)
+        mongo_ms, catalog_ms = median_ms(mongo), median_ms(in_memory)
+
+        # Re-augment 1% of the catalog and pick up the change
+        changed = [doc["_id"] for doc in collection.find({}, {"_id": 1}).limit(size // 100)]
+        collection.update_many({"_id": {"$in": changed}},
+                               {"$set": {"rural": True, "updated_at": datetime(2026, 1, 1)}})
+        start = time.perf_counter()
+        assert catalog.refresh(collection) >= len(changed)
+        refresh = time.perf_counter() - start
+        assert catalog.count(normalize_filters(flags=["rural"])) == collection.count_documents({"rural": True})
+
+        megabytes = catalog.get_stats()["bytes"] / 1e6
+        print(f"{size:>9}  {load:>6.1f}  {megabytes:>5.1f}  {mongo_ms:>8.2f}  {catalog_ms:>10.3f}  {refresh * 1000:>10.0f}")
+        collection.drop()
+
+
+def bench_facets(args):
+    from bulk import batched
+    from catalog import Catalog
+    from indexes import FILTER_INDEXES, ensure_indexes
+    from scholarship_queries import (FLAG_FIELDS, REWARD_BUCKETS, build_query, fetch_facets, fetch_page,
+                                     normalize_filters)
+
+    rng = random.Random(1)
+    combinations = [normalize_filters("", rng.choice(["All"] * 3 + ETHNICITIES), rng.choice(["All"] * 3 + GENDERS), "",
+                                      rng.choice([0, 0, 1000, 5000]), 1000000, rng.sample(FLAG_FIELDS, rng.randrange(3)),
+                                      rng.choice([None, None, 30]), today=datetime(2025, 3, 1))
+                    for _ in range(args.queries)]
+    options = {"preferred_ethnicity": ETHNICITIES, "preferred_gender": GENDERS}
+
+    def median_ms(run):
+        timings = []
+        for filters in combinations:
+            start = time.perf_counter()
+            run(filters)
+            timings.append(time.perf_counter() - start)
+        return sorted(timings)[len(timings) // 2] * 1000
+
+    db = bench_database(args)
+    print(f"{'documents':>9}  {'queries':>7}  {'separate ms':>11}  {'$facet ms':>9}  {'catalog ms':>10}")
+    for size in args.sizes:
+        collection = db[f"facets_{size}"]
+        for docs in batched(synthetic_scholarships(size), 10_000):
+            collection.insert_many(docs)
+        ensure_indexes(collection)
+        collection.create_indexes(FILTER_INDEXES)  # fetch_page's indexes, which the app no longer creates
+        catalog = Catalog.load(collection)
+
+        # What the sidebar counts cost as one query per option
+        def separate(filters):
+            terms, ethnicity, gender, major, min_reward, max_reward, flags, due_window = filters
+            queries = [build_query(*filters)]
+            queries += [build_query(terms, value, gender, major, min_reward, max_reward, flags, due_window)
+                        for value in options["preferred_ethnicity"]]
+            queries += [build_query(terms, ethnicity, value, major, min_reward, max_reward, flags, due_window)
+                        for value in options["preferred_gender"]]
+            queries += [build_query(terms, ethnicity, gender, major, min_reward, max_reward, {*flags, flag}, due_window)
+                        for flag in FLAG_FIELDS]
+            bounds = REWARD_BUCKETS + [float("inf")]
+            queries += [{**build_query(*filters), "reward": {"$gte": low, "$lt": high}}
+                        for low, high in zip(bounds, bounds[1:])]
+            return fetch_page(collection, queries[0]), [collection.count_documents(query) for query in queries]
+
+        def faceted(filters):
+            return fetch_facets(collection, filters)
+
+        def in_memory(filters):
+            return catalog.page(filters), catalog.facets(filters)
+
+        for filters in combinations[:5]:
+            page, counts = faceted(filters)
+            assert ([doc["_id"] for doc in page], counts) == in_memory(filters)
+            assert counts["total"] == separate(filters)[1][0]
+        round_trips = 1 + len(separate(combinations[0])[1])
+        print(f"{size:>9}  {round_trips:>4} → 1  {median_ms(separate):>11.1f}  {median_ms(faceted):>9.1f}"
+              f"  {median_ms(in_memory):>10.2f}")
+        collection.drop()
+
+
+class ScriptCallDatabase:
+    """Wraps a database, counting the collection calls a Streamlit script thread makes.
+
+    Background threads, such as the interaction store's writer, are not counted:
+    their writes do not hold up the rerun the user is waiting for.
+    """
+
+    METHODS = {"find", "find_one", "aggregate", "count_documents", "estimated_document_count", "distinct",
+               "bulk_write", "insert_one", "insert_many", "update_one", "update_many", "delete_one", "delete_many",
+               "create_index", "create_indexes", "drop_index", "index_information"}
+
+    def __init__(self, db):
+        self.db = db
+        self.calls = 0
+
+    def __getitem__(self, name):
+        return ScriptCallCollection(self.db[name], self)
+
+
+class ScriptCallCollection:
+    def __init__(self, collection, counter):
+        self.collection = collection
+        self.counter = counter
+
+    def __getattr__(self, name):
+        attribute = getattr(self.collection, name)
+        if name not in ScriptCallDatabase.METHODS:
+            return attribute
+
+        def counted(*args, **kwargs):
+            if threading.current_thread().name == "ScriptRunner.scriptThread":
+                self.counter.calls += 1
+            return attribute(*args, **kwargs)
+        return counted
+
+
+def bench_fragments(args):
+    """The Search page's MongoDB calls and wall time per interaction, with and without fragment reruns.
+
+    AppTest reruns the whole script on every interaction, so the runner below
+    keeps the fragments from one run to the next and reruns only the fragment
+    holding the clicked widget, as a browser session does. Without fragments,
+    st.fragment is replaced by a plain call and every click reruns the page.
+    """
+    from dataclasses import replace
+    from statistics import median
+    from unittest import mock
+    import streamlit as st
+    from streamlit.runtime.fragment import MemoryFragmentStorage
+    from streamlit.testing.v1 import AppTest, app_test, local_script_runner
+    import app_resources
+    import scholarship_queries
+    from bulk import batched
+    from indexes import ensure_indexes
+    from query_stats import QueryCounter
+
+    db = ScriptCallDatabase(bench_database(args))
+    for docs in batched(synthetic_scholarships(args.documents), 10_000):
+        db.db["scholarships"].insert_many(docs)
+    ensure_indexes(db.db["scholarships"])
+    # The page reads client["scholarship_db"]; here that is the scratch database
+    connection = ({"scholarship_db": db}, QueryCounter())
+
+    fragments = MemoryFragmentStorage()
+    widget_fragments = {}  # Widget id -> id of the innermost fragment it was drawn in
+    rerun = {"fragment_id": None}
+
+    class FragmentScriptRunner(local_script_runner.LocalScriptRunner):
+        def __init__(self, *runner_args, **runner_kwargs):
+            super().__init__(*runner_args, **runner_kwargs)
+            self._fragment_storage = fragments
+
+        def request_rerun(self, rerun_data):
+            if rerun["fragment_id"]:
+                rerun_data = replace(rerun_data, fragment_id_queue=[rerun["fragment_id"]])
+            return super().request_rerun(rerun_data)
+
+        def forward_msgs(self):
+            messages = super().forward_msgs()
+            for message in messages:
+                if message.WhichOneof("type") == "delta" and message.delta.WhichOneof("type") == "new_element":
+                    element = message.delta.new_element
+                    widget_id = getattr(getattr(element, element.WhichOneof("type")), "id", "")
+                    if widget_id:
+                        widget_fragments[widget_id] = message.delta.fragment_id
+            return messages
+
+    # Each round is a new session (and user) with nothing cached: a full run, then one interaction on the first result
+    def save(app):
+        return next(button for button in app.button if (button.key or "").startswith("all-save-")).click()
+
+    def details(app):
+        return next(toggle for toggle in app.toggle if toggle.key.startswith("all-details-")).set_value(True)
+
+    def next_page(app):
+        return next(button for button in app.button if button.label == "Next").click()
+
+    interactions = [("Save click", save), ("Show details", details), ("Next page", next_page)]
+
+    def measure(use_fragments):
+        results = {name: ([], []) for name, _ in interactions}
+        for name, interact in interactions:
+            for _ in range(args.rounds):
+                rerun["fragment_id"] = None
+                st.cache_data.clear()
+                app = AppTest.from_file("pages/Search.py", default_timeout=args.timeout).run()
+                widget = interact(app)
+                if use_fragments:
+                    rerun["fragment_id"] = widget_fragments[widget.id]
+                calls, start = db.calls, time.perf_counter()
+                app.run()
+                elapsed = time.perf_counter() - start
+                assert not app.exception, app.exception
+                results[name][0].append(db.calls - calls)
+                results[name][1].append(elapsed * 1000)
+        return results
+
+    # mongomock cannot evaluate the card projection's summary expression; the calls made are the same without it
+    card_fields = {"summary": 1} if args.in_process else {}
+    with mock.patch.object(app_resources, "init_connection", lambda: connection), \
+            mock.patch.object(app_test, "LocalScriptRunner", FragmentScriptRunner), \
+            mock.patch.dict(scholarship_queries.CARD_FIELDS, card_fields):
+        with mock.patch.object(st, "fragment", lambda func: func):
+            whole = measure(use_fragments=False)
+        scoped = measure(use_fragments=True)
+
+    print(f"{'interaction':>12}  {'rerun':>8}  {'MongoDB calls':>13}  {'median ms':>9}")
+    for name, _ in interactions:
+        for rerun_scope, results in (("page", whole), ("fragment", scoped)):
+            calls, timings = results[name]
+            print(f"{name:>12}  {rerun_scope:>8}  {median(calls):>13g}  {median(timings):>9.1f}")
+
+
+def bench_match(args):
+    import numpy as np
+    from bson import ObjectId
+    from catalog import Catalog
+    from matching import CIRCUMSTANCE_FLAGS, match, match_documents
+    from userInfo import UserData
+
+    rng = random.Random(1)
+    profiles = [UserData(rng.choice([20000, 45000, 80000, 150000]), round(rng.uniform(2.0, 4.0), 1),
+                         rng.choice(GENDERS), rng.choice(ETHNICITIES), rng.choice(MAJORS), rng.choice(UNIVERSITIES),
+                         rng.choice(LOCATIONS), rng.sample(CIRCUMSTANCE_FLAGS, rng.randrange(3)))
+                for _ in range(args.profiles)]
+    today = datetime(2025, 3, 1)  # Inside the synthetic deadlines, so some have passed and some have not
+
+    print(f"{'documents':>9}  {'load s':>6}  {'median ms':>9}  {'p95 ms':>6}  {'open to a student':>17}")
+    for size in args.sizes:
+        docs = [{**doc, "_id": ObjectId()} for doc in synthetic_scholarships(size)]
+        start = time.perf_counter()
+        catalog = Catalog.load(ListCollection(docs))
+        load = time.perf_counter() - start
+
+        if size <= 100_000:
+            for user in profiles[:3]:
+                expected = match_documents(docs, user, limit=len(docs), today=today)
+                matched = match(catalog, user, limit=len(docs), today=today)
+                assert {_id for _id, _ in matched} == {_id for _id, _ in expected}
+                assert np.allclose([score for _, score in matched], [score for _, score in expected])
+
+        timings, open_to = [], []
+        for user in profiles:
+            start = time.perf_counter()
+            match(catalog, user, limit=args.limit, today=today)
+            timings.append(time.perf_counter() - start)
+            open_to.append(len(match(catalog, user, limit=size, today=today)))
+        timings.sort()
+        median, p95 = timings[len(timings) // 2] * 1000, timings[int(len(timings) * 0.95)] * 1000
+        print(f"{size:>9}  {load:>6.1f}  {median:>9.1f}  {p95:>6.1f}  {sum(open_to) / len(open_to) / size:>16.1%}")
+
+
+def bench_profile_matches(args):
+    import numpy as np
+    from bson import ObjectId
+    from catalog import Catalog
+    from matching import CIRCUMSTANCE_FLAGS, Predicate, match
+    from profile_matches import ProfileMatchWriter, ensure_indexes, refresh_matches, top_matches
+    from userInfo import UserData
+
+    db = bench_database(args)
+    ensure_indexes(db)
+    # Loaded a second apart, as scraping and augmentation spread over time would stamp them
+    docs = {}
+    for i, doc in enumerate(synthetic_scholarships(args.documents)):
+        doc.update(_id=ObjectId(), updated_at=doc["updated_at"] + timedelta(seconds=i))
+        docs[doc["_id"]] = doc
+    db["scholarships"].insert_many(list(docs.values()))
+    rng = random.Random(2)
+    profiles = {f"profile-{i}": UserData(rng.choice([20000, 45000, 80000, 150000]), round(rng.uniform(2.0, 4.0), 1),
+                                         rng.choice(GENDERS), rng.choice(ETHNICITIES), rng.choice(MAJORS),
+                                         rng.choice(UNIVERSITIES), rng.choice(LOCATIONS),
+                                         rng.sample(CIRCUMSTANCE_FLAGS, rng.randrange(3)))
+                for i in range(args.profiles)}
+
+    def check():
+        """The stored pairs are what testing every profile against every scholarship gives."""
+        expected = {(profile_id, _id) for profile_id, user in profiles.items()
+                    for predicate in [Predicate(user, include_closed=True)]
+                    for _id, doc in docs.items() if predicate.accepts_document(doc)}
+        stored = {(pair["profile_id"], pair["scholarship_id"]) for pair in db["profile_matches"].find()}
+        assert stored == expected, (len(stored - expected), len(expected - stored))
+
+    start = time.perf_counter()
+    catalog = Catalog.load(db["scholarships"])
+    writer = ProfileMatchWriter(db, catalog)
+    for profile_id, user in profiles.items():
+        writer.save(profile_id, user)
+    saved = time.perf_counter() - start
+    writer.close()
+    print(f"saved {len(profiles)} profiles against {len(docs)} scholarships in {saved:.2f} s, their matches listed "
+          f"in the background in {time.perf_counter() - start:.1f} s, {db['profile_matches'].count_documents({})} "
+          f"matches")
+    check()
+
+    print(f"{'changed':>8}  {'read':>6}  {'seconds':>7}  {'added':>6}  {'removed':>7}")
+    start = time.perf_counter()
+    counts = refresh_matches(db)  # No watermark yet: every scholarship is read, and agrees with the writer
+    print(f"{'all':>8}  {counts['scholarships']:>6}  {time.perf_counter() - start:>7.2f}  {counts['added']:>6}  "
+          f"{counts['removed']:>7}")
+    for step, changed in enumerate(args.changes, 1):
+        # A reload or re-augmentation: new preferences and rewards, stamped later than anything before
+        for _id in rng.sample(list(docs), changed):
+            fields = {"preferred_gender": rng.choice(GENDERS + [None] * 4), "reward": float(rng.randrange(500, 20000)),
+                      "updated_at": datetime(2026, 1, 1) + timedelta(hours=step)}
+            for flag in rng.sample(CIRCUMSTANCE_FLAGS, 2):
+                fields[flag] = rng.random() < 0.1
+            docs[_id].update(fields)
+            db["scholarships"].update_one({"_id": _id}, {"$set": fields})
+        start = time.perf_counter()
+        counts = refresh_matches(db)
+        elapsed = time.perf_counter() - start
+        # The refresh reads the changed scholarships, plus those stamped with the previous watermark
+        print(f"{changed:>8}  {counts['scholarships']:>6}  {elapsed:>7.2f}  {counts['added']:>6}  "
+              f"{counts['removed']:>7}")
+        check()
+
+    # Reading a stored list ranks the same as matching the profile in memory
+    today = datetime(2025, 3, 1)
+    catalog = Catalog.load(db["scholarships"])
+    for profile_id, user in list(profiles.items())[:5]:
+        stored = top_matches(db, profile_id, limit=args.limit, today=today)
+        expected = match(catalog, user, limit=args.limit, today=today)
+        assert np.allclose([score for _, score in stored], [score for _, score in expected])
+
+
+def fake_model_client(server):
+    from openai import OpenAI
+    return OpenAI(base_url=f"{server.url}/v1", api_key="bench", max_retries=0)
+
+
+def bench_augment(args):
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    import augment
+
+    import load2
+
+    with open("load2.csv", encoding="utf-8") as file:
+        rows = list(csv.DictReader(file))
+    documents = [{"_id": i, "description": load2.create_description(rows[i % len(rows)])} for i in range(args.documents)]
+
+    with FakeModelServer(latency=args.latency, error_rate=args.error_rate) as server:
+        llm = fake_model_client(server)
+        print(f"{'concurrency':>11}  {'seconds':>7}  {'docs/sec':>8}  {'requests':>8}  written")
+        for concurrency in args.concurrency:
+            server.requests = 0
+            collection = NullCollection()
+            limits = augment.RequestLimits(args.requests_per_minute, args.tokens_per_minute)
+            start = time.perf_counter()
+            augmented, failed = augment.augment_all([dict(doc) for doc in documents], collection, llm,
+                                                    concurrency, limits, progress=False)
+            elapsed = time.perf_counter() - start
+            assert failed == 0 and collection.writes == len(documents)
+            print(f"{concurrency:>11}  {elapsed:>7.2f}  {augmented / elapsed:>8.1f}  {server.requests:>8}  "
+                  f"{collection.writes}")
+
+
+def bench_augment_cache(args):
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    import augment
+    import load2
+    from augment_cache import AugmentCache
+
+    with open("load2.csv", encoding="utf-8") as file:
+        rows = list(csv.DictReader(file))
+    # Every description appears twice, like a scholarship loaded by both load.py and load2.py
+    documents = [{"_id": i, "description": load2.create_description(rows[(i // 2) % len(rows)])}
+                 for i in range(args.documents)]
+
+    with FakeModelServer(latency=args.latency) as server, tempfile.TemporaryDirectory() as tmp:
+        llm = fake_model_client(server)
+        cache = AugmentCache(os.path.join(tmp, "augment_cache.sqlite"))
+        print(f"{'run':>6}  {'seconds':>7}  {'requests':>8}  {'hit rate':>8}")
+        for run in ("first", "rerun"):
+            server.requests = 0
+            cache_hits, cache_misses = cache.get_stats()["hits"], cache.get_stats()["misses"]
+            start = time.perf_counter()
+            augment.augment_all([dict(doc) for doc in documents], NullCollection(), llm, args.concurrency,
+                                augment.RequestLimits(100_000, 100_000_000), progress=False, cache=cache)
+            elapsed = time.perf_counter() - start
+            hits = cache.get_stats()["hits"] - cache_hits
+            lookups = hits + cache.get_stats()["misses"] - cache_misses
+            print(f"{run:>6}  {elapsed:>7.2f}  {server.requests:>8}  {hits / lookups:>8.0%}")
+        cache.close()
+
+
+def bench_augment_pack(args):
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    import augment
+    import load2
+
+    with open("load2.csv", encoding="utf-8") as file:
+        rows = list(csv.DictReader(file))
+    # Distinct descriptions, so identical ones in flight are not coalesced into one request
+    descriptions = [load2.create_description({**rows[i % len(rows)], "Link": f"{rows[i % len(rows)]['Link']}-{i}"})
+                    for i in range(args.documents)]
+
+    with FakeModelServer(latency=args.latency, mismatch_rate=args.mismatch_rate,
+                         token_latency=args.token_latency) as server:
+        llm = fake_model_client(server)
+        print(f"{'pack':>4}  {'seconds':>7}  {'docs/sec':>8}  {'requests':>8}  {'tokens/doc':>10}")
+        for pack_size in args.pack:
+            server.requests = server.prompt_tokens = server.completion_tokens = 0
+            documents = [{"_id": i, "description": description} for i, description in enumerate(descriptions)]
+            limits = augment.RequestLimits(args.requests_per_minute, 100_000_000)
+            start = time.perf_counter()
+            augmented, failed = augment.augment_all(documents, NullCollection(), llm, args.concurrency, limits,
+                                                    progress=False, pack_size=pack_size)
+            elapsed = time.perf_counter() - start
+            assert failed == 0 and augmented == len(documents)
+            tokens = (server.prompt_tokens + server.completion_tokens) / augmented
+            print(f"{pack_size:>4}  {elapsed:>7.2f}  {augmented / elapsed:>8.1f}  {server.requests:>8}  {tokens:>10.0f}")
+
+
+def bench_preextract(args):
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    import augment
+    import load2
+    import preextract
+
+    with open("load2.csv", encoding="utf-8") as file:
+        rows = list(csv.DictReader(file))
+    descriptions = [load2.create_description(rows[i % len(rows)]) for i in range(args.documents)]
+
+    start = time.perf_counter()
+    extracted = preextract.preextract_many(descriptions)
+    elapsed = time.perf_counter() - start
+    resolved = sum(len(fields) for fields in extracted) / len(extracted)
+    print(f"rules: {len(descriptions) / elapsed:,.0f} docs/sec, {resolved:.1f} of "
+          f"{len(augment.AugmentedScholarship.model_fields)} fields resolved per document")
+
+    with FakeModelServer(latency=args.latency) as server:
+        llm = fake_model_client(server)
+        print(f"{'mode':>8}  {'seconds':>7}  {'docs/sec':>8}  {'prompt tok/doc':>14}  {'completion tok/doc':>18}")
+        for mode, rules in (("model", False), ("rules", True)):
+            server.prompt_tokens = server.completion_tokens = 0
+            documents = [{"_id": i, "description": description} for i, description in enumerate(descriptions)]
+            # A token budget tight enough that response size decides the pace, as with a real account
+            limits = augment.RequestLimits(100_000, args.tokens_per_minute)
+            start = time.perf_counter()
+            augmented, failed = augment.augment_all(documents, NullCollection(), llm, args.concurrency, limits,
+                                                    progress=False, rules=rules)
+            elapsed = time.perf_counter() - start
+            assert failed == 0
+            # Duplicate descriptions coalesce onto one request, and must still record the fields the rules filled
+            assert all(doc["rule_fields"] == (sorted(fields) if rules else [])
+                       for doc, fields in zip(documents, extracted))
+            print(f"{mode:>8}  {elapsed:>7.2f}  {augmented / elapsed:>8.1f}  "
+                  f"{server.prompt_tokens / augmented:>14.0f}  {server.completion_tokens / augmented:>18.0f}")
+
+
+def fake_batch_results(request_path, result_path, error_every=7, invalid_every=11, malformed_every=13):
+    """Answer a batch input file like the provider would, with some failed and malformed lines.
+
+    Every `malformed_every`th line is cut short, and the last one has no trailing newline.
+    """
+    from jsonl import read_records
+
+    lines = []
+    for number, request in enumerate(read_records(request_path)):
+        line = {"id": f"batch_req_{number}", "custom_id": request["custom_id"], "response": None, "error": None}
+        if number % error_every == 0:
+            line["error"] = {"code": "server_error", "message": "The model produced no output"}
+        else:
+            schema = request["body"]["response_format"]["json_schema"]["schema"]
+            content = json.dumps(fake_instance(schema, schema.get("$defs", {}), {}))
+            if number % invalid_every == 0:
+                content = content[:len(content) // 2]
+            message = {"role": "assistant", "content": content, "refusal": None}
+            line["response"] = {"status_code": 200, "request_id": f"req_{number}",
+                                "body": {"choices": [{"index": 0, "message": message, "finish_reason": "stop"}]}}
+        text = json.dumps(line)
+        lines.append(text[:len(text) // 2] if number % malformed_every == 1 else text)
+    with open(result_path, 'w', encoding='utf-8') as file:
+        file.write('\n'.join(lines))
+
+
+def bench_augment_batch(args):
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    import augment_batch
+    import load2
+    from augment import pending_query
+    from jsonl import read_records
+
+    collection = bench_database(args)["augment_batch"]
+    scholarships = list(load2.read_scholarships("load2.csv"))
+    collection.insert_many([dict(scholarships[i % len(scholarships)]) for i in range(args.documents)])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'round':>5}  {'pending':>7}  {'requests':>8}  {'applied':>7}  {'failed':>6}")
+        for round_number in range(1, 4):
+            pending = collection.count_documents(pending_query())
+            if not pending:
+                break
+            paths = augment_batch.write_batch_requests(os.path.join(tmp, f"round{round_number}"), collection,
+                                                       max_requests=args.max_requests)
+            requests = 0
+            results = []
+            for path in paths:
+                results.append(path.replace(".jsonl", "-results.jsonl"))
+                fake_batch_results(path, results[-1])
+                requests += sum(1 for _ in read_records(path))
+            applied, failed = augment_batch.ingest_batch_results(results, collection)
+            assert requests == pending and applied + failed == pending
+            assert collection.count_documents({"augmentation_version": {"$exists": True}, "summary": None}) == 0
+            print(f"{round_number:>5}  {pending:>7}  {requests:>8}  {applied:>7}  {failed:>6}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline Equalify benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    scrape_parser = subparsers.add_parser("scrape", help="crawl throughput against a local fixture site")
+    scrape_parser.add_argument("--pages", type=int, default=8)
+    scrape_parser.add_argument("--per-page", type=int, default=25)
+    scrape_parser.add_argument("--latency", type=float, default=0.02, help="simulated seconds per response")
+    scrape_parser.add_argument("--rate", type=float, default=1000.0, help="per-host request limit")
+    scrape_parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    scrape_parser.set_defaults(run=bench_scrape)
+
+    recrawl_parser = subparsers.add_parser("recrawl", help="incremental re-crawl cost with the crawl cache")
+    # Many short listing pages, so several finish together and each hands out more of them
+    recrawl_parser.add_argument("--pages", type=int, default=40)
+    recrawl_parser.add_argument("--per-page", type=int, default=5)
+    recrawl_parser.add_argument("--latency", type=float, default=0.02, help="simulated seconds per response")
+    recrawl_parser.add_argument("--rate", type=float, default=1000.0, help="per-host request limit")
+    recrawl_parser.add_argument("--concurrency", type=int, default=8)
+    recrawl_parser.set_defaults(run=bench_recrawl)
+
+    extract_parser = subparsers.add_parser("extract", help="description extraction docs/sec on fixture HTML")
+    extract_parser.add_argument("--documents", type=int, default=500)
+    extract_parser.add_argument("--workers", type=int, nargs="+", default=[2, 4])
+    extract_parser.set_defaults(run=bench_extract)
+
+    load_parser = subparsers.add_parser("load", help="insert_one loop versus batched upserts")
+    load_parser.add_argument("--records", type=int, default=100_000)
+    load_parser.add_argument("--batch-size", type=int, default=1000)
+    add_database_arguments(load_parser)
+    load_parser.set_defaults(run=bench_load)
+
+    interactions_parser = subparsers.add_parser("interactions",
+                                                help="save/apply/favorite clicks: update_one versus write-behind")
+    interactions_parser.add_argument("--users", type=int, default=20, help="users clicking at once")
+    interactions_parser.add_argument("--clicks", type=int, default=20_000)
+    interactions_parser.add_argument("--scholarships", type=int, default=200)
+    interactions_parser.add_argument("--interval", type=float, default=0.2, help="seconds between write-behind flushes")
+    add_database_arguments(interactions_parser)
+    interactions_parser.set_defaults(run=bench_interactions)
+
+    csv_parser = subparsers.add_parser("csv", help="load2.py ingestion throughput on a synthetic CSV")
+    csv_parser.add_argument("--rows", type=int, default=2_000_000)
+    csv_parser.add_argument("--chunk-size", type=int, default=50_000)
+    csv_parser.add_argument("--batch-size", type=int, default=1000)
+    csv_parser.add_argument("--load", action="store_true", help="also upsert the documents into a scratch database")
+    add_database_arguments(csv_parser)
+    csv_parser.set_defaults(run=bench_csv)
+
+    search_parser = subparsers.add_parser("search", help="Search query latency with and without the indexes")
+    search_parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    search_parser.add_argument("--repeat", type=int, default=20, help="timed runs per query")
+    search_parser.add_argument("--queries", type=int, default=6, help="filter queries to report, besides the text search")
+    add_database_arguments(search_parser)
+    search_parser.set_defaults(run=bench_search)
+
+    paginate_parser = subparsers.add_parser("paginate", help="one Search page: sort and slice versus keyset")
+    paginate_parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    paginate_parser.add_argument("--page-size", type=int, default=5)
+    add_database_arguments(paginate_parser)
+    paginate_parser.set_defaults(run=bench_paginate)
+
+    cards_parser = subparsers.add_parser("cards", help="bytes and time per Search page, full documents versus cards")
+    cards_parser.add_argument("--documents", type=int, default=50_000)
+    cards_parser.add_argument("--pages", type=int, default=200, help="pages read in a row")
+    add_database_arguments(cards_parser)
+    cards_parser.set_defaults(run=bench_cards)
+
+    catalog_parser = subparsers.add_parser("catalog", help="Search filters in MongoDB versus the in-memory catalog")
+    catalog_parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    catalog_parser.add_argument("--queries", type=int, default=50, help="filter combinations timed")
+    add_database_arguments(catalog_parser)
+    catalog_parser.set_defaults(run=bench_catalog)
+
+    facets_parser = subparsers.add_parser("facets", help="sidebar counts as one query per option versus one $facet")
+    facets_parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    facets_parser.add_argument("--queries", type=int, default=20, help="filter combinations timed")
+    add_database_arguments(facets_parser)
+    facets_parser.set_defaults(run=bench_facets)
+
+    fragments_parser = subparsers.add_parser("fragments",
+                                             help="Search page MongoDB calls and ms per click, page versus fragment reruns")
+    fragments_parser.add_argument("--documents", type=int, default=10_000)
+    fragments_parser.add_argument("--rounds", type=int, default=5, help="times each interaction is measured")
+    fragments_parser.add_argument("--timeout", type=float, default=60, help="seconds a script run may take")
+    add_database_arguments(fragments_parser)
+    fragments_parser.set_defaults(run=bench_fragments)
+
+    match_parser = subparsers.add_parser("match", help="UserData matching latency on an in-memory catalog")
+    match_parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    match_parser.add_argument("--profiles", type=int, default=50, help="student profiles matched")
+    match_parser.add_argument("--limit", type=int, default=20, help="scholarships returned per student")
+    match_parser.set_defaults(run=bench_match)
+
+    profile_matches_parser = subparsers.add_parser("profile-matches",
+                                                   help="stored profile matches: refresh cost per changed scholarship")
+    profile_matches_parser.add_argument("--documents", type=int, default=5_000)
+    profile_matches_parser.add_argument("--profiles", type=int, default=50, help="stored student profiles")
+    profile_matches_parser.add_argument("--changes", type=int, nargs="+", default=[10, 100, 1000],
+                                        help="scholarships changed before each refresh")
+    profile_matches_parser.add_argument("--limit", type=int, default=20, help="scholarships read per student")
+    add_database_arguments(profile_matches_parser)
+    profile_matches_parser.set_defaults(run=bench_profile_matches)
+
+    augment_parser = subparsers.add_parser("augment", help="augmentation docs/sec against a fake model server")
+    augment_parser.add_argument("--documents", type=int, default=200)
+    augment_parser.add_argument("--latency", type=float, default=0.5, help="simulated seconds per completion")
+    augment_parser.add_argument("--error-rate", type=float, default=0.05, help="fraction of requests answered 429")
+    augment_parser.add_argument("--requests-per-minute", type=float, default=100_000)
+    augment_parser.add_argument("--tokens-per-minute", type=float, default=100_000_000)
+    augment_parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    augment_parser.set_defaults(run=bench_augment)
+
+    augment_cache_parser = subparsers.add_parser("augment-cache", help="augmentation requests saved by the cache")
+    augment_cache_parser.add_argument("--documents", type=int, default=200)
+    augment_cache_parser.add_argument("--latency", type=float, default=0.2, help="simulated seconds per completion")
+    augment_cache_parser.add_argument("--concurrency", type=int, default=8)
+    augment_cache_parser.set_defaults(run=bench_augment_cache)
+
+    augment_pack_parser = subparsers.add_parser("augment-pack", help="packed requests versus one per document")
+    augment_pack_parser.add_argument("--documents", type=int, default=400)
+    augment_pack_parser.add_argument("--latency", type=float, default=0.3, help="simulated seconds per completion")
+    augment_pack_parser.add_argument("--token-latency", type=float, default=0.002,
+                                     help="simulated seconds per completion token")
+    augment_pack_parser.add_argument("--mismatch-rate", type=float, default=0.05,
+                                     help="fraction of packed answers missing an entry")
+    augment_pack_parser.add_argument("--requests-per-minute", type=float, default=1_000,
+                                     help="the request budget packing saves")
+    augment_pack_parser.add_argument("--concurrency", type=int, default=8)
+    augment_pack_parser.add_argument("--pack", type=int, nargs="+", default=[1, 4, 8, 16])
+    augment_pack_parser.set_defaults(run=bench_augment_pack)
+
+    preextract_parser = subparsers.add_parser("preextract", help="tokens and docs/sec with and without rule-based fields")
+    preextract_parser.add_argument("--documents", type=int, default=200)
+    preextract_parser.add_argument("--latency", type=float, default=0.2, help="simulated seconds per completion")
+    preextract_parser.add_argument("--concurrency", type=int, default=16)
+    preextract_parser.add_argument("--tokens-per-minute", type=float, default=1_000_000)
+    preextract_parser.set_defaults(run=bench_preextract)
+
+    augment_batch_parser = subparsers.add_parser("augment-batch", help="batch-file augmentation end to end, offline")
+    augment_batch_parser.add_argument("--documents", type=int, default=500)
+    augment_batch_parser.add_argument("--max-requests", type=int, default=200, help="requests per batch input file")
+    add_database_arguments(augment_batch_parser)
+    augment_batch_parser.set_defaults(run=bench_augment_batch)
+
+    args = parser.parse_args()
+    args.run(args)
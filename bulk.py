@@ -0,0 +1,57 @@
+from itertools import islice
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def upsert(record, key="id", timestamp="updated_at") -> UpdateOne:
+    """Set every field of `record` on the document matching `key`, creating it if needed.
+
+    `timestamp` is set to the server's time only when the document is new or
+    one of the fields changes, so re-loading identical data leaves documents
+    unmodified and readers can find what changed since a given time.
+    """
+    if not timestamp:
+        return UpdateOne({key: record[key]}, {"$set": record}, upsert=True)
+    # Within one $set stage every expression sees the document as it was before the update
+    previous = {field: f"${field}" for field in record}
+    fields = {field: {"$literal": value} for field, value in record.items()}
+    fields[timestamp] = {"$cond": [{"$ne": [previous, {"$literal": record}]}, "$$NOW", f"${timestamp}"]}
+    return UpdateOne({key: record[key]}, [{"$set": fields}], upsert=True)
+
+
+def bulk_upsert(collection, records, key="id", batch_size=DEFAULT_BATCH_SIZE, timestamp="updated_at"):
+    """Upsert records into `collection` in unordered bulk_write batches, matching on `key`.
+
+    Records are consumed lazily, so any iterable (including a generator over a
+    file) can be loaded without holding it in memory. Returns counts of
+    inserted, updated, unchanged and failed records; a failed record does not
+    stop the rest of its batch. Inserted and updated documents get the time of
+    the write in `timestamp` (see upsert).
+    """
+    collection.create_index(key)
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0, "failed": 0}
+
+    for batch in batched(records, batch_size):
+        operations = [upsert(record, key, timestamp) for record in batch]
+        try:
+            result = collection.bulk_write(operations, ordered=False).bulk_api_result
+        except BulkWriteError as e:
+            result = e.details
+            counts["failed"] += len(result["writeErrors"])
+            for error in result["writeErrors"]:
+                print(f"Error loading record {batch[error['index']].get(key)}: {error['errmsg']}")
+
+        counts["inserted"] += result["nUpserted"]
+        counts["updated"] += result["nModified"]
+        counts["unchanged"] += result["nMatched"] - result["nModified"]
+
+    return counts
@@ -0,0 +1,287 @@
+import calendar
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
+
+from scholarship_queries import FACET_FIELDS, FLAG_FIELDS, REWARD_BUCKETS
+
+CATEGORY_FIELDS = ['preferred_ethnicity', 'preferred_gender', 'preferred_major', 'university', 'location']
+SNAPSHOT_FIELDS = ['reward', 'due_date', 'updated_at'] + CATEGORY_FIELDS + FLAG_FIELDS
+LAST = np.iinfo(np.int64).max  # Sort key of a missing due date
+EPOCH = datetime(1970, 1, 1)
+
+
+def epoch_milliseconds(moment) -> int:
+    # MongoDB returns naive UTC datetimes; timegm reads them as UTC where datetime.timestamp() would not
+    return calendar.timegm(moment.utctimetuple()) * 1000 + moment.microsecond // 1000
+
+
+def from_epoch_milliseconds(milliseconds) -> datetime:
+    """The naive UTC datetime MongoDB would return for `milliseconds`."""
+    return EPOCH + timedelta(milliseconds=milliseconds)
+
+
+def first_set(mask, start, count, chunk=1 << 16):
+    """Positions of the first `count` true values of `mask` from `start` on, scanning only as far as needed."""
+    found = []
+    while start < len(mask) and len(found) < count:
+        found += (np.flatnonzero(mask[start:start + chunk])[:count - len(found)] + start).tolist()
+        start += chunk
+    return np.array(found, dtype=np.int64)
+
+
+class Catalog:
+    """An in-memory, columnar copy of the fields the Search sidebar filters on.
+
+    Rows are kept in the Search page order, (due_date, _id) with missing due
+    dates last, so a page is the next few set bits of a mask. Flags are NumPy
+    boolean columns, categorical fields are dictionary-encoded (code 0 is None)
+    and rewards are codes into their sorted distinct values, so a reward range
+    is one comparison and a filter combination a handful of vectorized ANDs.
+    Text search is not covered; see `supports`.
+
+    Only augmented scholarships (those with a reward) are held, as only those
+    match a Search query. `refresh` reads the documents whose updated_at moved
+    since the last read; scholarships deleted from MongoDB stay until `load`
+    runs again. Queries and refreshes may come from different threads.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__positions = {}  # _id -> row
+        self.__ids = np.empty(0, dtype=object)
+        self.__id_keys = np.empty(0, dtype='S12')
+        self.__reward = np.empty(0)
+        self.__due = np.empty(0, dtype=np.int64)  # Milliseconds since the epoch, LAST when missing
+        self.__flags = {flag: np.empty(0, dtype=bool) for flag in FLAG_FIELDS}
+        self.__codes = {field: np.empty(0, dtype=np.int32) for field in CATEGORY_FIELDS}
+        self.__values = {field: [None] for field in CATEGORY_FIELDS}  # code -> value
+        self.__lookup = {field: {None: 0} for field in CATEGORY_FIELDS}  # value -> code
+        self.__reward_values = np.empty(0)  # Distinct rewards, ascending
+        self.__reward_codes = np.empty(0, dtype=np.uint32)
+        self.__watermark = None
+        self.__refreshed = 0.0
+
+    @staticmethod
+    def query(after=None) -> dict:
+        query = {"reward": {"$type": "number"}}
+        if after is not None:
+            query["updated_at"] = {"$gte": after}  # Same-millisecond writes are read again, which is harmless
+        return query
+
+    @classmethod
+    def load(cls, collection):
+        """A snapshot of the whole collection."""
+        catalog = cls()
+        catalog.refresh(collection)
+        return catalog
+
+    def refresh(self, collection) -> int:
+        """Apply the documents changed since the last refresh; returns how many were read."""
+        projection = dict.fromkeys(SNAPSHOT_FIELDS, 1)
+        docs = list(collection.find(self.query(self.__watermark), projection))
+        with self.__lock:
+            self.__apply(docs)
+            self.__refreshed = time.monotonic()
+        return len(docs)
+
+    def refresh_if_older(self, collection, seconds: float) -> int:
+        if time.monotonic() - self.__refreshed < seconds:
+            return 0
+        return self.refresh(collection)
+
+    def __encode(self, field, value) -> int:
+        code = self.__lookup[field].get(value)
+        if code is None:
+            code = self.__lookup[field][value] = len(self.__values[field])
+            self.__values[field].append(value)
+        return code
+
+    def __apply(self, docs):
+        if not docs:
+            return
+        new = [doc for doc in docs if doc["_id"] not in self.__positions]
+        for row, doc in enumerate(new, len(self.__ids)):
+            self.__positions[doc["_id"]] = row
+
+        def grow(column, fill):
+            return np.concatenate([column, np.full(len(new), fill, dtype=column.dtype)]) if new else column
+
+        self.__ids = grow(self.__ids, None)
+        self.__id_keys = grow(self.__id_keys, b'')
+        self.__reward = grow(self.__reward, 0.0)
+        self.__due = grow(self.__due, LAST)
+        self.__flags = {flag: grow(column, False) for flag, column in self.__flags.items()}
+        self.__codes = {field: grow(column, 0) for field, column in self.__codes.items()}
+
+        rows = np.fromiter((self.__positions[doc["_id"]] for doc in docs), dtype=np.int64, count=len(docs))
+        self.__ids[rows] = [doc["_id"] for doc in docs]
+        # ObjectIds order like their 12 bytes, which gives the same _id tie-break as MongoDB's sort
+        self.__id_keys[rows] = [getattr(doc["_id"], "binary", b'') for doc in docs]
+        self.__reward[rows] = [doc.get("reward") or 0.0 for doc in docs]
+        self.__due[rows] = [epoch_milliseconds(doc["due_date"]) if doc.get("due_date") else LAST for doc in docs]
+        for flag, column in self.__flags.items():
+            column[rows] = [bool(doc.get(flag)) for doc in docs]
+        for field, column in self.__codes.items():
+            column[rows] = [self.__encode(field, doc.get(field)) for doc in docs]
+        stamps = [doc["updated_at"] for doc in docs if doc.get("updated_at")]
+        if stamps:
+            self.__watermark = max(stamps + ([self.__watermark] if self.__watermark else []))
+
+        self.__sort_rows()
+
+    def __sort_rows(self):
+        # Put the rows in page order and remember where each _id went
+        order = np.lexsort((self.__id_keys, self.__due))
+        self.__ids, self.__id_keys = self.__ids[order], self.__id_keys[order]
+        self.__reward, self.__due = self.__reward[order], self.__due[order]
+        self.__flags = {flag: column[order] for flag, column in self.__flags.items()}
+        self.__codes = {field: column[order] for field, column in self.__codes.items()}
+        self.__positions = dict(zip(self.__ids.tolist(), range(len(self.__ids))))
+        values, codes = np.unique(self.__reward, return_inverse=True)
+        self.__reward_values, self.__reward_codes = values, codes.astype(np.uint32)
+
+    @staticmethod
+    def supports(filters) -> bool:
+        """Whether normalize_filters output can be answered here (text search needs MongoDB)."""
+        return not filters[0]
+
+    def __category_mask(self, field, value, pattern=False):
+        codes = self.__codes[field]
+        if not pattern:
+            code = self.__lookup[field].get(value)
+            return codes == code if code is not None else np.zeros(len(codes), dtype=bool)
+        # A regex is matched against each distinct value once, not against every row
+        regex = re.compile(value, re.IGNORECASE)
+        matching = [code for code, text in enumerate(self.__values[field]) if text is not None and regex.search(text)]
+        return np.isin(codes, matching)
+
+    def __masks(self, filters) -> dict:
+        """A mask per filter that excludes anything, keyed by field."""
+        _, ethnicity, gender, major, min_reward, max_reward, flags, due_window = filters
+        masks = {}
+        low = np.searchsorted(self.__reward_values, min_reward, side='left')
+        high = np.searchsorted(self.__reward_values, max_reward, side='right')
+        if low > 0 or high < len(self.__reward_values):
+            # Codes low..high-1 are in range; unsigned wrap-around turns that into one comparison
+            masks['reward'] = self.__reward_codes - np.uint32(low) < np.uint32(max(high - low, 0))
+        if ethnicity != "All":
+            masks['preferred_ethnicity'] = self.__category_mask('preferred_ethnicity', ethnicity)
+        if gender != "All":
+            masks['preferred_gender'] = self.__category_mask('preferred_gender', gender)
+        if major:
+            masks['preferred_major'] = self.__category_mask('preferred_major', major, pattern=True)
+        masks.update((flag, self.__flags[flag]) for flag in flags)
+        if due_window is not None:
+            # Rows are in due date order, so the window is one slice
+            start, end = np.searchsorted(self.__due, [epoch_milliseconds(moment) for moment in due_window])
+            masks['due_date'] = np.zeros(len(self.__due), dtype=bool)
+            masks['due_date'][start:end] = True
+        return masks
+
+    @staticmethod
+    def __combine(masks, excluded=None):
+        """The AND of `masks` other than `excluded`, or None if that leaves every row."""
+        selected = [mask for field, mask in masks.items() if field != excluded]
+        if not selected:
+            return None
+        mask = selected[0].copy()
+        for other in selected[1:]:
+            mask &= other
+        return mask
+
+    def __mask(self, filters):
+        """Which rows match `filters`, or None if all of them do."""
+        return self.__combine(self.__masks(filters))
+
+    def count(self, filters) -> int:
+        with self.__lock:
+            mask = self.__mask(filters)
+            return len(self.__ids) if mask is None else int(np.count_nonzero(mask))
+
+    def facets(self, filters) -> dict:
+        """The counts scholarship_queries.fetch_facets returns for `filters`."""
+        with self.__lock:
+            masks = self.__masks(filters)
+            mask = self.__combine(masks)
+            counts = {"total": len(self.__ids) if mask is None else int(np.count_nonzero(mask))}
+            for field in FACET_FIELDS:
+                others = self.__combine(masks, excluded=field)
+                codes = self.__codes[field] if others is None else self.__codes[field][others]
+                tally = np.bincount(codes, minlength=len(self.__values[field]))
+                counts[field] = {self.__values[field][code]: int(n) for code, n in enumerate(tally) if n}
+            counts["flags"] = {flag: int(np.count_nonzero(column if mask is None else column & mask))
+                               for flag, column in self.__flags.items()}
+
+            # Tally the distinct rewards, then add those up per bucket
+            others = self.__combine(masks, excluded='reward')
+            codes = self.__reward_codes if others is None else self.__reward_codes[others]
+            per_value = np.bincount(codes, minlength=len(self.__reward_values))
+            buckets = np.searchsorted(REWARD_BUCKETS, self.__reward_values, side='right') - 1
+            buckets[buckets < 0] = len(REWARD_BUCKETS) - 1  # Like $bucket's default
+            tally = np.bincount(buckets, weights=per_value, minlength=len(REWARD_BUCKETS))
+            counts["reward"] = {bound: int(n) for bound, n in zip(REWARD_BUCKETS, tally)}
+            return counts
+
+    def page(self, filters, after=None, descending=False, page_size=5) -> list:
+        """The _ids of one page of results, in the order and with the `after` cursor of scholarship_queries.fetch_page."""
+        with self.__lock:
+            total = len(self.__ids)
+            mask = self.__mask(filters)
+            # Ranks count rows in the requested direction; the page starts after the rank of `after`
+            rank = -1
+            if after is not None and after[1] in self.__positions:
+                row = self.__positions[after[1]]
+                rank = total - 1 - row if descending else row
+            if mask is None:
+                ranks = np.arange(rank + 1, min(total, rank + 1 + page_size))
+            else:
+                ranks = first_set(mask[::-1] if descending else mask, rank + 1, page_size)
+            rows = total - 1 - ranks if descending else ranks
+            return self.__ids[rows].tolist()
+
+    def __accepted(self, predicate):
+        """The rows `predicate` accepts."""
+        mask = self.__due >= predicate.due_after
+        for field in CATEGORY_FIELDS:
+            values = self.__values[field]
+            accepted = np.fromiter((predicate.accepts(field, value) for value in values), dtype=bool,
+                                   count=len(values))
+            if not accepted.all():
+                mask &= accepted[self.__codes[field]]
+        for flag in predicate.unmet_flags:
+            mask &= ~self.__flags[flag]
+        return np.flatnonzero(mask)
+
+    def matching(self, predicate) -> list:
+        """The _id, reward and due_date of every row `predicate` accepts."""
+        with self.__lock:
+            rows = self.__accepted(predicate)
+            columns = zip(self.__ids[rows].tolist(), self.__reward[rows].tolist(), self.__due[rows].tolist())
+            return [{"_id": _id, "reward": reward,
+                     "due_date": None if due == LAST else from_epoch_milliseconds(due)} for _id, reward, due in columns]
+
+    def match(self, predicate, score, limit=20) -> list:
+        """(_id, score) of the `limit` best-scoring rows that `predicate` accepts, best first.
+
+        `predicate` is a matching.Predicate, tested once per distinct value of
+        each categorical field; `score(reward, due)` scores the reward and due
+        date columns of the accepted rows.
+        """
+        with self.__lock:
+            rows = self.__accepted(predicate)
+            scores = score(self.__reward[rows], self.__due[rows])
+            best = np.argpartition(-scores, limit)[:limit] if len(rows) > limit else np.arange(len(rows))
+            best = best[np.argsort(-scores[best], kind='stable')]
+            return list(zip(self.__ids[rows[best]].tolist(), scores[best].tolist()))
+
+    def __len__(self):
+        return len(self.__ids)
+
+    def get_stats(self) -> dict:
+        columns = [self.__id_keys, self.__reward, self.__due, self.__reward_values, self.__reward_codes,
+                   *self.__flags.values(), *self.__codes.values()]
+        return {"rows": len(self.__ids), "bytes": sum(column.nbytes for column in columns),
+                "watermark": self.__watermark}
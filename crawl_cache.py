@@ -0,0 +1,89 @@
+import hashlib
+import sqlite3
+import threading
+from collections import Counter
+
+DEFAULT_PATH = 'crawl_cache.sqlite'
+
+HIT = 'hit'          # Page unchanged: 304 Not Modified, or the same description as last time
+MISS = 'miss'        # URL never crawled before
+CHANGED = 'changed'  # URL crawled before, but its description is different now
+
+
+def description_hash(description: str) -> str:
+    return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+
+class CrawlCache:
+    """Persistent per-URL record of HTTP validators and extracted description hashes.
+
+    The scraper sends the stored ETag/Last-Modified back as conditional request
+    headers, and only pages that come back new or with a different description
+    need to be parsed, saved and loaded again.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__connection.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, description_hash TEXT)"
+        )
+        self.__lock = threading.Lock()
+        self.__stats = Counter()
+
+    def conditional_headers(self, url: str) -> dict:
+        with self.__lock:
+            row = self.__connection.execute(
+                "SELECT etag, last_modified FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+        headers = {}
+        if row and row[0]:
+            headers['If-None-Match'] = row[0]
+        if row and row[1]:
+            headers['If-Modified-Since'] = row[1]
+        return headers
+
+    def record(self, url: str, response, description: str = None) -> str:
+        """Store the response validators and classify the page as HIT, MISS or CHANGED.
+
+        `description` is None when the response was 304 Not Modified.
+        """
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        with self.__lock:
+            row = self.__connection.execute(
+                "SELECT description_hash FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+
+            if description is None:
+                status = HIT if row else MISS
+                digest = row[0] if row else None
+            else:
+                digest = description_hash(description)
+                if row is None:
+                    status = MISS
+                elif row[0] == digest:
+                    status = HIT
+                else:
+                    status = CHANGED
+
+            # A 304 may leave out validators it did not change, so those keep their stored values
+            keep = "COALESCE(excluded.{0}, {0})" if description is None else "excluded.{0}"
+            self.__connection.execute(
+                "INSERT INTO pages (url, etag, last_modified, description_hash) VALUES (?, ?, ?, ?) "
+                f"ON CONFLICT(url) DO UPDATE SET etag = {keep.format('etag')}, "
+                f"last_modified = {keep.format('last_modified')}, description_hash = excluded.description_hash",
+                (url, etag, last_modified, digest)
+            )
+            # Commit right away so the cache agrees with what has been written to scrape.jsonl
+            self.__connection.commit()
+            self.__stats[status] += 1
+        return status
+
+    def get_stats(self) -> dict:
+        return {status: self.__stats[status] for status in (HIT, MISS, CHANGED)}
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__connection.commit()
+            self.__connection.close()
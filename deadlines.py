@@ -0,0 +1,46 @@
+import argparse
+from pymongo import UpdateOne
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+from dotenv import load_dotenv
+import os
+
+from bulk import DEFAULT_BATCH_SIZE, batched
+from indexes import ensure_indexes
+from normalize import next_occurrence, today_utc
+from profile_matches import refresh_stored_matches
+
+
+def roll_deadlines(collection, today=None, batch_size=DEFAULT_BATCH_SIZE) -> int:
+    """Move recurring deadlines that have passed to their next occurrence; returns how many moved.
+
+    Only scholarships with recurring_deadline set are read, through the
+    recurring_due_date partial index. Moved documents get a new updated_at, so
+    the Search catalog and stored profile matches pick up the new date.
+    """
+    today = today or today_utc()
+    passed = collection.find({"recurring_deadline": True, "due_date": {"$lt": today}}, {"due_date": 1})
+    rolled = 0
+    for batch in batched(passed, batch_size):
+        operations = []
+        for doc in batch:
+            due_date = next_occurrence(doc["due_date"].month, doc["due_date"].day, today)
+            operations.append(UpdateOne({"_id": doc["_id"], "due_date": doc["due_date"]},
+                                        {"$set": {"due_date": due_date}, "$currentDate": {"updated_at": True}}))
+        rolled += collection.bulk_write(operations, ordered=False).modified_count
+    return rolled
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Move passed recurring deadlines to their next occurrence. Run it daily so the Search page's "
+                    "Closing filter stays complete; the loaders do this too.")
+    parser.parse_args()
+
+    load_dotenv()
+    client = MongoClient(os.getenv('MONGO_URI'), server_api=ServerApi('1'))
+    db = client['scholarship_db']
+    ensure_indexes(db['scholarships'])
+    print(f"Rolled {roll_deadlines(db['scholarships'])} recurring deadlines forward")
+    refresh_stored_matches(db)
+    client.close()
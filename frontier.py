@@ -0,0 +1,78 @@
+import re
+import threading
+from urllib.parse import urldefrag
+
+PAGE_PARAMETER = re.compile(r'[?&]page=(\d+)')
+
+
+class Frontier:
+    """Tracks which listing and scholarship pages still need to be fetched.
+
+    Links are canonicalized before they are queued: listing pages by their page
+    number and scholarship pages by their numeric ID, so every page is scheduled
+    exactly once no matter how often, or in which form, it is linked. IDs in
+    `done_ids` count as already scheduled.
+    """
+
+    def __init__(self, base_url: str, prefix: str, max_pages: int = None, done_ids=()):
+        self.__base_url = base_url
+        self.__listing_path = PAGE_PARAMETER.split(base_url)[0]
+        self.__prefix = prefix
+        self.__max_pages = max_pages
+        self.__seen_pages = set()
+        self.__seen_ids = set(done_ids)
+        self.__listings = []
+        self.__scholarships = []
+        self.__lock = threading.Lock()
+
+    def canonical_listing(self, link: str):
+        if not link.startswith(self.__listing_path):
+            return None
+        match = PAGE_PARAMETER.search(link)
+        if not match:
+            return None
+        return int(match.group(1))
+
+    def canonical_scholarship(self, link: str):
+        link = urldefrag(link).url.split('?')[0].rstrip('/')
+        if not link.startswith(self.__prefix):
+            return None
+        # The ID is at the end of the URL after the last '/'
+        id_number = link.split('/')[-1]
+        return id_number if id_number.isdigit() else None
+
+    def add_listing_page(self, page: int) -> None:
+        with self.__lock:
+            if page in self.__seen_pages:
+                return
+            if self.__max_pages is not None and page >= self.__max_pages:
+                return
+            self.__seen_pages.add(page)
+            self.__listings.append(f'{self.__base_url}{page}')
+
+    def add_scholarship(self, id_number: str) -> None:
+        with self.__lock:
+            if id_number in self.__seen_ids:
+                return
+            self.__seen_ids.add(id_number)
+            self.__scholarships.append(f'{self.__prefix}{id_number}')
+
+    def add_links(self, links) -> None:
+        for link in links:
+            page = self.canonical_listing(link)
+            if page is not None:
+                self.add_listing_page(page)
+                continue
+            id_number = self.canonical_scholarship(link)
+            if id_number is not None:
+                self.add_scholarship(id_number)
+
+    def pop_listings(self) -> list:
+        with self.__lock:
+            listings, self.__listings = self.__listings, []
+        return listings
+
+    def pop_scholarships(self) -> list:
+        with self.__lock:
+            scholarships, self.__scholarships = self.__scholarships, []
+        return scholarships
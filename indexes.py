@@ -0,0 +1,145 @@
+import argparse
+import sys
+from pymongo import ASCENDING, TEXT, IndexModel
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+from dotenv import load_dotenv
+import os
+
+from scholarship_queries import FLAG_FIELDS, build_query, closing_window, page_queries
+
+INDEXES = [
+    IndexModel([("id", ASCENDING)], name="id_1"),  # Upsert key of load.py and load2.py
+    IndexModel([("updated_at", ASCENDING)], name="updated_at_1"),  # Incremental reads of catalog.py
+    # Pending documents for augment.py, in the _id order it pages through them
+    IndexModel([("augmentation_version", ASCENDING), ("_id", ASCENDING)], name="augmentation_version_id"),
+    # Recurring deadlines that have passed, for deadlines.py to roll forward
+    IndexModel([("due_date", ASCENDING)], name="recurring_due_date",
+               partialFilterExpression={"recurring_deadline": True}),
+    # The search box; a collection can only have one text index
+    IndexModel([("title", TEXT), ("description", TEXT), ("extra_requirements", TEXT)], name="search_text",
+               weights={"title": 10, "extra_requirements": 3, "description": 1}, default_language="english"),
+]
+
+# Indexes for answering the Search filters from MongoDB with fetch_page. The Search page answers every
+# filter without a text search from catalog.Catalog, so nothing reads them and they would only add a write
+# to every upsert: ensure_indexes drops them, and bench.py creates them to measure fetch_page.
+# Equality fields first, then the (due_date, _id) page order, then the reward range (equality, sort, range)
+PAGE_ORDER = [("due_date", ASCENDING), ("_id", ASCENDING)]
+FILTER_INDEXES = [
+    IndexModel([("preferred_ethnicity", ASCENDING), ("preferred_gender", ASCENDING), *PAGE_ORDER,
+                ("reward", ASCENDING)], name="ethnicity_gender_due_date_id_reward"),
+    IndexModel([("preferred_gender", ASCENDING), *PAGE_ORDER, ("reward", ASCENDING)],
+               name="gender_due_date_id_reward"),
+    IndexModel([*PAGE_ORDER, ("reward", ASCENDING)], name="due_date_id_reward"),
+] + [
+    # Only the few documents with a flag set are indexed for it
+    IndexModel([(flag, ASCENDING), *PAGE_ORDER, ("reward", ASCENDING)], name=f"{flag}_due_date_id_reward",
+               partialFilterExpression={flag: True})
+    for flag in FLAG_FIELDS
+]
+
+# (label, filter) pairs built the way the Search page builds the queries it sends to MongoDB: text searches
+REPRESENTATIVE_QUERIES = [
+    ("text search", build_query(search="nursing scholarship")),
+    ("text search, gender", build_query(search="nursing scholarship", gender="Female")),
+    ("text search, closing", build_query(search="nursing scholarship", due_window=closing_window(30))),
+]
+# The Search filters FILTER_INDEXES serve, for bench.py
+FILTER_QUERIES = [
+    ("no filters", build_query()),
+    ("ethnicity", build_query(ethnicity="Hispanic")),
+    ("ethnicity and gender", build_query(ethnicity="Hispanic", gender="Female")),
+    ("gender", build_query(gender="Female")),
+    ("closing in 30 days", build_query(due_window=closing_window(30))),
+    ("gender, closing in 30 days", build_query(gender="Female", due_window=closing_window(30))),
+] + [(flag, build_query(flags=[flag])) for flag in FLAG_FIELDS]
+
+
+def ensure_indexes(collection) -> list:
+    """Create every index in INDEXES that does not exist yet, and drop any FILTER_INDEXES; returns the names created."""
+    existing = set(collection.index_information())
+    for index in FILTER_INDEXES:
+        if index.document["name"] in existing:
+            collection.drop_index(index.document["name"])
+    return collection.create_indexes(INDEXES)
+
+
+def index_report(collection) -> dict:
+    """Compare the collection's indexes with INDEXES.
+
+    Returns the names of defined indexes that are missing, existing indexes
+    that are not defined here, and existing indexes with no recorded use since
+    the server last started ($indexStats).
+    """
+    defined = {index.document["name"] for index in INDEXES}
+    existing = set(collection.index_information()) - {"_id_"}
+    usage = {stats["name"]: stats["accesses"]["ops"] for stats in collection.aggregate([{"$indexStats": {}}])}
+    return {
+        "missing": sorted(defined - existing),
+        "undefined": sorted(existing - defined),
+        "unused": sorted(name for name in existing if usage.get(name, 0) == 0),
+    }
+
+
+def winning_stages(plan: dict) -> list:
+    """The stages of a winning plan from the root down, as (stage, index name) pairs."""
+    plan = plan.get("queryPlan", plan)  # Plans from the slot-based engine are wrapped
+    stages = [(plan["stage"], plan.get("indexName"))]
+    for child in [plan["inputStage"]] if "inputStage" in plan else plan.get("inputStages", []):
+        stages += winning_stages(child)
+    return stages
+
+
+def explain_query(collection, query, limit=5) -> dict:
+    """How MongoDB answers the first page of `query`: the indexes used, documents examined and whether it sorts in memory."""
+    first_query, sort = page_queries(query)[0]
+    explanation = collection.find(first_query).sort(sort).limit(limit).explain()
+    stages = winning_stages(explanation["queryPlanner"]["winningPlan"])
+    statistics = explanation.get("executionStats", {})
+    return {
+        "indexes": [index for _, index in stages if index],
+        "collection_scan": any(stage == "COLLSCAN" for stage, _ in stages),
+        "in_memory_sort": any(stage == "SORT" for stage, _ in stages),
+        "examined": statistics.get("totalDocsExamined"),
+        "returned": statistics.get("nReturned"),
+    }
+
+
+def verify(collection) -> list:
+    """explain() every representative query; returns (label, explanation) for those that scan the collection."""
+    failures = []
+    for label, query in REPRESENTATIVE_QUERIES:
+        explanation = explain_query(collection, query)
+        print(f"{label:>22}: {', '.join(explanation['indexes']) or 'COLLSCAN'}"
+              f"{' + in-memory sort' if explanation['in_memory_sort'] else ''} "
+              f"({explanation['examined']} examined, {explanation['returned']} returned)")
+        if explanation["collection_scan"]:
+            failures.append((label, explanation))
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create and check the indexes behind the Search page")
+    parser.add_argument('command', choices=['create', 'report', 'verify'],
+                        help="create missing indexes, list missing/unused ones, or explain() the Search queries")
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = MongoClient(os.getenv('MONGO_URI'), server_api=ServerApi('1'))
+    scholarships = client['scholarship_db']['scholarships']
+
+    status = 0
+    if args.command == 'create':
+        print(f"Indexes in place: {', '.join(ensure_indexes(scholarships))}")
+    elif args.command == 'report':
+        for kind, names in index_report(scholarships).items():
+            print(f"{kind:>9}: {', '.join(names) or '-'}")
+    else:
+        failures = verify(scholarships)
+        if failures:
+            print(f"{len(failures)} queries scan the whole collection; run `python indexes.py create`")
+            status = 1
+
+    client.close()
+    sys.exit(status)
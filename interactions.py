@@ -0,0 +1,131 @@
+import threading
+from datetime import datetime, timezone
+from pymongo import ASCENDING, DESCENDING, IndexModel, UpdateOne
+from pymongo.errors import PyMongoError
+
+from scholarship_queries import CARD_FIELDS, fetch_by_ids
+
+KINDS = ['saved', 'applied', 'favorited']
+
+INDEXES = [
+    # One document per user and scholarship; every read starts with the user
+    IndexModel([("user", ASCENDING), ("scholarship_id", ASCENDING)], name="user_scholarship_id", unique=True),
+]
+
+
+def ensure_indexes(collection) -> list:
+    """Create the user_interactions indexes that do not exist yet; returns their names."""
+    return collection.create_indexes(INDEXES)
+
+
+class InteractionStore:
+    """Each user's saved, applied and favorited scholarships, written behind.
+
+    `record` only updates a buffer; a background thread writes it with one
+    bulk_write every `interval` seconds, or sooner once `max_pending` documents
+    are waiting. Clicks on the same scholarship by the same user between two
+    writes become one update holding the latest state of each kind. Reads add
+    what is still buffered to what is stored, so users see their clicks at once.
+    """
+
+    def __init__(self, interactions, scholarships, interval=1.0, max_pending=500):
+        self.__interactions = interactions
+        self.__scholarships = scholarships
+        self.__interval = interval
+        self.__max_pending = max_pending
+        self.__pending = {}  # (user, scholarship_id) -> {kind: (state, changed at)}
+        self.__lock = threading.Lock()
+        self.__flushing = threading.Lock()  # Batches are written one at a time, in order
+        self.__wake = threading.Event()
+        self.__closed = False
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def record(self, user, scholarship_id, kind, state=True) -> None:
+        if kind not in KINDS:
+            raise ValueError(f"Unknown interaction kind: {kind}")
+        with self.__lock:
+            self.__pending.setdefault((user, scholarship_id), {})[kind] = (state, datetime.now(timezone.utc))
+            full = len(self.__pending) >= self.__max_pending
+        if full:
+            self.__wake.set()
+
+    def __run(self):
+        while not self.__closed:
+            self.__wake.wait(self.__interval)
+            self.__wake.clear()
+            try:
+                self.flush()
+            except PyMongoError as e:
+                print(f"Writing interactions failed, retrying: {e}")
+
+    def flush(self) -> int:
+        """Write everything buffered; returns the number of documents updated."""
+        with self.__flushing:
+            with self.__lock:
+                batch, self.__pending = self.__pending, {}
+            if not batch:
+                return 0
+
+            operations = []
+            for (user, scholarship_id), changes in batch.items():
+                fields = {}
+                for kind, (state, changed_at) in changes.items():
+                    fields[kind] = state
+                    fields[f"{kind}_at"] = changed_at
+                operations.append(UpdateOne({"user": user, "scholarship_id": scholarship_id}, {"$set": fields},
+                                            upsert=True))
+            try:
+                self.__interactions.bulk_write(operations, ordered=False)
+            except PyMongoError:
+                # Keep the batch for the next flush, under anything clicked since; rewriting a state is harmless
+                with self.__lock:
+                    for key, changes in batch.items():
+                        self.__pending[key] = {**changes, **self.__pending.get(key, {})}
+                raise
+            return len(operations)
+
+    def close(self) -> None:
+        """Stop the background thread and write what is left."""
+        self.__closed = True
+        self.__wake.set()
+        self.__thread.join()
+        self.flush()
+
+    def __buffered(self, user) -> dict:
+        """The states of `user` not written yet: {scholarship_id: {kind: state}}."""
+        with self.__lock:
+            return {scholarship_id: {kind: state for kind, (state, _) in changes.items()}
+                    for (owner, scholarship_id), changes in self.__pending.items() if owner == user}
+
+    def scholarship_ids(self, user, kind) -> set:
+        """The _ids of the scholarships `user` has marked as `kind`."""
+        ids = {doc["scholarship_id"] for doc in self.__interactions.find({"user": user, kind: True},
+                                                                         {"scholarship_id": 1})}
+        for scholarship_id, changes in self.__buffered(user).items():
+            if changes.get(kind) is True:
+                ids.add(scholarship_id)
+            elif changes.get(kind) is False:
+                ids.discard(scholarship_id)
+        return ids
+
+    def scholarships(self, user, kind, projection=CARD_FIELDS) -> list:
+        """The scholarships `user` has marked as `kind`, latest first, joined in one aggregation."""
+        pipeline = [
+            {"$match": {"user": user, kind: True}},
+            {"$sort": {f"{kind}_at": DESCENDING}},
+            {"$lookup": {"from": self.__scholarships.name, "localField": "scholarship_id", "foreignField": "_id",
+                         "as": "scholarship"}},
+            {"$unwind": "$scholarship"},
+            {"$replaceRoot": {"newRoot": "$scholarship"}},
+            {"$project": projection},
+        ]
+        buffered = self.__buffered(user)
+        docs = [doc for doc in self.__interactions.aggregate(pipeline)
+                if buffered.get(doc["_id"], {}).get(kind, True)]
+
+        # Marked since the last write
+        shown = {doc["_id"] for doc in docs}
+        added = [scholarship_id for scholarship_id, changes in buffered.items()
+                 if changes.get(kind) is True and scholarship_id not in shown]
+        return fetch_by_ids(self.__scholarships, added, projection) + docs if added else docs
@@ -0,0 +1,71 @@
+import json
+import os
+
+
+def read_lines(path):
+    """Yield the non-blank lines of a JSONL file undecoded, including a last line with no trailing newline."""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                yield line
+
+
+def is_partial(line) -> bool:
+    """Whether `line` is a last line cut short by a crash: no trailing newline, and not valid JSON."""
+    if line.endswith('\n'):
+        return False
+    try:
+        json.loads(line)
+    except ValueError:
+        return True
+    return False
+
+
+def read_records(path):
+    """Yield the records of a JSONL file one at a time.
+
+    A final line cut short by a crash is skipped rather than treated as an error;
+    one that is complete apart from its newline is read like any other.
+    """
+    for line in read_lines(path):
+        if is_partial(line):
+            break
+        yield json.loads(line)
+
+
+class JsonlWriter:
+    """Appends records to a JSONL file, flushing each one so a crash loses nothing written."""
+
+    def __init__(self, path, resume=False):
+        if resume:
+            self.__truncate_partial_line(path)
+        self.__file = open(path, 'a' if resume else 'w', encoding='utf-8')
+        self.__count = 0
+
+    @staticmethod
+    def __truncate_partial_line(path):
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb+') as file:
+            data = file.read()
+            end = data.rfind(b'\n') + 1
+            if end == len(data):
+                return
+            # Keep a last record that only lacks its newline, as read_records does
+            if data[end:].strip() and not is_partial(data[end:].decode('utf-8', errors='replace')):
+                file.write(b'\n')
+            else:
+                file.truncate(end)
+
+    def write(self, record) -> None:
+        self.__file.write(json.dumps(record) + '\n')
+        self.__file.flush()
+        self.__count += 1
+
+    def get_count(self) -> int:
+        return self.__count
+
+    def close(self) -> None:
+        self.__file.close()
@@ -1,8 +1,16 @@
-import json
+import argparse
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 from dotenv import load_dotenv
 import os
+from tqdm import tqdm
+
+from bulk import DEFAULT_BATCH_SIZE, bulk_upsert
+from deadlines import roll_deadlines
+from indexes import ensure_indexes
+from jsonl import read_records
+from normalize import deadline_fields, mentioned_deadline, today_utc
+from profile_matches import refresh_stored_matches
 
 load_dotenv()
 
@@ -14,17 +22,36 @@ client = MongoClient(URI, server_api=ServerApi('1'))
 db = client['scholarship_db']
 scholarships = db['scholarships']
 
-# Load JSON data from file
-with open('scrape.json', 'r') as file:
-    scholarship_data = json.load(file)
 
-# Insert scholarships into MongoDB
-for scholarship in scholarship_data:
-    # Insert the scholarship
-    result = scholarships.insert_one(scholarship)
-    print(f"Inserted scholarship with ID: {result.inserted_id}")
+def with_deadline(record, today=None) -> dict:
+    """The scraped record with the deadline its description mentions, if any, parsed into a due date."""
+    return {**record, **deadline_fields(mentioned_deadline(record.get("description")), today)}
+
+
+def load_jsonl_to_mongodb(file_path, batch_size=DEFAULT_BATCH_SIZE):
+    # Stream scholarships from the scraper output and upsert them on their scraped ID,
+    # so re-running the loader updates documents instead of duplicating them
+    today = today_utc()
+    records = tqdm((with_deadline(record, today) for record in read_records(file_path)), desc="Loading scholarships")
+    return bulk_upsert(scholarships, records, key="id", batch_size=batch_size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load scraped scholarships into MongoDB, upserting on the scraped id so re-running it is safe. "
+                    "A deadline stated after \"Deadline:\" becomes due_date; one without a year, like \"28-Feb\", "
+                    "recurs every year, and \"Rolling\" sets rolling_deadline instead.")
+    parser.add_argument('file', nargs='?', default='scrape.jsonl')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="upserts sent per bulk_write")
+    args = parser.parse_args()
 
-print(f"Total scholarships inserted: {len(scholarship_data)}")
+    counts = load_jsonl_to_mongodb(args.file, args.batch_size)
+    print(f"Scholarships inserted: {counts['inserted']}, updated: {counts['updated']}, "
+          f"unchanged: {counts['unchanged']}, failed: {counts['failed']}")
+    ensure_indexes(scholarships)
+    print(f"Recurring deadlines rolled forward: {roll_deadlines(scholarships)}")
+    refresh_stored_matches(db)
 
-# Close the MongoDB connection
-client.close()
+    # Close the MongoDB connection
+    client.close()
@@ -1,10 +1,17 @@
-import csv
+import argparse
+import pandas as pd
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 from dotenv import load_dotenv
 import os
 from tqdm import tqdm
 
+from bulk import DEFAULT_BATCH_SIZE, batched, bulk_upsert
+from deadlines import roll_deadlines
+from indexes import ensure_indexes
+from normalize import clean_text, content_key, deadline_fields, parse_amount, parse_deadline, parse_list, today_utc
+from profile_matches import refresh_stored_matches
+
 # Load environment variables
 load_dotenv()
 
@@ -14,6 +21,10 @@ client = MongoClient(MONGO_URI, server_api=ServerApi('1'))
 db = client['scholarship_db']
 scholarships = db['scholarships']
 
+CHUNK_SIZE = 50_000  # CSV rows parsed at a time
+TEXT_COLUMNS = ['Scholarship Name', 'Deadline', 'Amount', 'Description', 'Location', 'Years', 'Link']
+
+
 def create_description(row):
     return f"Scholarship: {row['Scholarship Name']}\n" \
            f"Deadline: {row['Deadline']}\n" \
@@ -23,23 +34,81 @@ def create_description(row):
            f"Link: {row['Link']}\n" \
            f"Details: {row['Description']}"
 
-def load_csv_to_mongodb(file_path):
-    with open(file_path, 'r', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for index, row in enumerate(tqdm(reader, desc="Loading scholarships")):
-            try:
-                document = {
-                    "id": index + 1,  # Start IDs from 1
-                    "description": create_description(row)
-                }
-
-                # Insert into MongoDB
-                scholarships.insert_one(document)
-            except Exception as e:
-                print(f"Error processing row: {row}")
-                print(f"Error message: {str(e)}")
+
+def read_csv_chunks(file_path, chunk_size=CHUNK_SIZE):
+    """Yield the CSV as DataFrames of `chunk_size` rows with every text column cleaned."""
+    reader = pd.read_csv(file_path, dtype=str, keep_default_na=False, chunksize=chunk_size, encoding='utf-8')
+    for chunk in reader:
+        for column in TEXT_COLUMNS:
+            chunk[column] = chunk[column].map(clean_text)
+        yield chunk
+
+
+def create_documents(chunk, today=None):
+    """Turn a cleaned chunk into scholarship documents keyed on their content, not their row number.
+
+    Recurring deadlines get their next due date on or after `today` (see normalize.resolve_deadline).
+    """
+    today = today or today_utc()
+    for values in zip(*(chunk[column].tolist() for column in TEXT_COLUMNS)):
+        row = dict(zip(TEXT_COLUMNS, values))
+        deadline, rolling = parse_deadline(row['Deadline'])
+        yield {
+            "id": f"csv-{content_key(row['Scholarship Name'], row['Link'])}",
+            "description": create_description(row),
+            **deadline_fields(row['Deadline'], today),
+            "csv": {
+                "name": row['Scholarship Name'],
+                "link": row['Link'],
+                "amount": parse_amount(row['Amount']),
+                "deadline": deadline,
+                "rolling_deadline": rolling,
+                "locations": parse_list(row['Location']),
+                "years": parse_list(row['Years']),
+            }
+        }
+
+
+def read_scholarships(file_path, chunk_size=CHUNK_SIZE):
+    for chunk in read_csv_chunks(file_path, chunk_size):
+        yield from create_documents(chunk)
+
+
+def remove_row_numbered(collection) -> int:
+    """Delete CSV documents from before content keys, when `id` was the row number; returns how many.
+
+    Loading the same CSV again under csv-<sha1> ids would otherwise list every
+    scholarship twice. Their stored profile matches go with them.
+    """
+    query = {"id": {"$type": "number"}, "description": {"$regex": r"^Scholarship: .*\nDeadline: "}}
+    ids = [doc["_id"] for doc in collection.find(query, {"_id": 1})]
+    for batch in batched(ids, DEFAULT_BATCH_SIZE):
+        collection.delete_many({"_id": {"$in": batch}})
+        db["profile_matches"].delete_many({"scholarship_id": {"$in": batch}})
+    return len(ids)
+
+
+def load_csv_to_mongodb(file_path, chunk_size=CHUNK_SIZE, batch_size=DEFAULT_BATCH_SIZE):
+    documents = tqdm(read_scholarships(file_path, chunk_size), desc="Loading scholarships")
+    return bulk_upsert(scholarships, documents, key="id", batch_size=batch_size)
+
 
 if __name__ == "__main__":
-    csv_file_path = "load2.csv"  # Replace with your CSV file path
-    load_csv_to_mongodb(csv_file_path)
-    print("CSV data loaded into MongoDB successfully.")
+    parser = argparse.ArgumentParser(
+        description="Load a scholarship CSV into MongoDB, keyed on a hash of name and link, with deadlines "
+                    "parsed as load.py does. Documents an older "
+                    "version keyed on row numbers are removed first.")
+    parser.add_argument('file', nargs='?', default="load2.csv")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="CSV rows parsed at a time")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="upserts sent per bulk_write")
+    args = parser.parse_args()
+
+    removed = remove_row_numbered(scholarships)
+    if removed:
+        print(f"Removed {removed} scholarships loaded under row numbers by an earlier version")
+    counts = load_csv_to_mongodb(args.file, args.chunk_size, args.batch_size)
+    print(f"CSV data loaded into MongoDB: {counts['inserted']} inserted, {counts['updated']} updated, "
+          f"{counts['unchanged']} unchanged, {counts['failed']} failed.")
+    ensure_indexes(scholarships)
+    print(f"Recurring deadlines rolled forward: {roll_deadlines(scholarships)}")
+    refresh_stored_matches(db)
@@ -0,0 +1,128 @@
+import re
+from datetime import datetime, timezone
+import numpy as np
+
+from catalog import LAST, epoch_milliseconds
+
+LOW_INCOME_LIMIT = 60000  # Household income (USD) up to which low-income scholarships apply
+# Flags that limit a scholarship to students in that circumstance; merit and essay flags limit no one
+CIRCUMSTANCE_FLAGS = [
+    'prefers_lgbt', 'women_in_stem', 'disabilities', 'rural', 'immigrant_or_refugee', 'neurodiversity',
+    'low_income', 'first_generation',
+]
+# Preferences compared with the student's answers; ethnicity and gender must be equal, the rest mentioned
+PREFERENCE_FIELDS = ['preferred_ethnicity', 'preferred_gender', 'preferred_major', 'university', 'location']
+EXACT_FIELDS = {'preferred_ethnicity', 'preferred_gender'}
+# Free-text preferences list alternatives, e.g. "Nursing, Biology or Chemistry"
+ALTERNATIVES = re.compile(r'\s*(?:[,;/]|\bor\b|\band\b)\s*', re.IGNORECASE)
+WORD = re.compile(r'\w+')
+
+REWARD_WEIGHT = 0.7
+DEADLINE_WEIGHT = 0.3
+REWARD_SCALE = 100000  # Rewards from this amount up get the whole reward weight
+DEADLINE_HALF_LIFE = 30  # Days; a deadline this far off counts half as much as one due today
+DAY = 86_400_000  # Milliseconds
+
+
+def admits(preference, answer, exact=False) -> bool:
+    """Whether a scholarship's preference admits the student's answer; no preference admits everyone."""
+    if not preference:
+        return True
+    if not answer:
+        return False
+    if exact:
+        return preference.casefold() == answer.casefold()
+    # Whole words only, so "Art" admits "Studio Art" but not "Earth Science"
+    answer = words(answer)
+    alternatives = (words(alternative) for alternative in ALTERNATIVES.split(preference))
+    return any(alternative.strip() and (alternative in answer or answer in alternative) for alternative in alternatives)
+
+
+def words(text) -> str:
+    """The words of `text`, casefolded and space separated, with a space at each end for whole-word `in` tests."""
+    return f" {' '.join(WORD.findall(text.casefold()))} "
+
+
+def midnight(today=None) -> int:
+    """Milliseconds since the epoch at the start of `today` (UTC by default); deadlines are compared by day."""
+    return epoch_milliseconds(today or datetime.now(timezone.utc)) // DAY * DAY
+
+
+class Predicate:
+    """A UserData profile compiled into tests over the augmented fields.
+
+    A scholarship is open to the student when each preference it states
+    admits the student's answer, it has no circumstance flag the student
+    lacks and its deadline has not passed. Scholarships without a due date
+    stay open, and with `include_closed` deadlines are not tested at all.
+    """
+
+    def __init__(self, user, today=None, include_closed=False):
+        self.__answers = dict(zip(PREFERENCE_FIELDS, [user.get_ethnicity(), user.get_gender(), user.get_major(),
+                                                      user.get_university(), user.get_location()]))
+        circumstances = set(user.get_circumstances())
+        # An income of 0 is the form's default, so like a missing one it says nothing about the student
+        if user.get_income() and user.get_income() <= LOW_INCOME_LIMIT:
+            circumstances.add('low_income')
+        self.met_flags = [flag for flag in CIRCUMSTANCE_FLAGS if flag in circumstances]
+        self.unmet_flags = [flag for flag in CIRCUMSTANCE_FLAGS if flag not in circumstances]
+        # Deadlines are compared by day, so a scholarship due today is still open
+        self.due_after = midnight(today)
+        if include_closed:
+            self.due_after = np.iinfo(np.int64).min
+
+    def answer(self, field):
+        return self.__answers[field]
+
+    def accepts(self, field, value) -> bool:
+        return admits(value, self.__answers[field], exact=field in EXACT_FIELDS)
+
+    def accepts_document(self, doc) -> bool:
+        """The same test for a single scholarship document."""
+        if doc.get("due_date") and epoch_milliseconds(doc["due_date"]) < self.due_after:
+            return False
+        if any(doc.get(flag) for flag in self.unmet_flags):
+            return False
+        return all(self.accepts(field, doc.get(field)) for field in PREFERENCE_FIELDS)
+
+
+def score(reward, due, today, reward_weight=REWARD_WEIGHT, deadline_weight=DEADLINE_WEIGHT):
+    """Rank of scholarships by reward (on a log scale) and nearness of the deadline, for arrays of both.
+
+    `due` and `today` are milliseconds since the epoch, `due` LAST when missing;
+    scholarships without a due date get no deadline weight.
+    """
+    rewards = np.log1p(np.clip(reward, 0, REWARD_SCALE)) / np.log1p(REWARD_SCALE)
+    days_left = np.maximum(due - today, 0) / DAY
+    deadlines = np.where(due == LAST, 0.0, 0.5 ** (days_left / DEADLINE_HALF_LIFE))
+    return reward_weight * rewards + deadline_weight * deadlines
+
+
+def score_expression(today, reward_weight=REWARD_WEIGHT, deadline_weight=DEADLINE_WEIGHT) -> dict:
+    """`score` as an aggregation expression over documents with reward and due_date; `today` is a datetime."""
+    capped = {"$min": [{"$max": [{"$ifNull": ["$reward", 0]}, 0]}, REWARD_SCALE]}
+    rewards = {"$divide": [{"$ln": {"$add": [1, capped]}}, float(np.log1p(REWARD_SCALE))]}
+    days_left = {"$divide": [{"$max": [{"$subtract": ["$due_date", today]}, 0]}, DAY]}
+    halvings = {"$divide": [days_left, DEADLINE_HALF_LIFE]}
+    deadlines = {"$cond": [{"$ifNull": ["$due_date", False]}, {"$pow": [0.5, halvings]}, 0]}
+    return {"$add": [{"$multiply": [reward_weight, rewards]}, {"$multiply": [deadline_weight, deadlines]}]}
+
+
+def match(catalog, user, limit=20, today=None, reward_weight=REWARD_WEIGHT, deadline_weight=DEADLINE_WEIGHT) -> list:
+    """The `limit` scholarships in a catalog.Catalog that are open to `user`, best first, as (_id, score) pairs."""
+    predicate = Predicate(user, today)
+    return catalog.match(predicate, lambda reward, due: score(reward, due, predicate.due_after, reward_weight,
+                                                                deadline_weight), limit)
+
+
+def match_documents(docs, user, limit=20, today=None, reward_weight=REWARD_WEIGHT,
+                    deadline_weight=DEADLINE_WEIGHT) -> list:
+    """`match` one document at a time, for checking it and for documents outside a catalog."""
+    predicate = Predicate(user, today)
+    matches = []
+    for doc in docs:
+        if predicate.accepts_document(doc):
+            due = epoch_milliseconds(doc["due_date"]) if doc.get("due_date") else LAST
+            matches.append((doc["_id"], float(score(doc.get("reward") or 0.0, np.int64(due), predicate.due_after,
+                                                    reward_weight, deadline_weight))))
+    return sorted(matches, key=lambda match: -match[1])[:limit]
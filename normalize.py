@@ -0,0 +1,134 @@
+import calendar
+import hashlib
+import html
+import re
+from datetime import datetime, timezone
+
+AMOUNT = re.compile(r'^\$?\s*(\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?$')
+NO_DEADLINE = {'', 'none', 'varies', 'n/a'}
+MONTHS = {name.casefold(): number for names in (calendar.month_name, calendar.month_abbr)
+          for number, name in enumerate(names) if name} | {'sept': 9}
+# Dates as they appear in deadlines: "28-Feb", "March 1", "March 1, 2026", "2026-03-01" and "3/1/2026"
+DEADLINE_PATTERNS = [
+    re.compile(r'(?P<day>\d{1,2})[-\s](?P<month>[a-z]+)\.?(?:[-\s,]+(?P<year>\d{4}))?\b', re.IGNORECASE),
+    re.compile(r'(?P<month>[a-z]+)\.?\s+(?P<day>\d{1,2})(?:st|nd|rd|th)?\b(?:,?\s+(?P<year>\d{4}))?', re.IGNORECASE),
+    re.compile(r'(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})\b'),
+    re.compile(r'(?P<month>\d{1,2})/(?P<day>\d{1,2})/(?P<year>\d{4})\b'),
+]
+# Where free-text descriptions state a deadline, e.g. "Application deadline: March 1"
+DEADLINE_MENTION = re.compile(r'\bdeadline\b[^:\n]{0,30}:\s*([^\n]+)', re.IGNORECASE)
+NO_RESTRICTIONS = {'', 'no restrictions', 'no geographic restrictions'}
+SUMMARY_LENGTH = 240
+
+
+def clean_text(value) -> str:
+    """Decode HTML entities (e.g. "&#039;") and collapse runs of whitespace."""
+    if value is None:
+        return ''
+    value = str(value)
+    if '&' in value:
+        value = html.unescape(value)
+    return ' '.join(value.split())
+
+
+def parse_amount(value):
+    """Turn an amount like "25,000" or "$1,500" into a float, or None if it is not a plain number."""
+    match = AMOUNT.match(clean_text(value))
+    if not match:
+        return None
+    return float(match.group(0).lstrip('$').replace(',', '').strip())
+
+
+def parse_deadline(value):
+    """Return (deadline text, rolling flag); the text is None when there is no fixed deadline."""
+    deadline = clean_text(value)
+    if deadline.lower() == 'rolling':
+        return None, True
+    if deadline.lower() in NO_DEADLINE:
+        return None, False
+    return deadline, False
+
+
+def next_occurrence(month, day, today) -> datetime:
+    """The first `month`-`day` on or after `today`, skipping years without that day (February 29)."""
+    year = today.year
+    while True:
+        if day <= calendar.monthrange(year, month)[1] and datetime(year, month, day) >= today:
+            return datetime(year, month, day)
+        year += 1
+
+
+def today_utc() -> datetime:
+    """Midnight UTC today, as the naive datetime MongoDB stores dates in."""
+    now = datetime.now(timezone.utc)
+    return datetime(now.year, now.month, now.day)
+
+
+def resolve_deadline(deadline, today=None):
+    """Return (due date, recurring flag) for deadline text from parse_deadline.
+
+    A day and month without a year ("28-Feb") recur every year and resolve to
+    their next occurrence on or after `today` (a naive UTC date, today if None).
+    Several dates ("November 30; April 30") resolve to the earliest. The date
+    is None when no day can be read, as for "February" or "First Week of January".
+    """
+    today = today or today_utc()
+    dates = []
+    for part in (deadline or '').split(';'):
+        part = re.sub(r'\(.*?\)', ' ', part).strip()
+        for pattern in DEADLINE_PATTERNS:
+            match = pattern.match(part)
+            if not match:
+                continue
+            month = match['month']
+            month = int(month) if month.isdigit() else MONTHS.get(month.casefold())
+            day = int(match['day'])
+            if not month or not 1 <= month <= 12 or not 1 <= day <= calendar.monthrange(2000, month)[1]:
+                continue
+            if match['year']:
+                if day <= calendar.monthrange(int(match['year']), month)[1]:
+                    dates.append((datetime(int(match['year']), month, day), False))
+            else:
+                dates.append((next_occurrence(month, day, today), True))
+            break
+    if not dates:
+        return None, False
+    return min(dates)
+
+
+def deadline_fields(value, today=None) -> dict:
+    """The due_date, recurring_deadline and rolling_deadline fields for a raw deadline value."""
+    deadline, rolling = parse_deadline(value)
+    due_date, recurring = resolve_deadline(deadline, today)
+    return {"due_date": due_date, "recurring_deadline": recurring, "rolling_deadline": rolling}
+
+
+def mentioned_deadline(description):
+    """The deadline a free-text description states after "deadline:", or None."""
+    match = DEADLINE_MENTION.search(description or '')
+    return match.group(1) if match else None
+
+
+def parse_list(value) -> list:
+    """Split a comma separated field, treating "No Restrictions" style values as an empty list."""
+    text = clean_text(value)
+    if text.lower() in NO_RESTRICTIONS:
+        return []
+    return [item.strip() for item in text.split(',') if item.strip()]
+
+
+def summarize(description, length=SUMMARY_LENGTH) -> str:
+    """A snippet of a description for result cards: its first `length` characters, cut at a word.
+
+    For descriptions built by load2.py the "Details:" text is used rather than the field lines above it.
+    """
+    text = clean_text(str(description or '').split('Details:', 1)[-1])
+    if len(text) <= length:
+        return text
+    return text[:length].rsplit(' ', 1)[0] + '…'
+
+
+def content_key(*parts) -> str:
+    """A stable key derived from the identifying fields of a record, independent of row order."""
+    normalized = '|'.join(clean_text(part).lower() for part in parts)
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
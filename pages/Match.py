@@ -0,0 +1,96 @@
+import atexit
+import streamlit as st
+from bson import ObjectId
+
+from app_resources import current_catalog, current_user_id, init_connection
+from matching import CIRCUMSTANCE_FLAGS, match
+from profile_matches import ensure_indexes as ensure_match_indexes
+from profile_matches import ProfileMatchWriter
+from scholarship_queries import CARD_FIELDS, fetch_by_ids
+from userInfo import UserData
+
+MATCH_LIMIT = 20  # Scholarships shown
+NOT_SAID = "Prefer not to say"
+ETHNICITY_OPTIONS = [NOT_SAID, "African American", "Hispanic", "Native American", "Asian", "Other"]
+GENDER_OPTIONS = [NOT_SAID, "Female", "Male", "Non-binary", "Other"]
+CIRCUMSTANCE_LABELS = {
+    'prefers_lgbt': "LGBTQ+", 'women_in_stem': "Woman in STEM", 'disabilities': "Living with a disability",
+    'rural': "From a rural area", 'immigrant_or_refugee': "Immigrant or refugee", 'neurodiversity': "Neurodivergent",
+    'low_income': "Low income", 'first_generation': "First generation college student",
+}
+
+# Ensure page configuration is set before any other Streamlit code
+st.set_page_config(layout="wide")
+
+client, _ = init_connection()
+db = client["scholarship_db"]
+scholarships_collection = db["scholarships"]
+catalog = current_catalog()
+user_id = current_user_id()
+
+
+# Saved profiles have their matches listed in profile_matches by a background thread
+@st.cache_resource
+def init_profile_matches():
+    ensure_match_indexes(db)
+    writer = ProfileMatchWriter(db, catalog)
+    atexit.register(writer.close)
+    return writer
+
+
+profile_match_writer = init_profile_matches()
+
+
+# st.cache_data cannot hash the ObjectIds of the matches; they are hashed by their hex string
+@st.cache_data(ttl=300, max_entries=500, hash_funcs={ObjectId: str})
+def fetch_cards(scholarship_ids):
+    return fetch_by_ids(scholarships_collection, scholarship_ids, CARD_FIELDS)
+
+
+st.title('''🎯 :rainbow[Equalify Match]''')
+st.write("Tell us about yourself to see the scholarships you qualify for, largest and soonest due first.")
+
+# The profile form, filled with what this user entered last
+if "profile" not in st.session_state:
+    st.session_state.profile = db["profiles"].find_one({"_id": user_id})
+profile = st.session_state.profile or UserData(0, 0.0, None, None, "", "", "").to_dict()
+with st.form("profile_form"):
+    col1, col2 = st.columns(2)
+    with col1:
+        income = st.number_input("Household Income ($)", min_value=0, value=int(profile["income"]),
+                                 help="Leave at 0 if you prefer not to say")
+        gpa = st.number_input("GPA", min_value=0.0, max_value=5.0, value=float(profile["GPA"]), step=0.1)
+        gender = st.selectbox("Gender", GENDER_OPTIONS, index=GENDER_OPTIONS.index(profile["gender"] or NOT_SAID))
+        ethnicity = st.selectbox("Ethnicity", ETHNICITY_OPTIONS,
+                                 index=ETHNICITY_OPTIONS.index(profile["ethnicity"] or NOT_SAID))
+    with col2:
+        major = st.text_input("Major", profile["major"])
+        university = st.text_input("University", profile["university"])
+        location = st.text_input("State", profile["location"])
+    circumstances = st.multiselect("Which of these apply to you?", CIRCUMSTANCE_FLAGS,
+                                   default=profile["circumstances"], format_func=CIRCUMSTANCE_LABELS.get)
+    if st.form_submit_button("Find my scholarships"):
+        user = UserData(income, gpa, None if gender == NOT_SAID else gender,
+                        None if ethnicity == NOT_SAID else ethnicity, major.strip(), university.strip(),
+                        location.strip(), circumstances)
+        # The profile is stored now and its match list written in the background; loaders and augmentation
+        # keep that list current
+        profile_match_writer.save(user_id, user)
+        st.session_state.profile = user.to_dict()
+
+if st.session_state.profile:
+    # The best open matches come straight from the in-memory catalog, without waiting for the stored list
+    matches = match(catalog, UserData.from_dict(st.session_state.profile), limit=MATCH_LIMIT)
+    scholarships = fetch_cards(tuple(scholarship_id for scholarship_id, _ in matches))
+    st.write(f"You qualify for these {len(scholarships)} scholarships." if scholarships else
+             "No open scholarships match your profile yet.")
+
+    for scholarship in scholarships:
+        st.subheader(scholarship.get("title", "Untitled scholarship"))
+        if "summary" in scholarship:
+            st.write(scholarship["summary"])
+        reward = scholarship.get("reward")
+        st.write(f"**Reward Amount**: {f'${reward}' if reward else 'Amount may vary'}")
+        if scholarship.get("due_date"):
+            st.write(f"**Due Date**: {scholarship['due_date'].strftime('%Y-%m-%d')}")
+        st.markdown("---")
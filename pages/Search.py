@@ -1,21 +1,61 @@
 import streamlit as st
-from pymongo import MongoClient
 from bson import ObjectId
-from datetime import datetime
-from dotenv import load_dotenv
-import os
+import atexit
 
-# Load environment variables (MongoDB URI)
-load_dotenv()
-MONGO_URI = os.getenv("MONGO_URI")
+from app_resources import current_catalog, current_user_id, init_connection
+from catalog import Catalog
+from interactions import KINDS, InteractionStore
+from interactions import ensure_indexes as ensure_interaction_indexes
+from query_stats import Measurement
+from scholarship_queries import (CARD_FIELDS, DETAIL_FIELDS, REWARD_BUCKETS, build_query, fetch_by_ids, fetch_facets,
+                                 next_page_after, normalize_filters)
 
-# Connect to MongoDB
-client = MongoClient(MONGO_URI)
+# Ensure page configuration is set before any other Streamlit code, cached resources included
+st.set_page_config(layout="wide")
+
+# MongoDB is connected once per server process (see app_resources.py)
+client, query_counter = init_connection()
+run_measurement = Measurement(query_counter)
 db = client["scholarship_db"]
 scholarships_collection = db["scholarships"]
 
-# Ensure page configuration is set before any other Streamlit code
-st.set_page_config(layout="wide")
+# Query results are reused across reruns until they expire
+RESULT_CACHE_TTL = 300  # Seconds
+RESULT_CACHE_ENTRIES = 500
+# st.cache_data cannot hash ObjectIds (document ids and page cursors); they are hashed by their hex string
+HASH_FUNCS = {ObjectId: str}
+
+
+# One aggregation returns both the page and the counts shown next to the sidebar options
+@st.cache_data(ttl=RESULT_CACHE_TTL, max_entries=RESULT_CACHE_ENTRIES, hash_funcs=HASH_FUNCS)
+def fetch_scholarship_facets(filters, after, descending, size):
+    return fetch_facets(scholarships_collection, filters, after, descending, size, CARD_FIELDS)
+
+
+@st.cache_data(ttl=RESULT_CACHE_TTL, max_entries=RESULT_CACHE_ENTRIES, hash_funcs=HASH_FUNCS)
+def fetch_cards(scholarship_ids):
+    return fetch_by_ids(scholarships_collection, scholarship_ids, CARD_FIELDS)
+
+
+@st.cache_data(ttl=RESULT_CACHE_TTL, max_entries=RESULT_CACHE_ENTRIES, hash_funcs=HASH_FUNCS)
+def fetch_details(scholarship_id):
+    return scholarships_collection.find_one({"_id": scholarship_id}, DETAIL_FIELDS) or {}
+
+
+# Filters without a text search are answered from an in-memory copy of the filterable fields
+catalog = current_catalog()
+
+
+# Saves, applications and favorites are kept per user and written to MongoDB in batches
+@st.cache_resource
+def init_interactions():
+    interactions = db["user_interactions"]
+    ensure_interaction_indexes(interactions)
+    store = InteractionStore(interactions, scholarships_collection)
+    atexit.register(store.close)
+    return store
+
+interaction_store = init_interactions()
 
 # Inject custom CSS to style the buttons as "Saved", "Applied", and "Favorited"
 st.markdown("""
@@ -37,214 +77,250 @@ st.markdown("""
 # Title and description
 st.title('''🔎 :rainbow[Equalify Search]''')
 
+user_id = current_user_id()
+
+# With ?debug=1 in the URL, each run and each fragment rerun shows its MongoDB commands and time
+debug = st.query_params.get("debug") == "1"
+
 # Initialize session state for saved, applied, and favorited scholarships
-if 'saved_scholarships' not in st.session_state:
-    st.session_state.saved_scholarships = set()
-if 'applied_scholarships' not in st.session_state:
-    st.session_state.applied_scholarships = set()
-if 'favorited_scholarships' not in st.session_state:
-    st.session_state.favorited_scholarships = set()
+for kind in KINDS:
+    if f'{kind}_scholarships' not in st.session_state:
+        st.session_state[f'{kind}_scholarships'] = {str(scholarship_id) for scholarship_id in
+                                                     interaction_store.scholarship_ids(user_id, kind)}
 
 # Pagination settings
 page_size = 5  # Number of scholarships to display per page
 if 'page_number' not in st.session_state:
     st.session_state.page_number = 1
-def change_page(change):
+    st.session_state.page_cursors = [None]  # Where each page up to the current one starts
+def change_page(change, cursor=None):
+    if change > 0:
+        st.session_state.page_cursors.append(cursor)
+    else:
+        st.session_state.page_cursors.pop()
     st.session_state.page_number += change
 
 
-# Sidebar filters
+# Sidebar options
+ETHNICITY_OPTIONS = ["All", "African American", "Hispanic", "Native American", "Asian", "Other"]
+GENDER_OPTIONS = ["All", "Female", "Male", "Non-binary", "Other"]
+CLOSING_OPTIONS = {"Any time": None, "Within 7 days": 7, "Within 30 days": 30, "Within 90 days": 90}
+FLAG_OPTIONS = [
+    ("prefers_lgbt", "Supports LGBTQ+"), ("is_merit_based", "Merit-Based"), ("is_essay_required", "Essay Required"),
+    ("women_in_stem", "Women in STEM"), ("disabilities", "Supports Disabilities"), ("rural", "Rural Student"),
+    ("immigrant_or_refugee", "Immigrant or Refugee"), ("neurodiversity", "Supports Neurodiversity"),
+    ("low_income", "Low Income"), ("first_generation", "First Generation College Student"),
+]
+
+# Sidebar filters; the empty slots are filled with result counts once the query has run
 with st.sidebar:
     st.header("Filter Scholarships")
 
     # Search bar to find scholarships by name, location, or requirements
-    search_query = st.text_input("Search for Scholarships", "")
+    search_query = st.text_input("Search for Scholarships", "",
+                                 help="Searches titles, descriptions and requirements; best matches come first")
 
     # Filter options
     sort_by_due_date = st.selectbox("Sort by Due Date", ["Ascending", "Descending"])
-    ethnicity_filter = st.selectbox("Required Ethnicity",
-                                    ["All", "African American", "Hispanic", "Native American", "Asian", "Other"])
-    gender_filter = st.selectbox("Gender", ["All", "Female", "Male", "Non-binary", "Other"])
+    closing_filter = st.selectbox("Closing", list(CLOSING_OPTIONS),
+                                  help="Only scholarships whose deadline falls between today and then")
+    ethnicity_filter = st.selectbox("Required Ethnicity", ETHNICITY_OPTIONS)
+    ethnicity_counts = st.empty()
+    gender_filter = st.selectbox("Gender", GENDER_OPTIONS)
+    gender_counts = st.empty()
     major_filter = st.text_input("Preferred Major", "")
     min_reward = st.number_input("Minimum Reward Amount ($)", min_value=0, value=0)
     max_reward = st.number_input("Maximum Reward Amount ($)", min_value=0, value=1000000)
+    reward_counts = st.empty()
 
     # Checkboxes for additional filters
-    lgbtq_filter = st.checkbox("Supports LGBTQ+", value=False)
-    merit_based_filter = st.checkbox("Merit-Based", value=False)
-    essay_required_filter = st.checkbox("Essay Required", value=False)
-    women_in_stem_filter = st.checkbox("Women in STEM", value=False)
-    disabilities_filter = st.checkbox("Supports Disabilities", value=False)
-    rural_filter = st.checkbox("Rural Student", value=False)
-    immigrant_or_refugee_filter = st.checkbox("Immigrant or Refugee", value=False)
-    neurodiversity_filter = st.checkbox("Supports Neurodiversity", value=False)
-    low_income_filter = st.checkbox("Low Income", value=False)
-    first_gen_filter = st.checkbox("First Generation College Student", value=False)
-
-
-# Fetch scholarships from MongoDB and apply filters
-def fetch_and_filter_scholarships():
-    mongo_query = {}
+    flag_filters = {}
+    flag_counts = {}
+    for flag, label in FLAG_OPTIONS:
+        col_checkbox, col_count = st.columns([4, 1])
+        flag_filters[flag] = col_checkbox.checkbox(label, value=False)
+        flag_counts[flag] = col_count.empty()
 
-    # Apply filters from sidebar
-    if search_query:
-        mongo_query["title"] = {"$regex": search_query, "$options": "i"}
-    if ethnicity_filter != "All":
-        mongo_query["preferred_ethnicity"] = ethnicity_filter
-    if gender_filter != "All":
-        mongo_query["preferred_gender"] = gender_filter
-    if major_filter:
-        mongo_query["preferred_major"] = {"$regex": major_filter, "$options": "i"}
-    if lgbtq_filter:
-        mongo_query["prefers_lgbt"] = True
-    if merit_based_filter:
-        mongo_query["is_merit_based"] = True
-    if essay_required_filter:
-        mongo_query["is_essay_required"] = True
-    if women_in_stem_filter:
-        mongo_query["women_in_stem"] = True
-    if disabilities_filter:
-        mongo_query["disabilities"] = True
-    if rural_filter:
-        mongo_query["rural"] = True
-    if immigrant_or_refugee_filter:
-        mongo_query["immigrant_or_refugee"] = True
-    if neurodiversity_filter:
-        mongo_query["neurodiversity"] = True
-    if low_income_filter:
-        mongo_query["low_income"] = True
-    if first_gen_filter:
-        mongo_query["first_generation"] = True
-
-    mongo_query["reward"] = {"$gte": min_reward, "$lte": max_reward}
-
-    # Fetch scholarships from MongoDB
-    scholarships = list(scholarships_collection.find(mongo_query))
-
-    # Sort scholarships by due date
-    if sort_by_due_date == "Ascending":
-        scholarships = sorted(scholarships, key=lambda x: x.get('due_date', datetime.max))
-    else:
-        scholarships = sorted(scholarships, key=lambda x: x.get('due_date', datetime.max), reverse=True)
 
-    return scholarships
+# Collect the sidebar filters
+def build_search_filter():
+    # Apply filters from sidebar
+    flags = [flag for flag, checked in flag_filters.items() if checked]
+    return normalize_filters(search_query, ethnicity_filter, gender_filter, major_filter, min_reward, max_reward,
+                             flags, CLOSING_OPTIONS[closing_filter])
 
 
 # Fetch filtered scholarships
-filtered_scholarships = fetch_and_filter_scholarships()
+filters = build_search_filter()
+mongo_query = build_query(*filters)
+descending = sort_by_due_date == "Descending"
+
+# Start from the first page whenever the filters or the order change
+query_signature = (filters, descending)
+if st.session_state.get('query_signature') != query_signature:
+    st.session_state.query_signature = query_signature
+    st.session_state.page_number = 1
+    st.session_state.page_cursors = [None]
+
+# Fetch only the current page, best matches first when searching, otherwise by due date
+def fetch_current_page():
+    page_after = st.session_state.page_cursors[-1]
+    if Catalog.supports(filters):
+        return fetch_cards(tuple(catalog.page(filters, page_after, descending, page_size)))
+    return fetch_scholarship_facets(filters, page_after, descending, page_size)[0]
+
+if Catalog.supports(filters):
+    facet_counts = catalog.facets(filters)
+else:
+    # The same cached aggregation the results tab reads its page from
+    facet_counts = fetch_scholarship_facets(filters, st.session_state.page_cursors[-1], descending, page_size)[1]
+total_scholarships = facet_counts["total"]
+
+# Show how many results each sidebar option would give with the other filters as they are
+def option_counts(options, counts):
+    return " · ".join(f"{option} ({counts.get(option, 0)})" for option in options)
+
+ethnicity_counts.caption(option_counts(ETHNICITY_OPTIONS[1:], facet_counts["preferred_ethnicity"]))
+gender_counts.caption(option_counts(GENDER_OPTIONS[1:], facet_counts["preferred_gender"]))
+reward_labels = [f"${low:,}–${high:,}" for low, high in zip(REWARD_BUCKETS, REWARD_BUCKETS[1:])] + \
+                [f"${REWARD_BUCKETS[-1]:,}+"]
+reward_counts.caption(option_counts(reward_labels, dict(zip(reward_labels, (facet_counts["reward"][low]
+                                                                            for low in REWARD_BUCKETS)))))
+for flag, slot in flag_counts.items():
+    slot.caption(f"({facet_counts['flags'][flag]})")
 
 # Pagination calculations
-total_scholarships = len(filtered_scholarships)
 total_pages = (total_scholarships // page_size) + (1 if total_scholarships % page_size > 0 else 0)
 
-# Determine scholarships for the current page
-start_idx = (st.session_state.page_number - 1) * page_size
-end_idx = start_idx + page_size
-current_page_scholarships = filtered_scholarships[start_idx:end_idx]
-
 # Function to display scholarships with buttons
 def display_scholarship_list(scholarships, tab_prefix):
     for scholarship in scholarships:
-        scholarship_id = str(scholarship["_id"])
-
-        # Safely access scholarship fields and display only available fields
-        if "title" in scholarship:
-            st.subheader(scholarship["title"])
-
-        if "description" in scholarship:
-            st.write(scholarship["description"])
-
-        if "is_merit_based" in scholarship:
-            st.write(f"**Merit-Based**: {'Yes' if scholarship['is_merit_based'] else 'No'}")
-
-        if "preferred_ethnicity" in scholarship:
-            st.write(f"**Preferred Ethnicity**: {scholarship['preferred_ethnicity']}")
-
-        if "preferred_gender" in scholarship:
-            st.write(f"**Preferred Gender**: {scholarship['preferred_gender']}")
-
-        if "preferred_major" in scholarship:
-            st.write(f"**Preferred Major**: {scholarship['preferred_major']}")
-
-        if "prefers_lgbt" in scholarship:
-            st.write(f"**Supports LGBTQ+**: {'Yes' if scholarship['prefers_lgbt'] else 'No'}")
-
-        if "location" in scholarship:
-            st.write(f"**Location**: {scholarship['location']}")
-
-        # Handle reward amount with conditional logic
-        if "reward" in scholarship:
-            reward = scholarship['reward']
-            if reward == 0:
-                st.write("**Reward Amount**: Amount may vary")
-            else:
-                st.write(f"**Reward Amount**: ${reward}")
-
-        if "extra_requirements" in scholarship:
-            st.write(f"**Extra Requirements**: {scholarship['extra_requirements']}")
-
-        if "due_date" in scholarship:
-            due_date = scholarship["due_date"]
-            st.write(f"**Due Date**: {due_date.strftime('%Y-%m-%d')}")
-
-        # Save, Apply, Favorite, and Remove buttons with unique keys per tab
-        col1, col2, col3, col4 = st.columns(4)
-
-        with col1:
-            if scholarship_id not in st.session_state.saved_scholarships:
-                if st.button(f"Save {scholarship['title']}", key=f"{tab_prefix}-save-{scholarship_id}"):
-                    st.session_state.saved_scholarships.add(scholarship_id)
-                    scholarships_collection.update_one({"_id": ObjectId(scholarship_id)}, {"$set": {"saved": True}})
-                    st.success(f"Scholarship '{scholarship['title']}' saved!")
-            else:
-                st.markdown(f"<button class='saved-button'>Saved</button>", unsafe_allow_html=True)
-
-        with col2:
-            if scholarship_id not in st.session_state.applied_scholarships:
-                if st.button(f"Mark {scholarship['title']} as applied", key=f"{tab_prefix}-apply-{scholarship_id}"):
-                    st.session_state.applied_scholarships.add(scholarship_id)
-                    scholarships_collection.update_one({"_id": ObjectId(scholarship_id)}, {"$set": {"applied": True}})
-                    st.success(f"Scholarship '{scholarship['title']}' marked as applied!")
-            else:
-                st.markdown(f"<button class='applied-button'>Applied</button>", unsafe_allow_html=True)
-
-        with col3:
-            if scholarship_id not in st.session_state.favorited_scholarships:
-                if st.button(f"Favorite {scholarship['title']}", key=f"{tab_prefix}-favorite-{scholarship_id}"):
-                    st.session_state.favorited_scholarships.add(scholarship_id)
-                    scholarships_collection.update_one({"_id": ObjectId(scholarship_id)}, {"$set": {"favorited": True}})
-                    st.success(f"Scholarship '{scholarship['title']}' favorited!")
-            else:
-                st.markdown(f"<button class='favorited-button'>Favorited</button>", unsafe_allow_html=True)
-
-        # Remove button for saved, applied, or favorited
-        with col4:
-            if tab_prefix == "saved":
-                if st.button(f"Remove from Saved", key=f"{tab_prefix}-remove-{scholarship_id}"):
-                    st.session_state.saved_scholarships.remove(scholarship_id)
-                    scholarships_collection.update_one({"_id": ObjectId(scholarship_id)}, {"$set": {"saved": False}})
-                    st.success(f"Scholarship '{scholarship['title']}' removed from saved!")
-            elif tab_prefix == "applied":
-                if st.button(f"Remove from Applied", key=f"{tab_prefix}-remove-{scholarship_id}"):
-                    st.session_state.applied_scholarships.remove(scholarship_id)
-                    scholarships_collection.update_one({"_id": ObjectId(scholarship_id)}, {"$set": {"applied": False}})
-                    st.success(f"Scholarship '{scholarship['title']}' removed from applied!")
-            elif tab_prefix == "favorited":
-                if st.button(f"Remove from Favorites", key=f"{tab_prefix}-remove-{scholarship_id}"):
-                    st.session_state.favorited_scholarships.remove(scholarship_id)
-                    scholarships_collection.update_one({"_id": ObjectId(scholarship_id)}, {"$set": {"favorited": False}})
-                    st.success(f"Scholarship '{scholarship['title']}' removed from favorites!")
-
-        # Add a horizontal line to separate scholarships
-        st.markdown("---")
+        scholarship_card(scholarship, tab_prefix)
+
+
+# A card is a fragment: its buttons and toggle rerun only the card
+@st.fragment
+def scholarship_card(scholarship, tab_prefix):
+    card_measurement = Measurement(query_counter)
+    scholarship_id = str(scholarship["_id"])
+
+    # Safely access scholarship fields and display only available fields
+    if "title" in scholarship:
+        st.subheader(scholarship["title"])
+
+    if "summary" in scholarship:
+        st.write(scholarship["summary"])
+
+    if "is_merit_based" in scholarship:
+        st.write(f"**Merit-Based**: {'Yes' if scholarship['is_merit_based'] else 'No'}")
+
+    if "preferred_ethnicity" in scholarship:
+        st.write(f"**Preferred Ethnicity**: {scholarship['preferred_ethnicity']}")
+
+    if "preferred_gender" in scholarship:
+        st.write(f"**Preferred Gender**: {scholarship['preferred_gender']}")
+
+    if "prefers_lgbt" in scholarship:
+        st.write(f"**Supports LGBTQ+**: {'Yes' if scholarship['prefers_lgbt'] else 'No'}")
+
+    # Handle reward amount with conditional logic
+    if "reward" in scholarship:
+        reward = scholarship['reward']
+        if reward == 0:
+            st.write("**Reward Amount**: Amount may vary")
+        else:
+            st.write(f"**Reward Amount**: ${reward}")
+
+    if scholarship.get("due_date"):
+        due_date = scholarship["due_date"]
+        st.write(f"**Due Date**: {due_date.strftime('%Y-%m-%d')}")
+    elif scholarship.get("rolling_deadline"):
+        st.write("**Due Date**: Rolling")
+
+    # The rest of the document is only fetched once its card is expanded
+    if st.toggle("Show details", key=f"{tab_prefix}-details-{scholarship_id}"):
+        details = scholarship
+        if "description" not in scholarship:
+            details = fetch_details(scholarship["_id"])
+
+        if "description" in details:
+            st.write(details["description"])
+
+        if "preferred_major" in details:
+            st.write(f"**Preferred Major**: {details['preferred_major']}")
+
+        if "location" in details:
+            st.write(f"**Location**: {details['location']}")
+
+        if "extra_requirements" in details:
+            st.write(f"**Extra Requirements**: {details['extra_requirements']}")
+
+    # Save, Apply, Favorite, and Remove buttons with unique keys per tab
+    col1, col2, col3, col4 = st.columns(4)
+
+    with col1:
+        if scholarship_id not in st.session_state.saved_scholarships:
+            if st.button(f"Save {scholarship['title']}", key=f"{tab_prefix}-save-{scholarship_id}"):
+                st.session_state.saved_scholarships.add(scholarship_id)
+                interaction_store.record(user_id, ObjectId(scholarship_id), "saved")
+                st.success(f"Scholarship '{scholarship['title']}' saved!")
+        else:
+            st.markdown(f"<button class='saved-button'>Saved</button>", unsafe_allow_html=True)
+
+    with col2:
+        if scholarship_id not in st.session_state.applied_scholarships:
+            if st.button(f"Mark {scholarship['title']} as applied", key=f"{tab_prefix}-apply-{scholarship_id}"):
+                st.session_state.applied_scholarships.add(scholarship_id)
+                interaction_store.record(user_id, ObjectId(scholarship_id), "applied")
+                st.success(f"Scholarship '{scholarship['title']}' marked as applied!")
+        else:
+            st.markdown(f"<button class='applied-button'>Applied</button>", unsafe_allow_html=True)
+
+    with col3:
+        if scholarship_id not in st.session_state.favorited_scholarships:
+            if st.button(f"Favorite {scholarship['title']}", key=f"{tab_prefix}-favorite-{scholarship_id}"):
+                st.session_state.favorited_scholarships.add(scholarship_id)
+                interaction_store.record(user_id, ObjectId(scholarship_id), "favorited")
+                st.success(f"Scholarship '{scholarship['title']}' favorited!")
+        else:
+            st.markdown(f"<button class='favorited-button'>Favorited</button>", unsafe_allow_html=True)
+
+    # Remove button for saved, applied, or favorited
+    with col4:
+        if tab_prefix == "saved":
+            if st.button(f"Remove from Saved", key=f"{tab_prefix}-remove-{scholarship_id}"):
+                st.session_state.saved_scholarships.discard(scholarship_id)
+                interaction_store.record(user_id, ObjectId(scholarship_id), "saved", False)
+                st.success(f"Scholarship '{scholarship['title']}' removed from saved!")
+        elif tab_prefix == "applied":
+            if st.button(f"Remove from Applied", key=f"{tab_prefix}-remove-{scholarship_id}"):
+                st.session_state.applied_scholarships.discard(scholarship_id)
+                interaction_store.record(user_id, ObjectId(scholarship_id), "applied", False)
+                st.success(f"Scholarship '{scholarship['title']}' removed from applied!")
+        elif tab_prefix == "favorited":
+            if st.button(f"Remove from Favorites", key=f"{tab_prefix}-remove-{scholarship_id}"):
+                st.session_state.favorited_scholarships.discard(scholarship_id)
+                interaction_store.record(user_id, ObjectId(scholarship_id), "favorited", False)
+                st.success(f"Scholarship '{scholarship['title']}' removed from favorites!")
+
+    if debug:
+        st.caption(f"Card: {card_measurement.summary()}")
+
+    # Add a horizontal line to separate scholarships
+    st.markdown("---")
 
 
 # Tabs for viewing all scholarships, saved, applied, and favorited
 tab1, tab2, tab3, tab4 = st.tabs(
     ["All Scholarships", "Saved Scholarships", "Applied Scholarships", "Favorited Scholarships"])
 
-# Tab 1: All Scholarships
-with tab1:
+# Each tab is a fragment too, so paging or refreshing a list leaves the sidebar and other tabs alone
+@st.fragment
+def results_tab():
+    tab_measurement = Measurement(query_counter)
+    current_page_scholarships = fetch_current_page()
+    next_page_cursor = next_page_after(mongo_query, current_page_scholarships, st.session_state.page_cursors[-1])
+
     st.write(f"Found {total_scholarships} scholarships matching your filters and search query.")
     display_scholarship_list(current_page_scholarships, tab_prefix="all")
 
@@ -260,101 +336,41 @@ with tab1:
 
     with col_next:
         if st.session_state.page_number < total_pages:
-            st.button("Next", on_click=change_page, args=(1,))
+            st.button("Next", on_click=change_page, args=(1, next_page_cursor))
+
+    if debug:
+        st.caption(f"Results tab: {tab_measurement.summary()}")
+
+
+# The user's list of one kind, read once per run of the tab; Refresh picks up what was marked on other tabs
+@st.fragment
+def interactions_tab(kind, message):
+    tab_measurement = Measurement(query_counter)
+    scholarships = interaction_store.scholarships(user_id, kind)
+    col_message, col_refresh = st.columns([4, 1])
+    col_message.write(message.format(count=len(scholarships)))
+    col_refresh.button("Refresh", key=f"{kind}-refresh")
+    display_scholarship_list(scholarships, tab_prefix=kind)
+
+    if debug:
+        st.caption(f"{kind.capitalize()} tab: {tab_measurement.summary()}")
+
+
+# Tab 1: All Scholarships
+with tab1:
+    results_tab()
 
 # Tab 2: Saved Scholarships
 with tab2:
-    saved_ids = list(st.session_state.saved_scholarships)
-    saved_scholarships = scholarships_collection.find({"_id": {"$in": [ObjectId(sid) for sid in saved_ids]}})
-    st.write(f"You have saved {len(saved_ids)} scholarships.")
-    display_scholarship_list(saved_scholarships, tab_prefix="saved")
-
-    # Track IDs to be removed after loop finishes
-    scholarships_to_remove = []
-    for scholarship in saved_scholarships:
-        scholarship_id = str(scholarship["_id"])
-        if "title" in scholarship:
-            st.subheader(scholarship["title"])
-        # Add a horizontal line to separate scholarships
-        st.markdown("---")
-
-        if "description" in scholarship:
-            st.write(scholarship["description"])
-        if "reward" in scholarship:
-            reward = scholarship['reward']
-            if reward == 0:
-                st.write("**Reward Amount**: Amount may vary")
-            else:
-                st.write(f"**Reward Amount**: ${reward}")
-        if "due_date" in scholarship:
-            st.write(f"**Due Date**: {scholarship['due_date'].strftime('%Y-%m-%d')}")
-        # Add a Remove button for Saved scholarships
-        if st.button(f"Remove {scholarship['title']} from Saved", key=f"remove-saved-{scholarship_id}"):
-            scholarships_to_remove.append(scholarship_id)
-            st.success(f"Scholarship '{scholarship['title']}' removed from saved!")
-    # Remove scholarships from session state and MongoDB after the loop
-    for sid in scholarships_to_remove:
-        st.session_state.saved_scholarships.remove(sid)
-        scholarships_collection.update_one({"_id": ObjectId(sid)}, {"$set": {"saved": False}})
+    interactions_tab("saved", "You have saved {count} scholarships.")
 
 # Tab 3: Applied Scholarships
 with tab3:
-    applied_ids = list(st.session_state.applied_scholarships)
-    applied_scholarships = scholarships_collection.find({"_id": {"$in": [ObjectId(sid) for sid in applied_ids]}})
-    st.write(f"You have applied to {len(applied_ids)} scholarships.")
-    display_scholarship_list(applied_scholarships, tab_prefix="applied")
-
-    scholarships_to_remove = []
-    for scholarship in applied_scholarships:
-        scholarship_id = str(scholarship["_id"])
-        if "title" in scholarship:
-            st.subheader(scholarship["title"])
-        if "description" in scholarship:
-            st.write(scholarship["description"])
-        if "reward" in scholarship:
-            reward = scholarship['reward']
-            if reward == 0:
-                st.write("**Reward Amount**: Amount may vary")
-            else:
-                st.write(f"**Reward Amount**: ${reward}")
-        if "due_date" in scholarship:
-            st.write(f"**Due Date**: {scholarship['due_date'].strftime('%Y-%m-%d')}")
-        # Add a Remove button for Applied scholarships
-        if st.button(f"Remove {scholarship['title']} from Applied", key=f"remove-applied-{scholarship_id}"):
-            scholarships_to_remove.append(scholarship_id)
-            st.success(f"Scholarship '{scholarship['title']}' removed from applied!")
-    for sid in scholarships_to_remove:
-        st.session_state.applied_scholarships.remove(sid)
-        scholarships_collection.update_one({"_id": ObjectId(sid)}, {"$set": {"applied": False}})
+    interactions_tab("applied", "You have applied to {count} scholarships.")
 
 # Tab 4: Favorited Scholarships
 with tab4:
-    favorited_ids = list(st.session_state.favorited_scholarships)
-    favorited_scholarships = scholarships_collection.find({"_id": {"$in": [ObjectId(sid) for sid in favorited_ids]}})
-    st.write(f"You have favorited {len(favorited_ids)} scholarships.")
-    display_scholarship_list(favorited_scholarships, tab_prefix="favorited")
-
-    scholarships_to_remove = []
-    for scholarship in favorited_scholarships:
-        scholarship_id = str(scholarship["_id"])
-        if "title" in scholarship:
-            st.subheader(scholarship["title"])
-        if "description" in scholarship:
-            st.write(scholarship["description"])
-        if "reward" in scholarship:
-            reward = scholarship['reward']
-            if reward == 0:
-                st.write("**Reward Amount**: Amount may vary")
-            else:
-                st.write(f"**Reward Amount**: ${reward}")
-        if "due_date" in scholarship:
-            st.write(f"**Due Date**: {scholarship['due_date'].strftime('%Y-%m-%d')}")
-
-        # Add a Remove button for Favorited scholarships
-        if st.button(f"Remove {scholarship['title']} from Favorites", key=f"remove-favorite-{scholarship_id}"):
-            scholarships_to_remove.append(scholarship_id)
-            st.success(f"Scholarship '{scholarship['title']}' removed from favorites!")
-    for sid in scholarships_to_remove:
-        st.session_state.favorited_scholarships.remove(sid)
-        scholarships_collection.update_one({"_id": ObjectId(sid)}, {"$set": {"favorited": False}})
+    interactions_tab("favorited", "You have favorited {count} scholarships.")
 
+if debug:
+    st.sidebar.caption(f"Full run: {run_measurement.summary()}")
@@ -16,6 +16,8 @@ import nltk
 from nltk.corpus import stopwords
 from nltk.stem import WordNetLemmatizer
 
+from scholarship_queries import DOMAIN_STOPWORDS
+
 # Load environment variables
 load_dotenv()
 
@@ -74,8 +76,7 @@ def preprocess_text(text):
     stop_words = set(stopwords.words('english'))
 
     # Add domain-specific stopwords
-    domain_stopwords = {'scholarship', 'student', 'award', 'application', 'apply', 'program', 'opportunity'}
-    stop_words.update(domain_stopwords)
+    stop_words.update(DOMAIN_STOPWORDS)
 
     # Remove stopwords, but keep negation words
     tokens = [token for token in tokens if token not in stop_words or token in ['no', 'not', 'nor', 'neither']]
@@ -0,0 +1,94 @@
+import argparse
+import re
+import pandas as pd
+
+from normalize import clean_text, parse_amount, parse_list
+
+# "Label: value" lines, as written by load2.create_description
+LINE_PATTERNS = {
+    label: re.compile(rf'^{label}:[ \t]*(.*)$', re.MULTILINE)
+    for label in ('Scholarship', 'Amount', 'Location')
+}
+
+
+def resolve_fields(lines: dict) -> dict:
+    """Map raw "Label: value" texts to the AugmentedScholarship fields they settle.
+
+    Only fields whose value is unambiguous are returned; the rest are left to the
+    model. Deadline and Years have no field in the schema (load2.py already parses
+    them into due_date and under "csv"), so they are not returned.
+    """
+    fields = {}
+    if lines.get('Scholarship'):
+        fields['title'] = clean_text(lines['Scholarship'])
+    if lines.get('Amount') is not None:
+        reward = parse_amount(lines['Amount'])
+        if reward is not None:
+            fields['reward'] = reward
+    if lines.get('Location') is not None:
+        locations = parse_list(lines['Location'])
+        fields['location'] = ', '.join(locations) if locations else None
+    return fields
+
+
+def preextract(description: str) -> dict:
+    """Fields that can be read straight off a description without asking the model."""
+    lines = {}
+    for label, pattern in LINE_PATTERNS.items():
+        match = pattern.search(description)
+        if match:
+            lines[label] = match.group(1)
+    return resolve_fields(lines)
+
+
+def preextract_many(descriptions) -> list:
+    """preextract over a whole column at once, using one vectorized str.extract per label."""
+    column = pd.Series(list(descriptions), dtype=object)
+    extracted = pd.DataFrame({label: column.str.extract(pattern, expand=False)
+                              for label, pattern in LINE_PATTERNS.items()})
+    extracted = extracted.astype(object).where(extracted.notna(), None)
+    return [resolve_fields(row) for row in extracted.to_dict('records')]
+
+
+def same_value(rule, model) -> bool:
+    if isinstance(rule, str) and isinstance(model, str):
+        return rule.casefold() == model.casefold()
+    if isinstance(rule, float) and isinstance(model, (int, float)):
+        return abs(rule - model) < 0.01
+    return rule == model
+
+
+def compare_with_model(docs, fields=('title', 'reward', 'location')):
+    """Agreement between the rules and stored model answers, per field: {field: (agreed, compared)}.
+
+    Fields listed in a document's rule_fields were stored by the rules themselves, so they are not compared.
+    """
+    docs = list(docs)
+    results = {field: [0, 0] for field in fields}
+    for doc, extracted in zip(docs, preextract_many(doc['description'] for doc in docs)):
+        for field in fields:
+            if field in extracted and field in doc and field not in doc.get('rule_fields', ()):
+                results[field][1] += 1
+                if same_value(extracted[field], doc[field]):
+                    results[field][0] += 1
+    return {field: tuple(counts) for field, counts in results.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare rule-based extraction with stored model answers. Values the rules stored themselves "
+                    "are left out, so documents augmented with --no-rules give the most comparisons.")
+    parser.add_argument('--limit', type=int, default=0, help="documents to compare (0 for all)")
+    args = parser.parse_args()
+
+    from augment import client, scholarships
+
+    # Documents built by load2.py that have been augmented since rule_fields was recorded, so it is known
+    # which of their fields the model answered
+    query = {"description": {"$regex": "^Scholarship: "}, "rule_fields": {"$exists": True}}
+    docs = scholarships.find(query, {"description": 1, "title": 1, "reward": 1, "location": 1, "rule_fields": 1})
+    docs = docs.limit(args.limit)
+    for field, (agreed, compared) in compare_with_model(docs).items():
+        rate = f"{agreed / compared:.0%}" if compared else "n/a"
+        print(f"{field:>10}: rules agree with the model on {agreed}/{compared} documents ({rate})")
+    client.close()
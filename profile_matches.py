@@ -0,0 +1,258 @@
+import argparse
+import threading
+from collections import defaultdict
+from pymongo import ASCENDING, DeleteMany, IndexModel, UpdateMany, UpdateOne
+from pymongo.errors import PyMongoError
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+from dotenv import load_dotenv
+import os
+
+from bulk import batched
+from catalog import from_epoch_milliseconds
+from matching import (CIRCUMSTANCE_FLAGS, EXACT_FIELDS, PREFERENCE_FIELDS, Predicate, admits, midnight,
+                      score_expression)
+from userInfo import UserData
+
+# What a scholarship needs in profile_matches to be ranked there
+MATCH_FIELDS = {"reward": 1, "due_date": 1}
+SCHOLARSHIP_FIELDS = {**MATCH_FIELDS, **dict.fromkeys(PREFERENCE_FIELDS + CIRCUMSTANCE_FLAGS, 1), "updated_at": 1}
+DEFAULT_BATCH_SIZE = 500
+
+INDEXES = {
+    "profiles": [IndexModel([("updated_at", ASCENDING)], name="updated_at_1")],
+    "profile_matches": [
+        # One document per profile and scholarship it matches; reads are by profile, refreshes by scholarship
+        IndexModel([("profile_id", ASCENDING), ("scholarship_id", ASCENDING)], name="profile_id_scholarship_id",
+                   unique=True),
+        IndexModel([("scholarship_id", ASCENDING)], name="scholarship_id_1"),
+    ],
+}
+
+
+def ensure_indexes(db) -> list:
+    """Create the profiles and profile_matches indexes that do not exist yet; returns their names."""
+    return [name for collection, indexes in INDEXES.items() for name in db[collection].create_indexes(indexes)]
+
+
+class ProfileIndex:
+    """Inverted index from profile answers and circumstances to the profiles that have them.
+
+    `profiles_for` finds the profiles a scholarship matches by testing its
+    preferences against each distinct answer once, so its cost depends on the
+    number of distinct answers and matching profiles, not on every profile.
+    Deadlines are not tested; profile_matches keeps closed scholarships and
+    leaves them out when read.
+    """
+
+    def __init__(self, profiles=()):
+        self.__all = set()
+        self.__answers = {field: defaultdict(set) for field in PREFERENCE_FIELDS}  # field -> answer -> profile ids
+        self.__flags = {flag: set() for flag in CIRCUMSTANCE_FLAGS}  # flag -> profile ids with that circumstance
+        for profile_id, user in profiles:
+            self.add(profile_id, user)
+
+    def add(self, profile_id, user) -> None:
+        predicate = Predicate(user, include_closed=True)
+        self.__all.add(profile_id)
+        for field in PREFERENCE_FIELDS:
+            if predicate.answer(field):
+                self.__answers[field][predicate.answer(field)].add(profile_id)
+        for flag in predicate.met_flags:
+            self.__flags[flag].add(profile_id)
+
+    def profiles_for(self, doc) -> set:
+        """The ids of the profiles `doc` is open to."""
+        candidates = None
+        for flag in CIRCUMSTANCE_FLAGS:
+            if doc.get(flag):
+                candidates = self.__flags[flag] if candidates is None else candidates & self.__flags[flag]
+        for field in PREFERENCE_FIELDS:
+            if candidates is not None and not candidates:
+                break
+            if not doc.get(field):
+                continue
+            admitted = set()
+            for answer, profile_ids in self.__answers[field].items():
+                if admits(doc[field], answer, exact=field in EXACT_FIELDS):
+                    admitted |= profile_ids
+            candidates = admitted if candidates is None else candidates & admitted
+        return set(self.__all if candidates is None else candidates)
+
+
+def load_profiles(db) -> ProfileIndex:
+    return ProfileIndex((profile["_id"], UserData.from_dict(profile)) for profile in db["profiles"].find())
+
+
+def match_document(profile_id, scholarship) -> dict:
+    return {"profile_id": profile_id, "scholarship_id": scholarship["_id"], "reward": scholarship.get("reward"),
+            "due_date": scholarship.get("due_date")}
+
+
+def store_profile(db, profile_id, user) -> None:
+    db["profiles"].update_one({"_id": profile_id}, {"$set": user.to_dict(), "$currentDate": {"updated_at": True}},
+                              upsert=True)
+
+
+def list_matches(db, catalog, profile_id, user, batch_size=DEFAULT_BATCH_SIZE) -> int:
+    """Replace the stored matches of `profile_id` with the scholarships in `catalog` it matches; returns how many."""
+    matches = catalog.matching(Predicate(user, include_closed=True))
+    db["profile_matches"].delete_many({"profile_id": profile_id})
+    for batch in batched(matches, batch_size):
+        db["profile_matches"].insert_many([match_document(profile_id, scholarship) for scholarship in batch],
+                                          ordered=False)
+    return len(matches)
+
+
+def save_profile(db, catalog, profile_id, user) -> int:
+    """Store `user` as `profile_id` and list every scholarship in `catalog` it matches; returns how many."""
+    store_profile(db, profile_id, user)
+    return list_matches(db, catalog, profile_id, user)
+
+
+class ProfileMatchWriter:
+    """Stores profiles at once and lists their matches in profile_matches in the background.
+
+    A profile can match a large part of the catalog, so `save` only stores the
+    profile and queues it; a background thread then lists the matches of the
+    queued profiles one at a time. A profile saved again before its turn is
+    listed once, with its latest answers. Pages show a student's best matches
+    with matching.match on the catalog, so they do not wait for the list.
+    """
+
+    def __init__(self, db, catalog, batch_size=DEFAULT_BATCH_SIZE, retry_interval=5.0):
+        self.__db = db
+        self.__catalog = catalog
+        self.__batch_size = batch_size
+        self.__retry_interval = retry_interval
+        self.__pending = {}  # profile_id -> UserData waiting to be listed
+        self.__lock = threading.Lock()
+        self.__flushing = threading.Lock()  # Profiles are listed one batch at a time, in order
+        self.__wake = threading.Event()
+        self.__closed = False
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def save(self, profile_id, user) -> None:
+        store_profile(self.__db, profile_id, user)
+        with self.__lock:
+            self.__pending[profile_id] = user
+        self.__wake.set()
+
+    def __run(self):
+        while not self.__closed:
+            # Idle until a profile is saved, or retry after a while what failed to be listed
+            with self.__lock:
+                waiting = bool(self.__pending)
+            self.__wake.wait(self.__retry_interval if waiting else None)
+            self.__wake.clear()
+            try:
+                self.flush()
+            except PyMongoError as e:
+                print(f"Listing profile matches failed, retrying: {e}")
+
+    def flush(self) -> int:
+        """List the matches of every queued profile; returns how many profiles were listed."""
+        with self.__flushing:
+            with self.__lock:
+                batch, self.__pending = self.__pending, {}
+            for listed, (profile_id, user) in enumerate(batch.items()):
+                try:
+                    list_matches(self.__db, self.__catalog, profile_id, user, self.__batch_size)
+                except PyMongoError:
+                    # Queue the rest again, unless saved since with newer answers
+                    with self.__lock:
+                        for key, queued in list(batch.items())[listed:]:
+                            self.__pending.setdefault(key, queued)
+                    raise
+            return len(batch)
+
+    def close(self) -> None:
+        """Stop the background thread and list what is left."""
+        self.__closed = True
+        self.__wake.set()
+        self.__thread.join()
+        self.flush()
+
+
+def refresh_matches(db, batch_size=DEFAULT_BATCH_SIZE) -> dict:
+    """Re-evaluate the profiles of the scholarships changed since the last refresh.
+
+    Changes are found through the updated_at stamp that bulk_upsert and
+    augmentation_update keep, from a watermark stored in sync_state. For each
+    changed scholarship, profiles it no longer matches are removed, those it
+    still matches get its new reward and due date, and new ones are added, so
+    the work follows the size of the change. Scholarships deleted from MongoDB
+    are not noticed.
+    """
+    state = db["sync_state"].find_one({"_id": "profile_matches"}) or {}
+    profiles = load_profiles(db)
+    query = {"reward": {"$type": "number"}}
+    if state.get("watermark"):
+        query["updated_at"] = {"$gte": state["watermark"]}  # Same-millisecond writes are read again, which is harmless
+
+    counts = {"scholarships": 0, "added": 0, "removed": 0}
+    watermark = state.get("watermark")
+    for batch in batched(db["scholarships"].find(query, SCHOLARSHIP_FIELDS), batch_size):
+        stored = defaultdict(set)
+        for pair in db["profile_matches"].find({"scholarship_id": {"$in": [doc["_id"] for doc in batch]}},
+                                               {"profile_id": 1, "scholarship_id": 1}):
+            stored[pair["scholarship_id"]].add(pair["profile_id"])
+
+        operations = []
+        for doc in batch:
+            matched = profiles.profiles_for(doc)
+            removed, added = stored[doc["_id"]] - matched, matched - stored[doc["_id"]]
+            if removed:
+                operations.append(DeleteMany({"scholarship_id": doc["_id"], "profile_id": {"$in": list(removed)}}))
+            if stored[doc["_id"]] - removed:
+                operations.append(UpdateMany({"scholarship_id": doc["_id"]},
+                                             {"$set": {field: doc.get(field) for field in MATCH_FIELDS}}))
+            operations += [UpdateOne({"profile_id": profile_id, "scholarship_id": doc["_id"]},
+                                     {"$set": match_document(profile_id, doc)}, upsert=True) for profile_id in added]
+            counts["added"] += len(added)
+            counts["removed"] += len(removed)
+            if doc.get("updated_at") and (watermark is None or doc["updated_at"] > watermark):
+                watermark = doc["updated_at"]
+        if operations:
+            db["profile_matches"].bulk_write(operations)
+        counts["scholarships"] += len(batch)
+
+    if watermark != state.get("watermark"):
+        db["sync_state"].update_one({"_id": "profile_matches"}, {"$set": {"watermark": watermark}}, upsert=True)
+    return counts
+
+
+def refresh_stored_matches(db) -> dict:
+    """Create any missing match indexes and run refresh_matches, printing what changed; for command-line tools."""
+    ensure_indexes(db)
+    counts = refresh_matches(db)
+    print(f"Profile matches refreshed for {counts['scholarships']} changed scholarships: "
+          f"{counts['added']} added, {counts['removed']} removed")
+    return counts
+
+
+def top_matches(db, profile_id, limit=20, today=None) -> list:
+    """The `limit` best open scholarships stored for `profile_id`, as (scholarship_id, score) pairs, best first."""
+    today = from_epoch_milliseconds(midnight(today))
+    pipeline = [
+        {"$match": {"profile_id": profile_id, "$or": [{"due_date": None}, {"due_date": {"$gte": today}}]}},
+        {"$addFields": {"score": score_expression(today)}},
+        {"$sort": {"score": -1, "scholarship_id": 1}},
+        {"$limit": limit},
+        {"$project": {"scholarship_id": 1, "score": 1}},
+    ]
+    return [(match["scholarship_id"], match["score"]) for match in db["profile_matches"].aggregate(pipeline)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Bring the stored profile matches up to date with the scholarships changed since the last "
+                    "refresh. The loaders, augment.py and augment_batch.py ingest do this too.")
+    parser.parse_args()
+
+    load_dotenv()
+    client = MongoClient(os.getenv('MONGO_URI'), server_api=ServerApi('1'))
+    db = client['scholarship_db']
+    refresh_stored_matches(db)
+    client.close()
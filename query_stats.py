@@ -0,0 +1,49 @@
+import threading
+import time
+from pymongo import monitoring
+
+
+class QueryCounter(monitoring.CommandListener):
+    """Counts the MongoDB commands a thread sends and the time the server took.
+
+    Register it with MongoClient(event_listeners=[counter]). Counts are per
+    thread, so a Streamlit run only sees its own commands, not those of other
+    sessions or of background writers.
+    """
+
+    def __init__(self):
+        self.__local = threading.local()
+
+    def __counts(self):
+        if not hasattr(self.__local, "commands"):
+            self.__local.commands, self.__local.microseconds = 0, 0
+        return self.__local
+
+    def started(self, event):
+        self.__counts().commands += 1
+
+    def succeeded(self, event):
+        self.__counts().microseconds += event.duration_micros
+
+    def failed(self, event):
+        self.__counts().microseconds += event.duration_micros
+
+    def snapshot(self) -> tuple:
+        """(commands, server milliseconds) sent by this thread so far."""
+        counts = self.__counts()
+        return counts.commands, counts.microseconds / 1000
+
+
+class Measurement:
+    """The commands, MongoDB time and wall time of one thread from now until `summary`."""
+
+    def __init__(self, counter):
+        self.__counter = counter
+        self.__commands, self.__mongo_ms = counter.snapshot()
+        self.__start = time.perf_counter()
+
+    def summary(self) -> str:
+        commands, mongo_ms = self.__counter.snapshot()
+        wall_ms = (time.perf_counter() - self.__start) * 1000
+        return (f"{commands - self.__commands} MongoDB commands, {mongo_ms - self.__mongo_ms:.1f} ms in MongoDB, "
+                f"{wall_ms:.1f} ms in total")
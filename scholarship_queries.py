@@ -0,0 +1,209 @@
+import re
+from datetime import timedelta
+from pymongo import ASCENDING, DESCENDING
+
+from normalize import SUMMARY_LENGTH, today_utc
+
+# Words in nearly every scholarship; they say nothing about relevance (shared with pages/Visualize.py)
+DOMAIN_STOPWORDS = {'scholarship', 'student', 'award', 'application', 'apply', 'program', 'opportunity'}
+
+# Boolean fields the Search page filters on, always as {flag: True}
+FLAG_FIELDS = [
+    'prefers_lgbt', 'is_merit_based', 'is_essay_required', 'women_in_stem', 'disabilities', 'rural',
+    'immigrant_or_refugee', 'neurodiversity', 'low_income', 'first_generation',
+]
+# Single-choice sidebar filters, counted per value by fetch_facets
+FACET_FIELDS = ['preferred_ethnicity', 'preferred_gender']
+# Lower bounds of the reward ranges counted by fetch_facets; the last range is open-ended
+REWARD_BUCKETS = [0, 1000, 5000, 10000, 50000]
+
+DEFAULT_MAX_REWARD = 1000000
+# What a Search result card shows; documents augmented before summaries existed get the start of their description
+CARD_FIELDS = {
+    "title": 1, "reward": 1, "due_date": 1, "rolling_deadline": 1, "preferred_ethnicity": 1, "preferred_gender": 1,
+    "is_merit_based": 1, "prefers_lgbt": 1,
+    "summary": {"$ifNull": ["$summary", {"$substrCP": ["$description", 0, SUMMARY_LENGTH]}]},
+}
+# What an expanded card adds
+DETAIL_FIELDS = ["description", "preferred_major", "location", "extra_requirements"]
+TEXT_SCORE = {"$meta": "textScore"}
+
+
+def search_terms(text: str) -> str:
+    """Turn search box input into terms for $text.
+
+    Words are split the way the text index tokenizes them (so "first-generation"
+    is two terms, never a negation); English stopwords and stemming are left to
+    the index, domain stopwords are dropped unless nothing else was typed.
+    """
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    terms = [word for word in words if word not in DOMAIN_STOPWORDS]
+    return " ".join(terms or words)
+
+
+def closing_window(days, today=None) -> tuple:
+    """The due dates closing within `days` days: from midnight UTC today up to, not including, the day after."""
+    start = today_utc() if today is None else today.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start, start + timedelta(days=days + 1)
+
+
+def normalize_filters(search="", ethnicity="All", gender="All", major="", min_reward=0,
+                      max_reward=DEFAULT_MAX_REWARD, flags=(), closing_within=None, today=None) -> tuple:
+    """The sidebar's filters as a hashable tuple for build_query(*filters), equal for inputs that query the same.
+
+    `closing_within` (days) becomes the dates of closing_window, so the tuple
+    changes, and cached results expire, when the day does.
+    """
+    due_window = None if closing_within is None else closing_window(closing_within, today)
+    return (search_terms(search), ethnicity, gender, " ".join(major.split()).lower(), float(min_reward),
+            float(max_reward), tuple(sorted(flags)), due_window)
+
+
+def build_query(search="", ethnicity="All", gender="All", major="", min_reward=0, max_reward=DEFAULT_MAX_REWARD,
+                flags=(), due_window=None) -> dict:
+    """The MongoDB filter for the Search page's sidebar; `flags` are the boolean fields that must be true.
+
+    `due_window` is a (start, end) pair of dates, as from closing_window, that
+    the due date must fall in; it is a range on the due_date indexes.
+    """
+    query = {}
+    terms = search_terms(search)
+    if terms:
+        # Ranked full-text search over title, description and extra_requirements (see indexes.py)
+        query["$text"] = {"$search": terms}
+    if ethnicity != "All":
+        query["preferred_ethnicity"] = ethnicity
+    if gender != "All":
+        query["preferred_gender"] = gender
+    if major:
+        query["preferred_major"] = {"$regex": major, "$options": "i"}
+    for flag in flags:
+        query[flag] = True
+    query["reward"] = {"$gte": min_reward, "$lte": max_reward}
+    if due_window is not None:
+        query["due_date"] = {"$gte": due_window[0], "$lt": due_window[1]}
+    return query
+
+
+def page_queries(query, after=None, descending=False) -> list:
+    """The (filter, sort) pairs that list `query` from just after `after`, in order.
+
+    Pages are keyset-based on (due_date, _id), with `after` the page_key of the
+    last document already shown, so each page is an index range however deep
+    it is. Scholarships without a due date come after the dated ones when
+    ascending and before them when descending. A text search is ordered by
+    relevance instead, and `after` is then the number of results already shown.
+    """
+    if "$text" in query:
+        return [(query, [("score", TEXT_SCORE), ("_id", ASCENDING)])]
+
+    direction = DESCENDING if descending else ASCENDING
+    greater = "$lt" if descending else "$gt"
+    dated = ({"due_date": {"$ne": None}}, [("due_date", direction), ("_id", direction)])
+    undated = ({"due_date": None}, [("_id", direction)])
+    segments = [undated, dated] if descending else [dated, undated]
+    if "due_date" in query:
+        segments = [dated]  # A due date range leaves out the undated ones
+
+    if after is not None:
+        due_date, last_id = after
+        # Skip the segments already listed, and the part of the current one up to `after`
+        segments = segments[segments.index(dated if due_date is not None else undated):]
+        segment, sort = segments[0]
+        if due_date is None:
+            bound = {"_id": {greater: last_id}}
+        else:
+            bound = {"$or": [{"due_date": {greater: due_date}}, {"due_date": due_date, "_id": {greater: last_id}}]}
+        segments[0] = ({"$and": [segment, bound]}, sort)
+
+    return [({"$and": [query, segment]}, sort) for segment, sort in segments]
+
+
+def page_key(doc):
+    """Where a page ending with `doc` stops, for the `after` of the next page."""
+    return doc.get('due_date'), doc['_id']
+
+
+def fetch_page(collection, query, after=None, descending=False, page_size=5, projection=None) -> list:
+    """Up to `page_size` scholarships matching `query`, following the page that ended at `after`.
+
+    `projection` is a find() projection such as CARD_FIELDS (all fields if None).
+    """
+    if "$text" in query:
+        projection = {**(projection or {}), "score": TEXT_SCORE}
+        [(text_query, sort)] = page_queries(query)
+        return list(collection.find(text_query, projection).sort(sort).skip(after or 0).limit(page_size))
+
+    page = []
+    for segment_query, sort in page_queries(query, after, descending):
+        page += collection.find(segment_query, projection).sort(sort).limit(page_size - len(page))
+        if len(page) == page_size:
+            break
+    return page
+
+
+def fetch_by_ids(collection, ids, projection=None) -> list:
+    """The documents with the given _ids, in the same order."""
+    found = {doc["_id"]: doc for doc in collection.find({"_id": {"$in": list(ids)}}, projection)}
+    return [found[_id] for _id in ids if _id in found]
+
+
+def next_page_after(query, page, after=None):
+    """The `after` of the page following `page`."""
+    if "$text" in query:
+        return (after or 0) + len(page)
+    return page_key(page[-1]) if page else after
+
+
+def facet_pipeline(filters, after=None, descending=False, page_size=5, projection=None) -> list:
+    """One aggregation for a page of `filters` (normalize_filters output) and the Search sidebar's counts.
+
+    Each count leaves out its own filter, so it is the number of results
+    picking that option would give: ethnicity and gender are counted without
+    the selected ethnicity or gender, reward buckets without the reward range,
+    and flags within the current results. Only the leading $match can use an
+    index; the page is sorted inside $facet (a top-k sort of page_size).
+    """
+    query = build_query(*filters)
+    # What every facet shares goes first ($text has to); each facet adds the filters it does not count
+    own = {field: query.pop(field) for field in [*FACET_FIELDS, "reward"] if field in query}
+    query["reward"] = {"$type": "number"}
+
+    def without(*fields):
+        return {field: condition for field, condition in own.items() if field not in fields}
+
+    project = [{"$project": projection}] if projection else []
+    if "$text" in query:
+        pages = [[{"$match": without()}, {"$sort": {"score": TEXT_SCORE, "_id": ASCENDING}}, {"$skip": after or 0},
+                  {"$limit": page_size}, *project]]
+    else:
+        pages = [[{"$match": segment_query}, {"$sort": dict(sort)}, {"$limit": page_size}, *project]
+                 for segment_query, sort in page_queries(without(), after, descending)]
+
+    facets = {f"page_{number}": stages for number, stages in enumerate(pages)}
+    facets["total"] = [{"$match": without()}, {"$count": "count"}]
+    for field in FACET_FIELDS:
+        facets[field] = [{"$match": without(field)}, {"$group": {"_id": f"${field}", "count": {"$sum": 1}}}]
+    facets["flags"] = [{"$match": without()}, {"$group": {"_id": None, **{
+        flag: {"$sum": {"$cond": [{"$eq": [f"${flag}", True]}, 1, 0]}} for flag in FLAG_FIELDS}}}]
+    facets["reward"] = [{"$match": without("reward")}, {"$bucket": {
+        "groupBy": "$reward", "boundaries": REWARD_BUCKETS, "default": REWARD_BUCKETS[-1]}}]
+    return [{"$match": query}, {"$facet": facets}]
+
+
+def fetch_facets(collection, filters, after=None, descending=False, page_size=5, projection=None) -> tuple:
+    """The page fetch_page would return for `filters`, and the sidebar's counts, in one round trip.
+
+    Counts are {"total": n, "preferred_ethnicity": {value: n}, "preferred_gender":
+    {value: n}, "flags": {flag: n}, "reward": {lower bound: n}}.
+    """
+    [result] = collection.aggregate(facet_pipeline(filters, after, descending, page_size, projection))
+    page = [doc for name in sorted(name for name in result if name.startswith("page_")) for doc in result[name]]
+    [flags] = result["flags"] or [dict.fromkeys(FLAG_FIELDS, 0)]
+    counts = {
+        "total": result["total"][0]["count"] if result["total"] else 0,
+        **{field: {group["_id"]: group["count"] for group in result[field]} for field in FACET_FIELDS},
+        "flags": {flag: flags[flag] for flag in FLAG_FIELDS},
+        "reward": {**dict.fromkeys(REWARD_BUCKETS, 0), **{bucket["_id"]: bucket["count"] for bucket in result["reward"]}},
+    }
+    return page[:page_size], counts
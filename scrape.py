@@ -1,22 +1,59 @@
+import argparse
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, UnicodeDammit
 from tqdm import tqdm  # Import the tqdm library for the progress bar
-import json
 
-# Step 1: Make requests to the website for multiple pages
-base_url = 'https://scholarships.asu.edu/scholarship-search&page='
-urls = [f'{base_url}{i}' for i in range(0, 8)]  # Generate URLs for pages 0 to 7
+from crawl_cache import CrawlCache, HIT
+from frontier import Frontier
+from jsonl import JsonlWriter, read_records
+from throttle import HostRateLimiter
+
+BASE_URL = 'https://scholarships.asu.edu/scholarship-search&page='
+SCHOLARSHIP_PREFIX = 'https://scholarships.asu.edu/scholarship/'
+OUTPUT_PATH = 'scrape.jsonl'
+
+DEFAULT_CONCURRENCY = 8   # Pages fetched in parallel
+DEFAULT_RATE = 10.0       # Requests per second per host
+DEFAULT_RETRIES = 3
+
+
+def make_session(concurrency=DEFAULT_CONCURRENCY, retries=DEFAULT_RETRIES, backoff=0.5):
+    """Create a session whose connection pool is shared by all fetcher threads.
 
-links = []
+    Failed requests (connection errors, 429 and 5xx responses) are retried with
+    exponential backoff, honouring any Retry-After header sent by the server.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency,
+                          pool_block=True, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
-# Loop through each page URL
-for url in urls:
-    response = requests.get(url)
 
-    # Step 2: Parse the content of the page
-    soup = BeautifulSoup(response.content, 'html.parser')
+def fetch(session, limiter, url, headers=None):
+    limiter.wait(url)
+    return session.get(url, headers=headers, timeout=30)
 
-    # Step 3: Find all the links on the page
+
+def extract_links(content, page_url):
+    soup = BeautifulSoup(content, 'html.parser')
+
+    links = []
+    # Find all the links on the page
     for link in soup.find_all('a', href=True):  # Find all anchor tags with href attribute
         href = link['href']
 
@@ -25,48 +62,271 @@ for url in urls:
             links.append(href)
         else:
             # If the link is relative, convert it to an absolute URL
-            full_url = requests.compat.urljoin(url, href)
-            links.append(full_url)
-
-# Step 4: Only include links with the pattern "https://scholarships.asu.edu/scholarship/" followed by numbers
-filtered_links = [link for link in links if link.startswith('https://scholarships.asu.edu/scholarship/')]
-
-scholarships = []
+            links.append(requests.compat.urljoin(page_url, href))
 
-# Step 5: Extract ID numbers and scrape each filtered link for its HTML description using div parent method
-for link in tqdm(filtered_links, desc="Scraping scholarship pages"):  # Add a progress bar to the loop
-    # Extract the ID number (assumes ID is at the end of the URL after the last '/')
-    id_number = link.split('/')[-1]
+    return links
 
-    scholarship = {
-        "id": id_number
-    }
 
-    # Make a request to the individual scholarship page to get its content
-    response = requests.get(link)
-    scholarship_soup = BeautifulSoup(response.content, 'html.parser')
+def extract_description(content):
+    scholarship_soup = BeautifulSoup(content, 'html.parser')
 
     # Find the h1 element with id "page-title" to locate the relevant div
     h1_element = scholarship_soup.find('h1', id='page-title')
 
-    if h1_element:
-        # Find the parent div of the h1 element (assuming description is within the same div)
-        parent_div = h1_element.find_parent('div')
+    if not h1_element:
+        return "H1 element not found"
+
+    # Find the parent div of the h1 element (assuming description is within the same div)
+    parent_div = h1_element.find_parent('div')
+
+    if not parent_div:
+        return "Parent div not found"
+
+    # Get the text content of the parent div (this should contain the description)
+    return parent_div.get_text(strip=True, separator=' ')
+
+
+# The attributes of a tag, with quoted values skipped whole so a "<" or ">" inside them is not markup
+ATTRIBUTES = r'(?:[^>"\']|"[^"]*"|\'[^\']*\')*'
+# Start and end tags, with their name in group 2 and the "/" of an end tag in group 1; comments, scripts
+# and styles are matched whole (without a name) so that tags inside them or their attribute values are skipped
+TAG_TOKEN = re.compile(rf'<!--.*?-->|<script\b.*?</script\s*>|<style\b.*?</style\s*>'
+                       rf'|<(/?)([a-z][^\s/>]*){ATTRIBUTES}>', re.IGNORECASE | re.DOTALL)
+# Elements html.parser never leaves open
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source',
+                 'track', 'wbr'}
+# An h1 whose id is exactly page-title, as BeautifulSoup's find('h1', id='page-title') would take it
+ATTRIBUTE = r'\s+[^\s=>]+(?:\s*=\s*(?:"[^"]*"|\'[^\']*\'|[^\s"\'>]+))?'
+PAGE_TITLE = re.compile(rf'<h1\b(?:{ATTRIBUTE})*?\s+id\s*=\s*(?:"page-title"|\'page-title\'|page-title(?=[\s/>]))',
+                        re.IGNORECASE)
+
+
+def extract_description_fast(content):
+    """Same result as extract_description, but only parses the div around the page title.
+
+    The enclosing div is located by following the tags in the raw markup, so
+    BeautifulSoup builds a tree for that subtree alone. Pages whose markup
+    cannot be sliced reliably (an end tag that closes elements the slice does
+    not hold, a title that is not in the div found) fall back to parsing the
+    whole document.
+    """
+    markup = UnicodeDammit(content, is_html=True).unicode_markup if isinstance(content, bytes) else content
+
+    title = PAGE_TITLE.search(markup)
+    if not title:
+        return extract_description(markup)
 
-        if parent_div:
-            # Get the text content of the parent div (this should contain the description)
-            description = parent_div.get_text(strip=True, separator=' ')
-            scholarship["description"] = description
+    # Find the innermost div still open where the h1 starts
+    open_divs = []
+    for token in TAG_TOKEN.finditer(markup):
+        if token.start() >= title.start():
+            break
+        if token.end() > title.start():
+            # The h1 is inside a comment, script or attribute value, not markup BeautifulSoup would find
+            return extract_description(markup)
+        if token.group(2) is None or token.group(2).lower() != 'div' or token.group(0).endswith('/>'):
+            continue
+        if token.group(1):
+            if open_divs:
+                open_divs.pop()
         else:
-            scholarship["description"] = "Parent div not found"
-    else:
-        scholarship["description"] = "H1 element not found"
+            open_divs.append(token.start())
+    if not open_divs:
+        return extract_description(markup)
+    root = open_divs[-1]
+
+    # Find the tag that closes it, nesting elements as html.parser does: an end tag closes the latest
+    # element of its name and any still open inside it
+    open_elements = []  # (name, start) of the elements open inside the slice, root first
+    for token in TAG_TOKEN.finditer(markup, root):
+        name = token.group(2)
+        if name is None or token.group(0).endswith('/>'):
+            continue
+        name = name.lower()
+        if token.start() == title.start():
+            innermost_div = next((start for element, start in reversed(open_elements) if element == 'div'), None)
+            if innermost_div != root:
+                return extract_description(markup)
+        if not token.group(1):
+            if name not in VOID_ELEMENTS:
+                open_elements.append((name, token.start()))
+            continue
+        if all(element != name for element, _ in open_elements):
+            # A stray end tag could close elements opened before the slice
+            return extract_description(markup)
+        while open_elements.pop()[0] != name:
+            pass
+        if open_elements:
+            continue
+        if token.end() <= title.end():
+            return extract_description(markup)
+        subtree = BeautifulSoup(markup[root:token.end()], 'html.parser')
+        h1_element = subtree.find('h1', id='page-title')
+        if not h1_element or h1_element.find_parent('div') is not subtree.div:
+            return extract_description(markup)
+        return subtree.div.get_text(strip=True, separator=' ')
+    return extract_description(markup)
+
+
+def fetch_scholarship(session, limiter, link, cache=None):
+    """Fetch a scholarship page, or return None if the server says it is unchanged."""
+    # Ask the server to skip the body if it has not changed since the last crawl
+    headers = cache.conditional_headers(link) if cache else None
+    response = fetch(session, limiter, link, headers)
+
+    if response.status_code == 304:
+        cache.record(link, response)
+        return None
+    return response
+
+
+def crawl(base_url=BASE_URL, prefix=SCHOLARSHIP_PREFIX, max_pages=None, concurrency=DEFAULT_CONCURRENCY,
+          rate=DEFAULT_RATE, parse_workers=0, session=None, progress=True, cache=None, skip_ids=(), failed=None):
+    """Follow the listing pages until no new ones turn up, yielding every scholarship they link to.
+
+    Pages are fetched by `concurrency` threads sharing one connection pool, and
+    no host is sent more than `rate` requests per second. Each scholarship page
+    is fetched once however often it is linked, and IDs in `skip_ids` are not
+    fetched at all. Descriptions are extracted by a pool of `parse_workers`
+    processes, or in this process when it is 0. With a CrawlCache only new and
+    changed scholarships are yielded.
+
+    A page that cannot be fetched once retries run out is reported and skipped,
+    and the crawl goes on; if `failed` is a list, the URL and error of each such
+    page are appended to it. Skipped pages are not cached, so the next crawl
+    fetches them again.
+
+    Scholarships are yielded as soon as they are parsed, in completion order.
+    """
+    session = session or make_session(concurrency)
+    limiter = HostRateLimiter(rate)
+    frontier = Frontier(base_url, prefix, max_pages, skip_ids)
+    frontier.add_listing_page(0)
+    parse_pool = ProcessPoolExecutor(max_workers=parse_workers) if parse_workers else None
+    progress_bar = tqdm(total=0, desc="Scraping scholarship pages", disable=not progress)
+
+    def report_failure(url, error):
+        if failed is not None:
+            failed.append((url, error))
+        progress_bar.write(f"Failed to fetch {url}: {error}")
+
+    def make_record(link, response, description):
+        if cache and cache.record(link, response, description) == HIT:
+            return None
+        return {
+            # The ID number is at the end of the URL after the last '/'
+            "id": link.split('/')[-1],
+            "description": description
+        }
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            # Every in-flight future maps to (link, response); response is None while fetching
+            pending = {}
+            listing_futures = {}
+            in_flight = set()  # The futures of both maps, kept together for wait()
+            listings = frontier.pop_listings()
+
+            while listings or in_flight:
+                # Fetch listing pages, queueing newly found scholarships as they turn up
+                for url in listings:
+                    future = executor.submit(fetch, session, limiter, url)
+                    listing_futures[future] = url
+                    in_flight.add(future)
+                listings = []
+
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in listing_futures:
+                        url = listing_futures.pop(future)
+                        try:
+                            response = future.result()
+                        except requests.RequestException as e:
+                            report_failure(url, e)
+                            continue
+                        frontier.add_links(extract_links(response.content, url))
+                        links = frontier.pop_scholarships()
+                        for link in links:
+                            fetched = executor.submit(fetch_scholarship, session, limiter, link, cache)
+                            pending[fetched] = (link, None)
+                            in_flight.add(fetched)
+                        progress_bar.total += len(links)
+                        progress_bar.refresh()
+                        # The frontier hands out each listing page once, so none popped here may be dropped
+                        listings.extend(frontier.pop_listings())
+                        continue
+
+                    link, response = pending.pop(future)
+                    if response is None:
+                        # A page finished downloading: parse it here or hand it to the parsers
+                        try:
+                            response = future.result()
+                        except requests.RequestException as e:
+                            report_failure(link, e)
+                            progress_bar.update()
+                            continue
+                        if response is None:
+                            progress_bar.update()
+                            continue
+                        if parse_pool:
+                            parsed = parse_pool.submit(extract_description_fast, response.content)
+                            pending[parsed] = (link, response)
+                            in_flight.add(parsed)
+                            continue
+                        description = extract_description_fast(response.content)
+                    else:
+                        description = future.result()
+
+                    progress_bar.update()
+                    record = make_record(link, response, description)
+                    if record is not None:
+                        yield record
+    finally:
+        progress_bar.close()
+        if parse_pool:
+            parse_pool.shutdown()
+
 
-    scholarships.append(scholarship)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=f"Scrape ASU scholarship descriptions into {OUTPUT_PATH}, one JSON record per line, each written "
+                    "as soon as it is parsed. Re-runs only add scholarships that are new or changed since the last "
+                    "crawl, appended after those already in the file.")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help="number of pages fetched in parallel")
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE,
+                        help="maximum requests per second to a single host")
+    parser.add_argument('--parse-workers', type=int, default=os.cpu_count(),
+                        help="processes used to extract descriptions (0 parses in the crawler process)")
+    parser.add_argument('--max-pages', type=int, default=None,
+                        help="stop after this many listing pages (default: follow pagination to the end)")
+    parser.add_argument('--full', action='store_true',
+                        help="ignore the crawl cache and output every scholarship")
+    parser.add_argument('--resume', action='store_true',
+                        help=f"continue an interrupted crawl without fetching the scholarships already in {OUTPUT_PATH}")
+    args = parser.parse_args()
 
-# Print the results
-print(scholarships)
+    # Stream scholarships to scrape.jsonl as they complete (only new and changed ones unless --full).
+    # The file is always appended to: the crawl cache counts what is in it as delivered, so records from a
+    # run that has not been loaded yet must not be dropped. load.py upserts, so a repeated record is harmless.
+    # With --resume, scholarships already in the file are not fetched again.
+    skip_ids = {record["id"] for record in read_records(OUTPUT_PATH)} if args.resume else set()
+    writer = JsonlWriter(OUTPUT_PATH, resume=True)
+    cache = None if args.full else CrawlCache()
+    failed = []
+    try:
+        for scholarship in crawl(max_pages=args.max_pages, concurrency=args.concurrency, rate=args.rate,
+                                 parse_workers=args.parse_workers, cache=cache, skip_ids=skip_ids, failed=failed):
+            writer.write(scholarship)
+    finally:
+        writer.close()
+        if cache:
+            cache.close()
 
-# save to json named scrape.json
-with open('scrape.json', 'w') as f:
-    json.dump(scholarships, f, indent=2)
+    print(f"Appended {writer.get_count()} scholarships to {OUTPUT_PATH}"
+          + (f" ({len(skip_ids)} already there were skipped)" if skip_ids else ""))
+    if failed:
+        print(f"{len(failed)} pages could not be fetched; the next run tries them again")
+    if cache:
+        stats = cache.get_stats()
+        print(f"Crawl cache: {stats['hit']} unchanged, {stats['miss']} new, {stats['changed']} changed")
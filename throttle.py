@@ -0,0 +1,49 @@
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+class RateLimiter:
+    """Spaces calls out so that at most `rate` units of cost start per second.
+
+    Each call reserves `cost` units (1 by default), so the same class limits
+    requests per second or, with a token estimate as the cost, tokens per second.
+    """
+
+    def __init__(self, rate: float):
+        self.__interval = 1.0 / rate if rate else 0.0
+        self.__next_slot = 0.0
+        self.__lock = threading.Lock()
+
+    def wait(self, cost: float = 1) -> None:
+        if not self.__interval:
+            return
+        with self.__lock:
+            now = time.monotonic()
+            slot = max(now, self.__next_slot)
+            self.__next_slot = slot + self.__interval * cost
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class HostRateLimiter:
+    """Keeps a separate RateLimiter for every host that gets requested."""
+
+    def __init__(self, rate: float):
+        self.__rate = rate
+        self.__limiters = {}
+        self.__lock = threading.Lock()
+
+    def wait(self, url: str) -> None:
+        host = urlsplit(url).netloc
+        with self.__lock:
+            limiter = self.__limiters.get(host)
+            if limiter is None:
+                limiter = self.__limiters[host] = RateLimiter(self.__rate)
+        limiter.wait()
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """Exponential backoff with full jitter: a random delay up to base * 2**attempt, capped."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
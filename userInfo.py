@@ -1,6 +1,6 @@
 class UserData:
     def __init__(self, income: float, GPA: float, gender: str, ethnicity: str,
-                 major: str, university: str, location: str):
+                 major: str, university: str, location: str, circumstances: frozenset = frozenset()):
         self.__GPA = GPA
         self.__income = income
         self.__gender = gender
@@ -8,6 +8,8 @@ class UserData:
         self.__major = major
         self.__university = university
         self.__location = location
+        # Eligibility flags of the augmented schema that apply to the student, e.g. "first_generation"
+        self.__circumstances = frozenset(circumstances)
 
     def get_income(self) -> float:
         return self.__income
@@ -29,13 +31,16 @@ class UserData:
 
     def get_location(self) -> str:
         return self.__location
+
+    def get_circumstances(self) -> frozenset:
+        return self.__circumstances
     
     def set_income(self, income: float) -> None:
         if income < 0:
             raise ValueError("Income must be a non-negative value.")
         self.__income = income
 
-    def set_income(self, GPA: float) -> None:
+    def set_gpa(self, GPA: float) -> None:
         if GPA < 0:
             raise ValueError("GPA must be a non-negative value.")
         self.__GPA = GPA
@@ -54,3 +59,23 @@ class UserData:
 
     def set_location(self, location: str) -> None:
         self.__location = location
+
+    def set_circumstances(self, circumstances) -> None:
+        self.__circumstances = frozenset(circumstances)
+
+    def to_dict(self) -> dict:
+        return {
+            "income": self.__income,
+            "GPA": self.__GPA,
+            "gender": self.__gender,
+            "ethnicity": self.__ethnicity,
+            "major": self.__major,
+            "university": self.__university,
+            "location": self.__location,
+            "circumstances": sorted(self.__circumstances),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'UserData':
+        return cls(data["income"], data["GPA"], data["gender"], data["ethnicity"], data["major"],
+                   data["university"], data["location"], data.get("circumstances", ()))